@@ -49,11 +49,13 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'whitenoise.middleware.WhiteNoiseMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
+    'intention_app.profiling.ProfilingMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
@@ -89,6 +91,19 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/2.1/topics/cache/
+# Holds calendar timezones and free/busy information, see intention_app/caching.py.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'intention',
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    }
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/2.1/ref/settings/#auth-password-validators
 
@@ -124,14 +139,14 @@ USE_TZ = True
 
 # Static files (CSS, JavaScript, Images)
 # https://docs.djangoproject.com/en/2.1/howto/static-files/
-STATIC_ROOT = os.path.join('intetion', 'static')
-
-STATICFILES_DIRS = (
-    os.path.join('intention', 'static'),
-)
+# Static files are collected by the build_static management command, which fingerprints and compresses them,
+# and served by WhiteNoise. Fingerprinted files are served with far-future cache headers.
+STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
 
 STATIC_URL = '/static/'
 
+STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
+
 AUTHENTICATION_BACKENDS = (
     "django.contrib.auth.backends.ModelBackend",
     "allauth.account.auth_backends.AuthenticationBackend",
@@ -148,3 +163,25 @@ LOGIN_REDIRECT_URL = 'scheduling_options_view'
 ACCOUNT_SESSION_REMEMBER = True
 
 SOCIALACCOUNT_QUERY_EMAIL = True
+
+# Length in minutes of the slots availability is consolidated into when scheduling. One of 1, 5, or 15.
+SCHEDULING_SLOT_MINUTES = 1
+
+# Threads prefetching user calendars in the background when the scheduling options page is shown. 0 disables.
+PREFETCH_WORKERS = 2
+
+# Requests are profiled into reports in PROFILE_DIR when PROFILE_REQUESTS is set, when staff add ?profile=1 to a url,
+# or at random with probability PROFILE_SAMPLE_RATE. Only the newest PROFILE_MAX_REPORTS reports are kept.
+# See intention_app/profiling.py and the profile_summary management command.
+PROFILE_REQUESTS = os.environ.get('INTENTION_PROFILE_REQUESTS') == '1'
+PROFILE_SAMPLE_RATE = float(os.environ.get('INTENTION_PROFILE_SAMPLE_RATE', 0))
+PROFILE_DIR = os.environ.get('INTENTION_PROFILE_DIR', os.path.join(BASE_DIR, 'profiles'))
+PROFILE_MAX_REPORTS = 200
+
+# OAuth client of the app, as downloaded from the Google API console. Its secret is read from here when needed
+# rather than stored with the credentials of users.
+GOOGLE_CLIENT_SECRETS_FILE = 'client_secret.json'
+
+# Public https url of the calendar_webhook view, to which Google pushes notifications of calendar changes.
+# Calendars are only watched when set. See intention_app/watching.py.
+CALENDAR_WEBHOOK_URL = os.environ.get('INTENTION_CALENDAR_WEBHOOK_URL')
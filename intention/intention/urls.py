@@ -15,18 +15,21 @@ Including another URLconf
 """
 from django.contrib import admin
 from django.urls import path, include
-from intention_app.views import *
+from intention_app import views
 
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('accounts/', include('allauth.urls')),
-    path('', homepage_view, name='homepage'),
-    path('user_preferences', user_preferences_view, name='user_preferences_view'),
-    path('scheduling_options', scheduling_options_view, name='scheduling_options_view'),
-    path('schedule', schedule_view, name='schedule_view'),
-    path('reschedule', reschedule_view, name='reschedule_view'),
-    path('calendar', calendar_view, name='calendar_view'),
-    path('authorize', authorize, name='authorize'),
-    path('oauth2callback', oauth2callback, name='oauth2callback')
+    path('', views.homepage_view, name='homepage'),
+    path('user_preferences', views.user_preferences_view, name='user_preferences_view'),
+    path('scheduling_options', views.scheduling_options_view, name='scheduling_options_view'),
+    path('schedule', views.schedule_view, name='schedule_view'),
+    path('schedule_commit', views.schedule_commit_view, name='schedule_commit_view'),
+    path('reschedule', views.reschedule_view, name='reschedule_view'),
+    path('calendar', views.calendar_view, name='calendar_view'),
+    path('availability', views.availability_view, name='availability_view'),
+    path('calendar_webhook', views.calendar_webhook, name='calendar_webhook'),
+    path('authorize', views.authorize, name='authorize'),
+    path('oauth2callback', views.oauth2callback, name='oauth2callback')
 ]
\ No newline at end of file
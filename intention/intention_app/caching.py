@@ -0,0 +1,105 @@
+"""Module to cache Google calendar data between requests.
+
+Wraps the timezone and free/busy lookups of googleapi_utils with the Django
+cache. Every (user, calendar) pair has a version number that is part of the
+key of each cached entry read from that calendar, so bumping the version
+invalidates all entries for the calendar at once without tracking them.
+Versions are stored in the database as CalendarVersion rows, so that a
+calendar invalidated in one worker process is invalidated in all of them,
+whichever cache backend is configured.
+
+Free/busy information is read for whole utc days around the requested
+range so that nearby queries share entries, from the database snapshot of
+the calendars on a miss, and is cached as an array of (start, end) utc
+epoch seconds. Event listings are cached briefly, ie once prefetched for the
+reschedule page, and are read from Google on a miss.
+
+Exported Functions
+------------------
+get_localtz(credentials, user_id, calendar_id='primary')
+get_busy_array(credentials, user_id, time_min, time_max, calendars=['primary'])
+make_events_getter(user_id)
+invalidate_calendars(user_id, calendars)
+"""
+
+from datetime import timedelta
+from hashlib import sha256
+
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from pytz import timezone
+
+from intention_app.models import CalendarVersion
+from intention_app.scheduling.utils import googleapi_utils
+from intention_app.snapshots import make_freebusy_getter
+from intention_app.scheduling.utils.datetime_utils import utc
+from intention_app.scheduling.utils.scheduling_utils import make_busy_array
+
+TIMEZONE_CACHE_SECONDS = 24 * 60 * 60
+FREEBUSY_CACHE_SECONDS = 5 * 60
+EVENTS_CACHE_SECONDS = 2 * 60
+
+
+def get_localtz(credentials, user_id, calendar_id='primary'):
+    """Returns timezone associated with user calendar."""
+    key = 'timezone:%s:%s' % (user_id, _hash([calendar_id, _get_versions(user_id, [calendar_id])]))
+    timezone_name = cache.get(key)
+    if timezone_name is None:
+        timezone_name = googleapi_utils.get_localtz(credentials, calendar_id).zone
+        cache.set(key, timezone_name, TIMEZONE_CACHE_SECONDS)
+    return timezone(timezone_name)
+
+
+def get_busy_array(credentials, user_id, time_min, time_max, calendars=['primary']):
+    """Returns busy times of user calendars overlapping range provided as array of (start, end) utc epoch seconds."""
+    day_min = time_min.astimezone(utc).replace(hour=0, minute=0, second=0, microsecond=0)
+    day_max = time_max.astimezone(utc).replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1)
+    key = 'freebusy:%s:%s' % (user_id, _hash([calendars, _get_versions(user_id, calendars),
+                                              day_min.isoformat(), day_max.isoformat()]))
+    busy_array = cache.get(key)
+    if busy_array is None:
+        freebusy_ranges = make_freebusy_getter(user_id)(credentials, day_min, day_max, calendars)
+        busy_array = make_busy_array(freebusy_ranges)
+        cache.set(key, busy_array, FREEBUSY_CACHE_SECONDS)
+    overlapping = (busy_array[:, 0] < time_max.timestamp()) & (busy_array[:, 1] > time_min.timestamp())
+    return busy_array[overlapping]
+
+
+def make_events_getter(user_id):
+    """Returns function with the signature of googleapi_utils.iter_events_in_range served from the cache."""
+    def get_events(credentials, timeMin, timeMax, calendars=['primary'], profile=googleapi_utils.MINIMAL):
+        key = 'events:%s:%s' % (user_id, _hash([calendars, _get_versions(user_id, calendars), timeMin.isoformat(),
+                                                timeMax.isoformat(), profile]))
+        events = cache.get(key)
+        if events is None:
+            events = list(googleapi_utils.iter_events_in_range(credentials, timeMin, timeMax, calendars, profile))
+            cache.set(key, events, EVENTS_CACHE_SECONDS)
+        return events
+    return get_events
+
+
+def invalidate_calendars(user_id, calendars):
+    """Invalidates all cached entries read from the user calendars provided, in every process."""
+    calendars = set(calendars)
+    versions = CalendarVersion.objects.filter(user_id=user_id, calendar_id__in=calendars)
+    if versions.update(version=F('version') + 1) == len(calendars): return
+    missing = calendars - set(versions.values_list('calendar_id', flat=True))
+    try:
+        with transaction.atomic():
+            CalendarVersion.objects.bulk_create([CalendarVersion(user_id=user_id, calendar_id=calendar_id, version=2)
+                                                 for calendar_id in missing])
+    except IntegrityError: # Created concurrently, after the update.
+        versions.filter(calendar_id__in=missing).update(version=F('version') + 1)
+
+
+def _get_versions(user_id, calendars):
+    """Returns list of current versions of the user calendars provided."""
+    versions = dict(CalendarVersion.objects.filter(user_id=user_id, calendar_id__in=calendars)
+                    .values_list('calendar_id', 'version'))
+    return [versions.get(calendar_id, 1) for calendar_id in calendars]
+
+
+def _hash(value):
+    """Returns short digest of value, for use in cache keys of bounded length."""
+    return sha256(repr(value).encode()).hexdigest()[:32]
@@ -0,0 +1,87 @@
+"""Module to keep the Google credentials of users for work outside of a request.
+
+Watch channels are renewed by a management command, long after the session
+that opened them. Credentials are kept once per user as StoredCredentials,
+rather than with every channel, and only what is needed to get a new access
+token is kept: the refresh token, encrypted with a key derived from
+SECRET_KEY, and the id of the OAuth client. Access tokens are not kept, and
+the client secret is read from GOOGLE_CLIENT_SECRETS_FILE when credentials
+are loaded.
+
+Exported Functions
+------------------
+store_credentials(user_id, credentials_dict)
+load_credentials(user_id)
+forget_credentials(user_id)
+encrypt_token(token)
+decrypt_token(encrypted_token)
+"""
+
+import base64
+import hmac
+import json
+from hashlib import sha256
+
+from cryptography.fernet import Fernet, InvalidToken
+from django.conf import settings
+from google.oauth2.credentials import Credentials
+
+from intention_app.models import StoredCredentials
+
+# Salt of the key refresh tokens are encrypted with, derived from SECRET_KEY.
+KEY_SALT = b'intention_app.credentials'
+
+
+def store_credentials(user_id, credentials_dict):
+    """Keeps credentials of user, as stored in the session, replacing those kept before."""
+    StoredCredentials.objects.update_or_create(user_id=user_id, defaults={
+        'client_id': credentials_dict['client_id'],
+        'token_uri': credentials_dict['token_uri'],
+        'scopes': json.dumps(credentials_dict.get('scopes') or []),
+        'refresh_token': encrypt_token(credentials_dict['refresh_token']),
+    })
+
+
+def load_credentials(user_id):
+    """Returns credentials kept for user, without an access token, or None if none are kept or can be read."""
+    stored = StoredCredentials.objects.filter(user_id=user_id).first()
+    if stored is None: return None
+    try:
+        refresh_token = decrypt_token(stored.refresh_token)
+    except InvalidToken: # Encrypted under a previous SECRET_KEY.
+        return None
+    return Credentials(None, refresh_token=refresh_token, token_uri=stored.token_uri, client_id=stored.client_id,
+                       client_secret=_get_client_secret(stored.client_id), scopes=json.loads(stored.scopes))
+
+
+def forget_credentials(user_id):
+    """Discards credentials kept for user."""
+    StoredCredentials.objects.filter(user_id=user_id).delete()
+
+
+def encrypt_token(token):
+    """Returns token encrypted and authenticated, as text."""
+    return _get_fernet().encrypt(token.encode()).decode()
+
+
+def decrypt_token(encrypted_token):
+    """Returns token encrypted with encrypt_token. Raises InvalidToken if encrypted under another key."""
+    return _get_fernet().decrypt(encrypted_token.encode()).decode()
+
+
+def _get_fernet():
+    """Returns cipher keyed by SECRET_KEY."""
+    key = hmac.new(settings.SECRET_KEY.encode(), KEY_SALT, sha256).digest()
+    return Fernet(base64.urlsafe_b64encode(key))
+
+
+def _get_client_secret(client_id):
+    """Returns secret of the OAuth client of the app with client id provided, or None if not configured."""
+    try:
+        with open(settings.GOOGLE_CLIENT_SECRETS_FILE) as secrets_file:
+            clients = json.load(secrets_file)
+    except (OSError, ValueError):
+        return None
+    for client in clients.values():
+        if client.get('client_id') == client_id: return client.get('client_secret')
+    return None
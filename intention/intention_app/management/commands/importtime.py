@@ -0,0 +1,61 @@
+"""Management command to measure the import time of the app on startup.
+
+Imports the URL configuration in a fresh interpreter under python -X importtime
+and reports total import time and the slowest modules. Fails if startup is
+slower than --max-ms or loads any of the modules meant to load lazily, so
+that cold start regressions are caught.
+
+Usage: python manage.py importtime [--module intention.urls] [--top 15] [--max-ms 500] [--forbid numpy ...]
+"""
+
+import os
+import re
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# Modules that must only be imported on first use, not on startup.
+LAZY_MODULES = ['numpy', 'googleapiclient', 'google_auth_oauthlib', 'intention_app.scheduling.scheduler',
+                'intention_app.scheduling.rescheduler']
+
+IMPORTTIME_LINE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)$')
+
+
+class Command(BaseCommand):
+    help = 'Measures import time of the app on startup with python -X importtime.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--module', default=settings.ROOT_URLCONF, help='module to import after django setup')
+        parser.add_argument('--top', type=int, default=15, help='number of slowest modules to list')
+        parser.add_argument('--max-ms', type=float, help='fail if total import time exceeds this many milliseconds')
+        parser.add_argument('--forbid', nargs='*', default=LAZY_MODULES, help='fail if any of these modules load')
+
+    def handle(self, *args, **options):
+        imports = _measure_imports(options['module'])
+        total_ms = sum(self_us for module, self_us, cumulative_us in imports) / 1000
+        self.stdout.write('Total import time: %.1f ms (%d modules)' % (total_ms, len(imports)))
+        self.stdout.write('Slowest modules (cumulative ms, self ms):')
+        for module, self_us, cumulative_us in sorted(imports, key=lambda x : -x[2])[:options['top']]:
+            self.stdout.write('  %8.1f %8.1f  %s' % (cumulative_us / 1000, self_us / 1000, module))
+
+        loaded = set(module for module, self_us, cumulative_us in imports)
+        forbidden = [module for module in options['forbid'] if module in loaded]
+        if forbidden: raise CommandError('Modules loaded on startup that should load lazily: %s' % ', '.join(forbidden))
+        if options['max_ms'] is not None and total_ms > options['max_ms']:
+            raise CommandError('Import time %.1f ms exceeds limit of %.1f ms' % (total_ms, options['max_ms']))
+
+
+def _measure_imports(module):
+    """Returns list of (module, self microseconds, cumulative microseconds) of imports on startup."""
+    env = dict(os.environ, DJANGO_SETTINGS_MODULE=os.environ.get('DJANGO_SETTINGS_MODULE', 'intention.settings'))
+    code = 'import django; django.setup(); import %s' % module
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], env=env, cwd=settings.BASE_DIR,
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    if result.returncode != 0: raise CommandError('Failed to import %s:\n%s' % (module, result.stderr[-2000:]))
+    imports = []
+    for line in result.stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if match: imports.append((match.group(4), int(match.group(1)), int(match.group(2))))
+    return imports
@@ -0,0 +1,242 @@
+"""Management command to measure throughput and tail latency of the scheduling views under concurrency.
+
+Creates --users synthetic users in a throwaway test database and runs each
+one on its own thread, logged in with its own test client, firing a
+weighted --mix of requests at schedule_view and reschedule_view. Google
+calendar API requests are answered in process by the fake API of
+intention_app.testing, with a fake account per user, each request taking
+--latency-ms as if made over the network.
+
+Reports throughput, latency percentiles per operation, API requests made,
+and database queries. On SQLite, the test database is a file rather than in
+memory so that threads contend for its lock as workers would, and writes
+slower than --lock-wait-ms are reported as waits on the lock.
+
+Usage: python manage.py loadtest [--users 8] [--requests 25] [--latency-ms 50] [--calendars 4] [--lock-wait-ms 10]
+                                 [--mix schedule_get=1,schedule_post=2,schedule_preview=1,reschedule_get=1,...]
+                                 [--seed 0]
+"""
+
+import math
+import os
+import random
+import tempfile
+import time
+from collections import Counter, defaultdict
+from threading import Lock, Thread
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, OperationalError
+from django.test import Client, override_settings
+from django.test.utils import setup_databases, setup_test_environment, teardown_databases, \
+    teardown_test_environment
+from django.urls import reverse
+
+from intention_app.models import PERIOD_CHOICES, STARTDATE_CHOICES, TIMERANGE_CHOICES
+from intention_app.testing import BUILD, fake_google_api, FakeCalendarBackend, make_credentials_dict
+
+DEFAULT_MIX = 'schedule_get=1,schedule_post=2,schedule_preview=1,reschedule_get=1,reschedule_post=1'
+WRITE_STATEMENTS = ('INSERT', 'UPDATE', 'DELETE', 'REPLACE')
+PERCENTILES = [50, 95, 99]
+
+
+class Command(BaseCommand):
+    help = 'Load tests schedule_view and reschedule_view with concurrent synthetic users against a fake calendar API.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=8, help='number of concurrent synthetic users')
+        parser.add_argument('--requests', type=int, default=25, help='number of requests made by each user')
+        parser.add_argument('--latency-ms', type=float, default=50, help='latency of each calendar API request')
+        parser.add_argument('--calendars', type=int, default=4, help='number of calendars of each user')
+        parser.add_argument('--mix', default=DEFAULT_MIX, help='weights of operations, as name=weight,...')
+        parser.add_argument('--lock-wait-ms', type=float, default=10,
+                            help='writes slower than this are counted as waits on the SQLite database lock')
+        parser.add_argument('--seed', type=int, default=0, help='seed of the random forms and operation mix')
+
+    def handle(self, *args, **options):
+        mix = _parse_mix(options['mix'])
+        sqlite = connection.vendor == 'sqlite'
+        test_db_dir = tempfile.mkdtemp(prefix='intention-loadtest-') if sqlite else None
+        if sqlite: connection.settings_dict['TEST']['NAME'] = os.path.join(test_db_dir, 'loadtest.sqlite3')
+        setup_test_environment()
+        old_config = setup_databases(verbosity=0, interactive=False)
+        try:
+            with override_settings(PREFETCH_WORKERS=0, PROFILE_REQUESTS=False, PROFILE_SAMPLE_RATE=0,
+                                   STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage'):
+                stats, api, elapsed = _run(options, mix)
+        finally:
+            connection.close()
+            teardown_databases(old_config, verbosity=0)
+            teardown_test_environment()
+            if test_db_dir: os.rmdir(test_db_dir)
+        self._report(options, stats, api, elapsed, sqlite)
+
+    def _report(self, options, stats, api, elapsed, sqlite):
+        latencies = stats['latencies']
+        requests = sum(len(values) for values in latencies.values())
+        self.stdout.write('%d users x %d requests, %.0f ms API latency: %d requests in %.2f s, %.1f requests/s' % (
+            options['users'], options['requests'], options['latency_ms'], requests, elapsed, requests / elapsed))
+        self.stdout.write('%-18s %7s %7s %9s %9s %9s %9s' % ('operation', 'count', 'errors', 'p50 ms', 'p95 ms',
+                                                           'p99 ms', 'max ms'))
+        for operation, values in sorted(latencies.items()):
+            values = sorted(values)
+            self.stdout.write('%-18s %7d %7d %9.1f %9.1f %9.1f %9.1f' % (
+                (operation, len(values), stats['errors'][operation]) +
+                tuple(_percentile(values, percent) for percent in PERCENTILES) + (values[-1],)))
+        for operation, error in sorted(stats['first_errors'].items()):
+            self.stdout.write('First error of %s: %s' % (operation, error))
+        if stats['skipped']:
+            self.stdout.write('Skipped: %s' % ', '.join('%s %d' % item for item in sorted(stats['skipped'].items())))
+
+        api_requests = sum(count for name, count in api.items() if name != BUILD)
+        self.stdout.write('API requests: %d (%.1f per request), services built: %d' % (
+            api_requests, api_requests / max(requests, 1), api[BUILD]))
+        for name, count in sorted(api.items()):
+            if name != BUILD: self.stdout.write('  %-16s %7d' % (name, count))
+
+        db = stats['db']
+        self.stdout.write('Database: %d queries (%.1f per request), %.1f ms total, %d writes, %.1f ms writing' % (
+            db['queries'], db['queries'] / max(requests, 1), db['time'] * 1000, db['writes'], db['write_time'] * 1000))
+        if sqlite:
+            self.stdout.write('SQLite lock waits: %d writes over %.0f ms, %.1f ms waiting, %d "database is locked" errors'
+                              % (db['lock_waits'], options['lock_wait_ms'], db['lock_wait_time'] * 1000, db['locked']))
+
+
+def _run(options, mix):
+    """Runs the load test. Returns (stats, Counter of API requests, seconds elapsed)."""
+    backends, clients = {}, []
+    calendars = ['primary'] + ['calendar%d' % index for index in range(1, options['calendars'])]
+    for index in range(options['users']):
+        user = User.objects.create(username='loadtest%d' % index, email='loadtest%d@example.com' % index)
+        user.preferences.set_calendars(calendars)
+        user.preferences.save()
+        credentials_dict = dict(make_credentials_dict(), token='loadtest%d' % index)
+        backends[credentials_dict['token']] = FakeCalendarBackend(calendars)
+        client = Client()
+        client.force_login(user)
+        session = client.session
+        session['credentials'] = credentials_dict
+        session.save()
+        clients.append(client)
+    connection.close()
+
+    stats = {'latencies': defaultdict(list), 'errors': Counter(), 'skipped': Counter(), 'db': Counter(),
+             'first_errors': {}}
+    stats_lock = Lock()
+    operations, weights = zip(*mix)
+    with fake_google_api(lambda credentials : backends[credentials.token], options['latency_ms'] / 1000) as api:
+        threads = [Thread(target=_run_user, args=(client, random.Random(options['seed'] + index), operations,
+                                                  weights, options, stats, stats_lock))
+                   for index, client in enumerate(clients)]
+        start = time.perf_counter()
+        for thread in threads: thread.start()
+        for thread in threads: thread.join()
+        elapsed = time.perf_counter() - start
+    return stats, api, elapsed
+
+
+def _run_user(client, rng, operations, weights, options, stats, stats_lock):
+    """Makes the requests of one synthetic user, recording their latencies and database queries into stats."""
+    db, latencies, errors, skipped, first_errors = Counter(), defaultdict(list), Counter(), Counter(), {}
+    lock_wait = options['lock_wait_ms'] / 1000
+
+    def record_query(execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        except OperationalError as error:
+            if 'locked' in str(error): db['locked'] += 1
+            raise
+        finally:
+            duration = time.perf_counter() - start
+            db['queries'] += 1
+            db['time'] += duration
+            if sql.lstrip().upper().startswith(WRITE_STATEMENTS):
+                db['writes'] += 1
+                db['write_time'] += duration
+                if duration > lock_wait:
+                    db['lock_waits'] += 1
+                    db['lock_wait_time'] += duration
+
+    try:
+        with connection.execute_wrapper(record_query):
+            for index in range(options['requests']):
+                operation = rng.choices(operations, weights)[0]
+                start = time.perf_counter()
+                try:
+                    response = OPERATIONS[operation](client, rng)
+                except Exception as error: # Raised by the view.
+                    if operation not in first_errors: first_errors[operation] = repr(error)
+                    response = False
+                duration = time.perf_counter() - start
+                if response is None:
+                    skipped[operation] += 1
+                    continue
+                latencies[operation].append(duration * 1000)
+                if response is False or response.status_code >= 400: errors[operation] += 1
+    finally:
+        connection.close()
+    with stats_lock:
+        stats['db'].update(db)
+        stats['errors'].update(errors)
+        stats['skipped'].update(skipped)
+        for operation, error in first_errors.items(): stats['first_errors'].setdefault(operation, error)
+        for operation, values in latencies.items(): stats['latencies'][operation] += values
+
+
+def _schedule_get(client, rng):
+    return client.get(reverse('schedule_view'))
+
+
+def _schedule_post(client, rng, preview=False):
+    form = {'name': 'load test', 'frequency': str(rng.randint(1, 7)), 'period': rng.choice(PERIOD_CHOICES)[0],
+            'hours': '1', 'minutes': '0', 'timerange': rng.choice(TIMERANGE_CHOICES)[0],
+            'startdate': rng.choice(STARTDATE_CHOICES)[0]}
+    if preview: form['preview'] = '1'
+    return client.post(reverse('schedule_view'), form)
+
+
+def _schedule_preview(client, rng):
+    return _schedule_post(client, rng, preview=True)
+
+
+def _reschedule_get(client, rng):
+    return client.get(reverse('reschedule_view'))
+
+
+def _reschedule_post(client, rng):
+    """Reschedules up to 3 of the events listed by the last reschedule_get, or returns None if there are none."""
+    event_ids = list(client.session.get('event_map', {}))
+    if not event_ids: return None
+    selected = rng.sample(event_ids, min(3, len(event_ids)))
+    return client.post(reverse('reschedule_view'), {'mydata': ','.join(selected), 'schedule': 'TOMORROW'})
+
+
+OPERATIONS = {
+    'schedule_get': _schedule_get,
+    'schedule_post': _schedule_post,
+    'schedule_preview': _schedule_preview,
+    'reschedule_get': _reschedule_get,
+    'reschedule_post': _reschedule_post,
+}
+
+
+def _parse_mix(mix):
+    """Returns list of (operation, weight) of mix given as name=weight,..."""
+    parsed = []
+    for item in mix.split(','):
+        name, _, weight = item.partition('=')
+        if name.strip() not in OPERATIONS:
+            raise CommandError('Unknown operation %s, expected one of %s' % (name, ', '.join(sorted(OPERATIONS))))
+        try:
+            parsed.append((name.strip(), float(weight or 1)))
+        except ValueError:
+            raise CommandError('Invalid weight of %s: %s' % (name, weight))
+    if not any(weight > 0 for name, weight in parsed): raise CommandError('Mix has no operation of positive weight')
+    return parsed
+
+
+def _percentile(values, percent):
+    """Returns nearest-rank percentile of sorted values."""
+    return values[max(math.ceil(percent / 100 * len(values)) - 1, 0)]
@@ -0,0 +1,87 @@
+"""Management command to summarize the request profiles collected by ProfilingMiddleware.
+
+Lists the reports in PROFILE_DIR per view, with their durations and peak
+memory, then merges their stats and lists the functions hottest across all
+of them, with the number of reports each function appears in. Reports may
+be narrowed to a view, a user hash, or a scheduling period.
+
+Usage: python manage.py profile_summary [--dir PROFILE_DIR] [--view schedule_view] [--user HASH] [--period WEEK]
+                                        [--sort tottime] [--top 25]
+"""
+
+import os
+import pstats
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from intention_app.profiling import read_reports
+
+SORT_KEYS = {'tottime': 2, 'cumtime': 3, 'ncalls': 1}
+
+
+class Command(BaseCommand):
+    help = 'Summarizes the hot functions of requests profiled by ProfilingMiddleware.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dir', default=settings.PROFILE_DIR, help='directory of profile reports')
+        parser.add_argument('--view', help='only summarize reports of this view')
+        parser.add_argument('--user', help='only summarize reports of this user hash')
+        parser.add_argument('--period', help='only summarize reports scheduling this period, ie WEEK')
+        parser.add_argument('--sort', choices=sorted(SORT_KEYS), default='tottime', help='order of hot functions')
+        parser.add_argument('--top', type=int, default=25, help='number of hot functions to list')
+
+    def handle(self, *args, **options):
+        reports = [(stats_path, tags) for stats_path, tags in read_reports(options['dir'])
+                   if all(options[name] is None or tags.get(name) == options[name]
+                          for name in ('view', 'user', 'period'))]
+        if not reports: raise CommandError('No matching profile reports in %s' % options['dir'])
+
+        self.stdout.write('%d reports in %s' % (len(reports), options['dir']))
+        self.stdout.write('%-28s %7s %12s %12s %14s' % ('view', 'reports', 'median ms', 'max ms', 'max peak kB'))
+        by_view = defaultdict(list)
+        for stats_path, tags in reports: by_view[tags['view']].append(tags)
+        for view, view_tags in sorted(by_view.items(), key=lambda x : str(x[0])):
+            durations = sorted(tags['duration_ms'] for tags in view_tags)
+            # Peaks are not measured under memory traced by others before Python 3.9.
+            peaks = [tags['peak_memory_kb'] for tags in view_tags if tags['peak_memory_kb'] is not None]
+            self.stdout.write('%-28s %7d %12.1f %12.1f %14s' % (
+                view, len(view_tags), durations[len(durations) // 2], durations[-1],
+                '%.1f' % max(peaks) if peaks else '-'))
+        slowest = max(reports, key=lambda x : x[1]['duration_ms'])[1]
+        self.stdout.write('Slowest: %s %.1f ms, user %s, period %s, frequency %s, %s calendars' % (
+            slowest['view'], slowest['duration_ms'], slowest['user'], slowest['period'], slowest['frequency'],
+            slowest['calendars']))
+
+        functions, appearances = _merge_stats([stats_path for stats_path, tags in reports])
+        self.stdout.write('\nHot functions by %s (ms summed over reports):' % options['sort'])
+        self.stdout.write('%10s %10s %10s %8s  %s' % ('ncalls', 'tottime', 'cumtime', 'reports', 'function'))
+        index = SORT_KEYS[options['sort']]
+        for function, totals in sorted(functions.items(), key=lambda x : -x[1][index])[:options['top']]:
+            self.stdout.write('%10d %10.1f %10.1f %8d  %s' % (totals[1], totals[2] * 1000, totals[3] * 1000,
+                                                             appearances[function], _format_function(function)))
+
+
+def _merge_stats(stats_paths):
+    """Returns dict of function to [primitive calls, calls, total time, cumulative time] summed over stats files,
+    and Counter of the number of files each function appears in."""
+    functions, appearances = defaultdict(lambda : [0, 0, 0.0, 0.0]), Counter()
+    for stats_path in stats_paths:
+        for function, (primitive_calls, calls, total_time, cumulative_time, callers) in \
+                pstats.Stats(stats_path).stats.items():
+            totals = functions[function]
+            totals[0] += primitive_calls
+            totals[1] += calls
+            totals[2] += total_time
+            totals[3] += cumulative_time
+            appearances[function] += 1
+    return functions, appearances
+
+
+def _format_function(function):
+    """Returns function (filename, line, name) of pstats as name (file:line), with the file relative to the project."""
+    filename, line, name = function
+    if filename == '~': return name # Builtin.
+    if filename.startswith(settings.BASE_DIR): filename = os.path.relpath(filename, settings.BASE_DIR)
+    return '%s (%s:%d)' % (name, filename, line)
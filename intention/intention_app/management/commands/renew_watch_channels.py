@@ -0,0 +1,27 @@
+"""Management command to renew calendar watch channels before they expire.
+
+Meant to be run periodically, ie daily from cron, so that channels are
+replaced before Google stops sending their notifications.
+
+Usage: python manage.py renew_watch_channels [--hours 24]
+"""
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from intention_app.watching import renew_channels, RENEW_BEFORE
+
+
+class Command(BaseCommand):
+    help = 'Renews calendar watch channels expiring soon.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hours', type=float, default=RENEW_BEFORE.total_seconds() / 3600,
+                            help='renew channels expiring within this many hours')
+
+    def handle(self, *args, **options):
+        if not settings.CALENDAR_WEBHOOK_URL: raise CommandError('CALENDAR_WEBHOOK_URL is not set.')
+        renewed = renew_channels(settings.CALENDAR_WEBHOOK_URL, timedelta(hours=options['hours']))
+        self.stdout.write('Renewed %d watch channels.' % renewed)
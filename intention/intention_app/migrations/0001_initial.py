@@ -0,0 +1,87 @@
+# Generated by Django 2.1.5 on 2026-10-19 08:06
+
+import datetime
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Schedule',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(default='habit name', max_length=200)),
+                ('frequency', models.IntegerField(choices=[(1, 1), (2, 2), (3, 3), (4, 4), (5, 5), (6, 6), (7, 7)], default=1)),
+                ('period', models.CharField(choices=[('DAY', 'day'), ('WEEK', 'week'), ('MONTH', 'month')], default='WEEK', max_length=200)),
+                ('hours', models.IntegerField(choices=[(0, 0), (1, 1), (2, 2), (3, 3), (4, 4), (5, 5), (6, 6), (7, 7), (8, 8), (9, 9), (10, 10), (11, 11), (12, 12)], default=1)),
+                ('minutes', models.IntegerField(choices=[(0, 0), (1, 1), (2, 2), (3, 3), (4, 4), (5, 5), (6, 6), (7, 7), (8, 8), (9, 9), (10, 10), (11, 11), (12, 12), (13, 13), (14, 14), (15, 15), (16, 16), (17, 17), (18, 18), (19, 19), (20, 20), (21, 21), (22, 22), (23, 23), (24, 24), (25, 25), (26, 26), (27, 27), (28, 28), (29, 29), (30, 30), (31, 31), (32, 32), (33, 33), (34, 34), (35, 35), (36, 36), (37, 37), (38, 38), (39, 39), (40, 40), (41, 41), (42, 42), (43, 43), (44, 44), (45, 45), (46, 46), (47, 47), (48, 48), (49, 49), (50, 50), (51, 51), (52, 52), (53, 53), (54, 54), (55, 55), (56, 56), (57, 57), (58, 58), (59, 59), (60, 60)], default=0)),
+                ('timerange', models.CharField(choices=[('ANYTIME', 'anytime'), ('MORNING', 'morning'), ('AFTERNOON', 'afternoon'), ('EVENING', 'evening')], default='ANYTIME', max_length=200)),
+                ('startdate', models.CharField(choices=[('TODAY', 'today'), ('TOMORROW', 'tomorrow'), ('NEXT_WEEK', 'next week')], default='TOMORROW', max_length=200)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Time',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('wake_up_time', models.CharField(choices=[('0:00', '12:00am'), ('0:30', '12:30am'), ('1:00', '1:00am'), ('1:30', '1:30am'), ('2:00', '2:00am'), ('2:30', '2:30am'), ('3:00', '3:00am'), ('3:30', '3:30am'), ('4:00', '4:00am'), ('4:30', '4:30am'), ('5:00', '5:00am'), ('5:30', '5:30am'), ('6:00', '6:00am'), ('6:30', '6:30am'), ('7:00', '7:00am'), ('7:30', '7:30am'), ('8:00', '8:00am'), ('8:30', '8:30am'), ('9:00', '9:00am'), ('9:30', '9:30am'), ('10:00', '10:00am'), ('10:30', '10:30am'), ('11:00', '11:00am'), ('11:30', '11:30am'), ('24:00', '12:00pm'), ('24:30', '12:30pm'), ('13:00', '1:00pm'), ('13:30', '1:30pm'), ('14:00', '2:00pm'), ('14:30', '2:30pm'), ('15:00', '3:00pm'), ('15:30', '3:30pm'), ('16:00', '4:00pm'), ('16:30', '4:30pm'), ('17:00', '5:00pm'), ('17:30', '5:30pm'), ('18:00', '6:00pm'), ('18:30', '6:30pm'), ('19:00', '7:00pm'), ('19:30', '7:30pm'), ('20:00', '8:00pm'), ('20:30', '8:30pm'), ('21:00', '9:00pm'), ('21:30', '9:30pm'), ('22:00', '10:00pm'), ('22:30', '10:30pm'), ('23:00', '11:00pm'), ('23:30', '11:30pm')], default=8, max_length=10)),
+                ('sleep_time', models.CharField(choices=[('0:00', '12:00am'), ('0:30', '12:30am'), ('1:00', '1:00am'), ('1:30', '1:30am'), ('2:00', '2:00am'), ('2:30', '2:30am'), ('3:00', '3:00am'), ('3:30', '3:30am'), ('4:00', '4:00am'), ('4:30', '4:30am'), ('5:00', '5:00am'), ('5:30', '5:30am'), ('6:00', '6:00am'), ('6:30', '6:30am'), ('7:00', '7:00am'), ('7:30', '7:30am'), ('8:00', '8:00am'), ('8:30', '8:30am'), ('9:00', '9:00am'), ('9:30', '9:30am'), ('10:00', '10:00am'), ('10:30', '10:30am'), ('11:00', '11:00am'), ('11:30', '11:30am'), ('24:00', '12:00pm'), ('24:30', '12:30pm'), ('13:00', '1:00pm'), ('13:30', '1:30pm'), ('14:00', '2:00pm'), ('14:30', '2:30pm'), ('15:00', '3:00pm'), ('15:30', '3:30pm'), ('16:00', '4:00pm'), ('16:30', '4:30pm'), ('17:00', '5:00pm'), ('17:30', '5:30pm'), ('18:00', '6:00pm'), ('18:30', '6:30pm'), ('19:00', '7:00pm'), ('19:30', '7:30pm'), ('20:00', '8:00pm'), ('20:30', '8:30pm'), ('21:00', '9:00pm'), ('21:30', '9:30pm'), ('22:00', '10:00pm'), ('22:30', '10:30pm'), ('23:00', '11:00pm'), ('23:30', '11:30pm')], default=23, max_length=10)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Preferences',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('calendar_id', models.CharField(default='primary', max_length=200)),
+                ('calendars', models.TextField(default='["primary"]')),
+                ('day_start_time', models.TimeField(default=datetime.time(8, 0))),
+                ('day_end_time', models.TimeField(default=datetime.time(0, 0))),
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='BusyInterval',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('calendar_id', models.CharField(max_length=200)),
+                ('source', models.CharField(choices=[('FREEBUSY', 'free/busy'), ('EVENTS', 'events')], default='FREEBUSY', max_length=10)),
+                ('event_id', models.CharField(blank=True, default='', max_length=200)),
+                ('start_utc', models.DateTimeField()),
+                ('end_utc', models.DateTimeField()),
+                ('fetched_at', models.DateTimeField()),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='busy_intervals', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='BusyCoverage',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('calendar_id', models.CharField(max_length=200)),
+                ('source', models.CharField(choices=[('FREEBUSY', 'free/busy'), ('EVENTS', 'events')], default='FREEBUSY', max_length=10)),
+                ('start_utc', models.DateTimeField()),
+                ('end_utc', models.DateTimeField()),
+                ('fetched_at', models.DateTimeField()),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='busy_coverage', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='busyinterval',
+            index=models.Index(fields=['user', 'calendar_id', 'source', 'start_utc'], name='intention_a_user_id_957cd2_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='busyinterval',
+            index=models.Index(fields=['user', 'calendar_id', 'source', 'end_utc'], name='intention_a_user_id_700fb6_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='busycoverage',
+            index=models.Index(fields=['user', 'calendar_id', 'source', 'start_utc'], name='intention_a_user_id_de487f_idx'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 2.1.5 on 2026-10-19 08:41
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('intention_app', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WatchChannel',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('calendar_id', models.CharField(max_length=200)),
+                ('channel_id', models.CharField(max_length=64, unique=True)),
+                ('resource_id', models.CharField(max_length=200)),
+                ('token', models.CharField(max_length=64)),
+                ('expiration', models.DateTimeField(db_index=True)),
+                ('credentials', models.TextField()),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='watch_channels', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 2.1.5 on 2026-10-19 08:12
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('intention_app', '0002_watchchannel'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SchedulePlan',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('token', models.CharField(max_length=32)),
+                ('calendar_id', models.CharField(max_length=200)),
+                ('form', models.TextField()),
+                ('events', models.TextField()),
+                ('created_at', models.DateTimeField(db_index=True)),
+                ('committed_at', models.DateTimeField(blank=True, null=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='schedule_plans', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'unique_together': {('user', 'token')},
+            },
+        ),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 2.1.5 on 2026-10-19 14:20
+
+import json
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def store_channel_credentials(apps, schema_editor):
+    """Keeps the credentials of the newest channel of each user, without their access token or client secret."""
+    from intention_app.credentials import encrypt_token
+    WatchChannel = apps.get_model('intention_app', 'WatchChannel')
+    StoredCredentials = apps.get_model('intention_app', 'StoredCredentials')
+    stored = set()
+    for channel in WatchChannel.objects.order_by('-expiration'):
+        credentials = json.loads(channel.credentials)
+        if channel.user_id in stored or not credentials.get('refresh_token'): continue
+        StoredCredentials.objects.create(user_id=channel.user_id, client_id=credentials['client_id'],
+                                         token_uri=credentials['token_uri'],
+                                         scopes=json.dumps(credentials.get('scopes') or []),
+                                         refresh_token=encrypt_token(credentials['refresh_token']))
+        stored.add(channel.user_id)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('intention_app', '0004_calendarversion'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StoredCredentials',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('client_id', models.CharField(max_length=200)),
+                ('token_uri', models.CharField(max_length=200)),
+                ('scopes', models.TextField()),
+                ('refresh_token', models.TextField()),
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='stored_credentials', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.RunPython(store_channel_credentials, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='watchchannel',
+            name='credentials',
+        ),
+    ]
@@ -25,9 +25,23 @@ class Preferences(models.Model):
 
     def set_calendars(self, calendars):
         self.calendars = json.dumps(calendars)
+        self._parsed_calendars = list(calendars)
 
     def get_calendars(self):
-        return json.loads(self.calendars)
+        if getattr(self, '_parsed_calendars', None) is None: self._parsed_calendars = json.loads(self.calendars)
+        return list(self._parsed_calendars)
+
+
+def get_preferences(user):
+    """Returns preferences of user, cached on the user instance for the rest of the request.
+
+    Preferences are not cached across requests, as a process-local cache would keep serving
+    preferences saved in other worker processes.
+    """
+    preferences = getattr(user, '_cached_preferences', None)
+    if preferences is None:
+        preferences = user._cached_preferences = Preferences.objects.get(user_id=user.pk)
+    return preferences
 
 
 @receiver(post_save, sender=User)
@@ -37,8 +51,9 @@ def create_user_preferences(sender, instance, created, **kwargs):
 
 
 @receiver(post_save, sender=User)
-def save_user_preferences(sender, instance, **kwargs):
-    instance.preferences.save()
+def save_user_preferences(sender, instance, update_fields=None, **kwargs):
+    if update_fields is None: # Targeted user writes, ie of last_login, never change preferences.
+        instance.preferences.save()
 
 
 class Time(models.Model):
@@ -54,3 +69,103 @@ class Schedule(models.Model):
     minutes = models.IntegerField(choices = [(x, x) for x in range(61)], default = 0)
     timerange = models.CharField(max_length=200, choices = TIMERANGE_CHOICES, default="ANYTIME")
     startdate = models.CharField(max_length=200, choices = STARTDATE_CHOICES, default="TOMORROW")
+
+
+class BusyInterval(models.Model):
+    """Busy time range of a user calendar, persisted so that it is shared across processes and restarts.
+
+    Ranges are synced either from free/busy queries or, with their event ids, from event listings.
+    """
+    FREEBUSY, EVENTS = 'FREEBUSY', 'EVENTS'
+    SOURCE_CHOICES = ((FREEBUSY, 'free/busy'), (EVENTS, 'events'))
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='busy_intervals')
+    calendar_id = models.CharField(max_length=200)
+    source = models.CharField(max_length=10, choices=SOURCE_CHOICES, default=FREEBUSY)
+    event_id = models.CharField(max_length=200, blank=True, default='')
+    start_utc = models.DateTimeField()
+    end_utc = models.DateTimeField()
+    fetched_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'calendar_id', 'source', 'start_utc']),
+            models.Index(fields=['user', 'calendar_id', 'source', 'end_utc']),
+        ]
+
+
+class BusyCoverage(models.Model):
+    """Time window of a user calendar for which busy intervals were synced at fetched_at."""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='busy_coverage')
+    calendar_id = models.CharField(max_length=200)
+    source = models.CharField(max_length=10, choices=BusyInterval.SOURCE_CHOICES, default=BusyInterval.FREEBUSY)
+    start_utc = models.DateTimeField()
+    end_utc = models.DateTimeField()
+    fetched_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'calendar_id', 'source', 'start_utc']),
+        ]
+
+
+class WatchChannel(models.Model):
+    """Push notification channel watching events of a user calendar.
+
+    Renewed outside of a request with the StoredCredentials of the user.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='watch_channels')
+    calendar_id = models.CharField(max_length=200)
+    channel_id = models.CharField(max_length=64, unique=True)
+    resource_id = models.CharField(max_length=200)
+    token = models.CharField(max_length=64)
+    expiration = models.DateTimeField(db_index=True)
+
+
+class StoredCredentials(models.Model):
+    """Google credentials of a user kept for work outside of a request, see intention_app/credentials.py.
+
+    Keeps only the encrypted refresh token and the OAuth client it was issued to, not the client secret.
+    """
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='stored_credentials')
+    client_id = models.CharField(max_length=200)
+    token_uri = models.CharField(max_length=200)
+    scopes = models.TextField()
+    refresh_token = models.TextField()
+
+
+class SchedulePlan(models.Model):
+    """Events planned for a user calendar, written to it once when the plan is committed.
+
+    Keeps the submitted form, so that committing the plan needs no further scheduling.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='schedule_plans')
+    token = models.CharField(max_length=32)
+    calendar_id = models.CharField(max_length=200)
+    form = models.TextField()
+    events = models.TextField()
+    created_at = models.DateTimeField(db_index=True)
+    committed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        unique_together = (('user', 'token'),)
+
+    def get_form(self):
+        return json.loads(self.form)
+
+    def get_events(self):
+        return json.loads(self.events)
+
+
+class CalendarVersion(models.Model):
+    """Version of the data cached from a user calendar, bumped whenever the calendar changes.
+
+    Kept in the database rather than the cache so that a change seen by one worker process,
+    ie a push notification, invalidates the data cached by every worker process.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='calendar_versions')
+    calendar_id = models.CharField(max_length=200)
+    version = models.PositiveIntegerField(default=1)
+
+    class Meta:
+        unique_together = (('user', 'calendar_id'),)
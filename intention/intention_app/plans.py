@@ -0,0 +1,99 @@
+"""Module to schedule events in two phases, planning then committing.
+
+make_plan runs the scheduler and stores the events it proposes as a
+SchedulePlan under a token, without writing to the user calendar, so that
+plans may be previewed. commit_plan writes the events of a plan to the
+calendar. Both are idempotent per token: submitting the same form under a
+token again returns the stored plan without scheduling again, and committing
+a committed plan makes no requests at all. A token submitted with an edited
+form, or whose uncommitted plan expired, is replaced with a new token.
+
+Events are inserted with ids derived from the token, so that a commit
+retried after failing part way, or raced by a double submit, skips the
+events already written rather than duplicating them.
+
+Exported Functions
+------------------
+new_token()
+make_plan(form, preferences, credentials, user_id, token=None, slot_minutes=DEFAULT_SLOT_MINUTES, get_freebusy=None,
+          localtz=None)
+commit_plan(credentials, user_id, token)
+"""
+
+import json
+import re
+import uuid
+from datetime import timedelta
+
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from intention_app.caching import invalidate_calendars
+from intention_app.models import SchedulePlan
+from intention_app.scheduling.consolidator import DEFAULT_SLOT_MINUTES
+from intention_app.snapshots import invalidate_snapshots
+
+# Uncommitted plans older than this are not committed, as the calendar may have changed since.
+PLAN_MAX_AGE = timedelta(hours=1)
+# Plans are kept this long to answer repeated commits, then deleted.
+LEDGER_MAX_AGE = timedelta(days=1)
+
+TOKEN_PATTERN = re.compile(r'^[0-9a-f]{32}$')
+
+
+def new_token():
+    """Returns a new plan token. Tokens are valid characters of calendar event ids."""
+    return uuid.uuid4().hex
+
+
+def make_plan(form, preferences, credentials, user_id, token=None, slot_minutes=DEFAULT_SLOT_MINUTES,
+              get_freebusy=None, localtz=None):
+    """Returns plan of events scheduled for form, or None if they could not be scheduled.
+
+    Returns the existing plan if one was made for the same form under token already and can still be
+    committed. A new token is used if none is provided, or if the existing plan cannot be reused.
+    """
+    if token is None or not TOKEN_PATTERN.match(token): token = new_token()
+    plan = SchedulePlan.objects.filter(user_id=user_id, token=token).first()
+    if plan is not None:
+        if _can_reuse(plan, form): return plan
+        token = new_token()
+
+    from intention_app.scheduling.scheduler import plan_events
+    events = plan_events(form, preferences, credentials, slot_minutes, get_freebusy, localtz)
+    if not events: return None
+    now = timezone.now()
+    for index, event in enumerate(events):
+        event['id'] = '%s%04d' % (token, index)
+    SchedulePlan.objects.filter(user_id=user_id, created_at__lt=now - LEDGER_MAX_AGE).delete()
+    try:
+        with transaction.atomic():
+            return SchedulePlan.objects.create(user_id=user_id, token=token, calendar_id=preferences.calendar_id,
+                                               form=json.dumps(form), events=json.dumps(events), created_at=now)
+    except IntegrityError: # Made concurrently by a double submit.
+        return SchedulePlan.objects.get(user_id=user_id, token=token)
+
+
+def commit_plan(credentials, user_id, token):
+    """Writes events of plan to the user calendar once. Returns the plan, or None if unknown or expired."""
+    plan = SchedulePlan.objects.filter(user_id=user_id, token=token).first()
+    if plan is None or plan.committed_at is not None: return plan
+    if _is_expired(plan): return None
+
+    from intention_app.scheduling.utils.googleapi_utils import add_events_to_calendar
+    add_events_to_calendar(credentials, plan.get_events(), plan.calendar_id)
+    plan.committed_at = timezone.now()
+    SchedulePlan.objects.filter(pk=plan.pk, committed_at__isnull=True).update(committed_at=plan.committed_at)
+    invalidate_calendars(user_id, [plan.calendar_id])
+    invalidate_snapshots(user_id, [plan.calendar_id])
+    return plan
+
+
+def _can_reuse(plan, form):
+    """Returns whether or not plan answers a submission of form, ie was made for it and is not expired."""
+    return json.loads(plan.form) == form and (plan.committed_at is not None or not _is_expired(plan))
+
+
+def _is_expired(plan):
+    """Returns whether or not plan is too old to commit, as the calendar may have changed since it was made."""
+    return plan.created_at < timezone.now() - PLAN_MAX_AGE
@@ -0,0 +1,99 @@
+"""Module to warm the caches of user calendars in the background.
+
+Users choose between scheduling and rescheduling on the scheduling options
+page, so rendering it prefetches what either page reads first: the calendar
+timezone, the events of the current day, and the free/busy times of the
+default scheduling form. Pages then read them from the cache and snapshot
+rather than from Google.
+
+Prefetches run on a small thread pool of PREFETCH_WORKERS threads, separate
+from request workers. At most MAX_PENDING_PREFETCHES are queued or running at
+a time and a user is prefetched at most once per PREFETCH_INTERVAL_SECONDS;
+prefetches beyond those are dropped rather than queued.
+
+Exported Functions
+------------------
+prefetch_calendars(credentials_dict, user_id, preferences)
+warm_calendars(credentials, user_id, preferences)
+"""
+
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from threading import BoundedSemaphore, Lock
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+
+from intention_app.models import Schedule
+
+MAX_PENDING_PREFETCHES = 8
+PREFETCH_INTERVAL_SECONDS = 60
+
+logger = logging.getLogger(__name__)
+
+_pending = BoundedSemaphore(MAX_PENDING_PREFETCHES)
+_executor = None
+_executor_lock = Lock()
+
+
+def prefetch_calendars(credentials_dict, user_id, preferences):
+    """Queues warming of the caches of user calendars on the prefetch pool. Returns whether it was queued.
+
+    Expects credentials as stored in the session.
+    """
+    if not settings.PREFETCH_WORKERS: return False
+    key = 'prefetch:%s' % user_id
+    if not cache.add(key, True, PREFETCH_INTERVAL_SECONDS): return False # Prefetched recently.
+    if not _pending.acquire(blocking=False):
+        cache.delete(key)
+        return False
+    try:
+        future = _get_executor().submit(_prefetch, dict(credentials_dict), user_id, preferences)
+    except RuntimeError: # Interpreter shutting down.
+        _pending.release()
+        return False
+    future.add_done_callback(lambda future : _pending.release())
+    return True
+
+
+def warm_calendars(credentials, user_id, preferences):
+    """Reads timezone, events of the current day, and free/busy times of the default scheduling form of
+    user calendars into the cache and snapshot."""
+    from intention_app.caching import get_localtz, make_events_getter
+    from intention_app.scheduling.rescheduler import get_events_current_day
+    from intention_app.scheduling.utils.scheduling_utils import get_end_of_multi_period, get_start_time
+    from intention_app.snapshots import make_freebusy_getter
+    localtz = get_localtz(credentials, user_id, preferences.calendar_id)
+    get_events_current_day(credentials, preferences, make_events_getter(user_id), localtz)
+
+    period, timerange, startdate = [Schedule._meta.get_field(name).default
+                                     for name in ('period', 'timerange', 'startdate')]
+    day_start_time, day_end_time = preferences.day_start_time, preferences.day_end_time
+    period_start_time = get_start_time(startdate, datetime.now(localtz), timerange, localtz, day_start_time,
+                                       day_end_time)
+    multi_period_end = get_end_of_multi_period(period_start_time, period, timerange, localtz, day_start_time,
+                                               day_end_time)
+    if period_start_time < multi_period_end:
+        make_freebusy_getter(user_id)(credentials, period_start_time, multi_period_end, preferences.get_calendars())
+
+
+def _prefetch(credentials_dict, user_id, preferences):
+    """Warms caches of user calendars on a prefetch thread, which owns its own database connection."""
+    from google.oauth2.credentials import Credentials
+    try:
+        warm_calendars(Credentials(**credentials_dict), user_id, preferences)
+    except Exception:
+        logger.exception('Failed to prefetch calendars of user %s', user_id)
+    finally:
+        connections.close_all()
+
+
+def _get_executor():
+    """Returns the prefetch thread pool, creating it on first use."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=settings.PREFETCH_WORKERS, thread_name_prefix='prefetch')
+        return _executor
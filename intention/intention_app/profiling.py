@@ -0,0 +1,144 @@
+"""Module to profile individual requests and keep reports of them on disk.
+
+ProfilingMiddleware runs a request under cProfile and tracemalloc when
+profiling is enabled with PROFILE_REQUESTS, when staff add ?profile=1 to a
+url, or when the request is sampled at PROFILE_SAMPLE_RATE. Each profiled
+request writes a pstats file to PROFILE_DIR, next to a json file of its
+tags: the view, a hash of the user, the scheduling inputs of the request
+(period, frequency, and calendar count), the duration and the peak memory
+allocated. Only the newest PROFILE_MAX_REPORTS reports are kept. The peak
+is not measured if memory was already traced before the request and the
+peak cannot be reset, ie before Python 3.9.
+
+Profiling is global to the process, so one request is profiled at a time;
+requests arriving meanwhile run unprofiled. See the profile_summary
+management command to summarize the hot functions of collected reports.
+
+Exported Functions
+------------------
+read_reports(profile_dir)
+"""
+
+import cProfile
+import json
+import logging
+import os
+import random
+import time
+import tracemalloc
+from threading import Lock
+
+from django.conf import settings
+from django.utils.crypto import salted_hmac
+
+PROFILE_QUERY_PARAMETER = 'profile'
+STATS_SUFFIX, TAGS_SUFFIX = '.prof', '.json'
+
+logger = logging.getLogger(__name__)
+
+_profiling_lock = Lock()
+
+
+class ProfilingMiddleware:
+    """Profiles requests selected by setting, staff query parameter, or sampling rate."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not _should_profile(request) or not _profiling_lock.acquire(blocking=False):
+            return self.get_response(request)
+        try:
+            return self._profile(request)
+        finally:
+            _profiling_lock.release()
+
+    def _profile(self, request):
+        """Returns response to request, made under the profiler, and writes its report."""
+        was_tracing = tracemalloc.is_tracing()
+        # Traces of whoever started tracing are kept, so their peak is reset rather than cleared.
+        measure_peak = not was_tracing or hasattr(tracemalloc, 'reset_peak')
+        profiler = cProfile.Profile()
+        start = time.perf_counter()
+        try:
+            if not was_tracing: tracemalloc.start()
+            elif measure_peak: tracemalloc.reset_peak()
+            profiler.enable()
+            response = self.get_response(request)
+        finally:
+            profiler.disable()
+            duration = time.perf_counter() - start
+            peak = tracemalloc.get_traced_memory()[1] if measure_peak else None
+            if not was_tracing: tracemalloc.stop()
+        try:
+            _write_report(profiler, _get_tags(request, response, duration, peak))
+        except Exception: # Never fail the request for its report.
+            logger.exception('Failed to write profile of %s', request.path)
+        return response
+
+
+def read_reports(profile_dir):
+    """Returns list of (stats path, tags) of the reports in profile_dir, oldest first."""
+    reports = []
+    for name in _list_reports(profile_dir):
+        with open(os.path.join(profile_dir, name + TAGS_SUFFIX)) as f:
+            reports.append((os.path.join(profile_dir, name + STATS_SUFFIX), json.load(f)))
+    return reports
+
+
+def _list_reports(profile_dir):
+    """Returns list of names of the complete reports in profile_dir, oldest first."""
+    if not os.path.isdir(profile_dir): return []
+    files = set(os.listdir(profile_dir))
+    return sorted(name[:-len(TAGS_SUFFIX)] for name in files
+                  if name.endswith(TAGS_SUFFIX) and name[:-len(TAGS_SUFFIX)] + STATS_SUFFIX in files)
+
+
+def _should_profile(request):
+    """Returns whether request is to be profiled."""
+    if settings.PROFILE_REQUESTS: return True
+    if PROFILE_QUERY_PARAMETER in request.GET and getattr(request, 'user', None) is not None and \
+       request.user.is_staff:
+        return True
+    return settings.PROFILE_SAMPLE_RATE > 0 and random.random() < settings.PROFILE_SAMPLE_RATE
+
+
+def _get_tags(request, response, duration, peak):
+    """Returns dict of tags of the report of a profiled request."""
+    from intention_app.models import get_preferences
+    resolver_match = getattr(request, 'resolver_match', None)
+    user = getattr(request, 'user', None)
+    authenticated = user is not None and user.is_authenticated
+    data = request.POST if request.method == 'POST' else request.GET
+    return {
+        'view': resolver_match.view_name if resolver_match else None,
+        'path': request.path,
+        'method': request.method,
+        'status': response.status_code,
+        'user': salted_hmac('intention_app.profiling', str(user.pk)).hexdigest()[:12] if authenticated else None,
+        'period': data.get('period'),
+        'frequency': data.get('frequency'),
+        'calendars': len(get_preferences(user).get_calendars()) if authenticated else None,
+        'duration_ms': round(duration * 1000, 1),
+        'peak_memory_kb': round(peak / 1024, 1) if peak is not None else None,
+        'time': time.time(),
+    }
+
+
+def _write_report(profiler, tags):
+    """Writes stats of profiler and tags to a new report in PROFILE_DIR, then deletes the oldest reports."""
+    profile_dir = settings.PROFILE_DIR
+    os.makedirs(profile_dir, exist_ok=True)
+    name = '%s-%06d-%s-%s' % (time.strftime('%Y%m%d%H%M%S', time.gmtime(tags['time'])), random.randrange(10 ** 6),
+                              (tags['view'] or 'unresolved').replace(':', '.'), tags['user'] or 'anonymous')
+    profiler.dump_stats(os.path.join(profile_dir, name + STATS_SUFFIX))
+    with open(os.path.join(profile_dir, name + TAGS_SUFFIX), 'w') as f:
+        json.dump(tags, f)
+
+    names = _list_reports(profile_dir)
+    for old_name in names[:max(len(names) - settings.PROFILE_MAX_REPORTS, 0)]:
+        for suffix in (STATS_SUFFIX, TAGS_SUFFIX):
+            try:
+                os.remove(os.path.join(profile_dir, old_name + suffix))
+            except FileNotFoundError: # Deleted by another process.
+                pass
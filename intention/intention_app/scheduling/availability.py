@@ -0,0 +1,30 @@
+"""Module to find free time in a user calendar.
+
+Lists free slots of a given length, honouring the user's waking hours and
+the requested timerange, with the same window logic used to place events
+in the scheduler. Performs no API requests, so may be served from cached
+busy times.
+
+Exported Functions
+------------------
+find_free_slots(preferences, localtz, busy_array, range_start, range_end, event_length, timerange, max_slots)
+"""
+
+from intention_app.scheduling.utils.availability_index import make_availability_index
+from intention_app.scheduling.utils.scheduling_utils import *
+
+
+def find_free_slots(preferences, localtz, busy_array, range_start, range_end, event_length, timerange, max_slots):
+    """Returns list of up to max_slots consecutive non-overlapping free (start, end) times between range provided."""
+    day_start_time, day_end_time, calendar_id, calendars = unpack_preferences(preferences)
+    availability = make_availability_index(busy_array, localtz)
+    slots = []
+    event_start = range_start
+    while len(slots) < max_slots:
+        day_start, day_end = get_timerange_start_end_time(event_start, timerange, day_start_time, day_end_time)
+        success, start_time = availability.find_first_fit(max(event_start, day_start), event_length,
+                                                          range_end - event_length, day_start, day_end)
+        if not success: break
+        slots.append((start_time, start_time + event_length))
+        event_start = start_time + event_length
+    return slots
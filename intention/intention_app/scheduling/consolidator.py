@@ -3,18 +3,44 @@
 Handles logic needed to consolidate free busy information from
 multiple periods of a user calendar into a single period range.
 
+The consolidated period is divided into slots of configurable length
+(1, 5, or 15 minutes). Busy ranges mark every slot they touch, so coarser
+slots round busy ranges outwards. Before converting slots back to time
+ranges, availability is packed into a bitmap and searched with shifts and
+ANDs for a run of free slots as long as the event to place, so that periods
+with no room for it are rejected early.
+
+Consolidations given a window key are kept incrementally between calls, so
+that reconsolidating a window whose busy ranges mostly did not change, ie on
+the next request of the same user, only maps the ranges that entered or left
+the window and only converts the busy runs that changed back to time ranges.
+Their slots and packed bitmap are kept until the next change, so a window
+that did not change is neither rotated nor packed again.
+Kept consolidations count busy ranges per minute in 16 bits, and are bounded
+by the bytes they hold rather than by their number, as a month holds four
+times the minutes of a week. A window with more overlapping busy ranges than
+a count holds is consolidated anew on every call instead.
+
 Exported Functions
 ------------------
-consolidate_multiple_periods(busy_ranges, first_period_start, first_period_end, period, localtz)
+consolidate_multiple_periods(busy_ranges, first_period_start, first_period_end, period, localtz, slot_minutes=1)
+consolidate_busy_array(busy_array, first_period_start, first_period_end, period, localtz, slot_minutes=1,
+                       window_key=None, min_free_minutes=0)
+find_free_run(bitmap, num_slots, run_length, start_slot=0)
+clear_consolidations()
 """
 
+from collections import Counter, OrderedDict
 from datetime import timedelta
+from threading import Lock
 
 import numpy as np
 
 from intention_app.scheduling.utils.datetime_utils import add_timedelta, get_weekday_index, get_week_number, \
     is_dst, DAY, WEEK, MONTH, SECONDS_IN_MINUTE, MINUTES_IN_HOUR, HOURS_IN_DAY, DAYS_IN_WEEK
-from intention_app.scheduling.utils.scheduling_utils import get_range_freebusy
+from intention_app.scheduling.utils.datetime_array_utils import get_day_numbers, get_days_of_month, get_dst_flags, \
+    get_months, get_wall_seconds, get_week_numbers, get_weekday_indices, EPOCH
+from intention_app.scheduling.utils.scheduling_utils import make_busy_array
 
 # Number days in month consolidation.
 DAYS_IN_MONTH_ARRAY = 28
@@ -22,14 +48,231 @@ DAYS_IN_MONTH_ARRAY = 28
 MINUTES_IN_DAY = HOURS_IN_DAY * MINUTES_IN_HOUR
 MINUTES_IN_WEEK = MINUTES_IN_DAY * DAYS_IN_WEEK
 
+# Supported slot lengths in minutes. Each evenly divides a day.
+SLOT_MINUTES_CHOICES = (1, 5, 15)
+DEFAULT_SLOT_MINUTES = 1
+
+# Bytes of incremental consolidations kept, least recently used evicted first.
+MAX_CONSOLIDATION_BYTES = 16 * 1024 * 1024
+# Estimated bytes kept per busy range counted, and per busy run converted to a time range.
+RANGE_BYTES = 256
+
+# Type of busy range counts per minute, and the most busy ranges it counts on a minute.
+COUNT_DTYPE = np.uint16
+MAX_BUSY_COUNT = np.iinfo(COUNT_DTYPE).max
 
-def consolidate_multiple_periods(busy_ranges, first_period_start, first_period_end, period, localtz):
+_consolidations = OrderedDict()
+_consolidations_lock = Lock()
+
+
+def consolidate_multiple_periods(busy_ranges, first_period_start, first_period_end, period, localtz,
+                                 slot_minutes=DEFAULT_SLOT_MINUTES):
     """Returns list of busy time ranges consolidated across mutliple periods."""
+    busy_array = make_busy_array(busy_ranges)
+    return consolidate_busy_array(busy_array, first_period_start, first_period_end, period, localtz, slot_minutes)
+
+
+def consolidate_busy_array(busy_array, first_period_start, first_period_end, period, localtz,
+                           slot_minutes=DEFAULT_SLOT_MINUTES, window_key=None, min_free_minutes=0):
+    """Returns list of busy time ranges consolidated across mutliple periods.
+
+    Expects array of (start, end) utc epoch seconds as returned by make_busy_array. If window_key
+    is provided, updates the consolidation last kept under the key rather than starting anew.
+    Returns None instead if the period has no run of min_free_minutes free minutes to place an event in.
+    """
+    if window_key is not None:
+        consolidation = _get_consolidation(window_key, first_period_start, period, localtz)
+        with consolidation.lock:
+            try:
+                consolidation.update(busy_array)
+            except OverflowError:
+                _discard_consolidation(window_key, consolidation)
+            else:
+                slot_array = consolidation.get_slot_array(first_period_start, slot_minutes)
+                if not _has_free_run(slot_array, first_period_start, localtz, slot_minutes, min_free_minutes,
+                                     consolidation.pack_slot_array):
+                    return None
+                return consolidation.convert_to_timeranges(first_period_start, first_period_end, slot_minutes,
+                                                           slot_array)
+    slot_array = _make_slot_array(busy_array, first_period_start, period, localtz, slot_minutes)
+    if not _has_free_run(slot_array, first_period_start, localtz, slot_minutes, min_free_minutes): return None
+    return _convert_array_to_timeranges(slot_array, first_period_start, first_period_end, localtz, slot_minutes)
+
+
+def find_free_run(bitmap, num_slots, run_length, start_slot=0):
+    """Returns first slot at or after start_slot that begins run_length consecutive free slots, or None.
+
+    Doubles the length of the free runs found at each step by ANDing the bitmap with a shifted
+    copy of itself, so takes a logarithmic number of whole-bitmap operations in run_length.
+    """
+    if run_length <= 0: return start_slot if start_slot < num_slots else None
+    num_bits = len(bitmap) * 8
+    runs = int.from_bytes(bitmap.tobytes(), 'big')
+    runs &= ~((1 << (num_bits - num_slots)) - 1) # Padding bits past num_slots are never free.
+    run_found = 1
+    while run_found < run_length:
+        shift = min(run_found, run_length - run_found)
+        runs &= runs << shift
+        run_found += shift
+    runs &= (1 << (num_bits - start_slot)) - 1 # Bit set for slot i if slots i through i+run_length-1 free.
+    if not runs: return None
+    return num_bits - runs.bit_length()
+
+
+class IncrementalConsolidation:
+    """Busy minutes of the consolidated period, counted per minute and updated by the change in busy ranges.
+
+    Each minute holds the number of busy ranges mapped onto it, so that ranges leaving the window
+    are subtracted exactly. Minutes are counted from the period start the consolidation was made
+    for. Days and weeks map ranges onto the same minutes of the period from any later start, so
+    the counts are rotated onto it; months map ranges by weekday and week of the first month, so
+    only the same start can be updated.
+    """
+
+    def __init__(self, first_period_start, period, localtz):
+        self.anchor = first_period_start
+        self.period = period
+        self.localtz = localtz
+        self.minutes_in_period = _get_minutes_in_period(period)
+        self.counts = np.zeros(self.minutes_in_period, dtype=COUNT_DTYPE)
+        self.ranges = Counter()
+        self.lock = Lock()
+        self._timeranges_key = None
+        self._timeranges = {} # Time range of each busy run converted for _timeranges_key.
+        self._slots_key = None
+        self._slot_array = self._bitmap = None # Slots and their packed bitmap for _slots_key, packed once searched.
+
+    def can_update(self, first_period_start, period, localtz):
+        """Returns whether or not the consolidation can be updated for the period start provided."""
+        if period != self.period or localtz.zone != self.localtz.zone: return False
+        if period == MONTH: return (first_period_start == self.anchor and
+                                    first_period_start.utcoffset() == self.anchor.utcoffset())
+        return (first_period_start.timestamp() - self.anchor.timestamp()) % SECONDS_IN_MINUTE == 0
+
+    def update(self, busy_array):
+        """Counts busy ranges of array not yet counted and subtracts counted ranges no longer in it.
+
+        Raises OverflowError, leaving the consolidation unchanged, if a minute would count more than MAX_BUSY_COUNT.
+        """
+        ranges = Counter(map(tuple, busy_array.tolist()))
+        added, removed = ranges - self.ranges, self.ranges - ranges
+        if not added and not removed: return
+        counts = self.counts.astype(np.int64)
+        if added: counts += self._count_busy_minutes(list(added.elements()))
+        if removed: counts -= self._count_busy_minutes(list(removed.elements()))
+        if counts.max() > MAX_BUSY_COUNT: raise OverflowError('Over %d busy ranges on a minute' % MAX_BUSY_COUNT)
+        self.counts = counts.astype(COUNT_DTYPE)
+        self.ranges = ranges
+        self._slots_key = None
+
+    def get_size(self):
+        """Returns estimated number of bytes kept by the consolidation."""
+        slots_bytes = 0 if self._slots_key is None else self._slot_array.nbytes
+        if self._bitmap is not None: slots_bytes += self._bitmap.nbytes
+        return self.counts.nbytes + slots_bytes + (len(self.ranges) + len(self._timeranges)) * RANGE_BYTES
+
+    def get_slot_array(self, first_period_start, slot_minutes):
+        """Returns array of slots in the period starting at first_period_start with values set to False for busy slots."""
+        if slot_minutes not in SLOT_MINUTES_CHOICES:
+            raise ValueError('slot_minutes must be one of %s' % (SLOT_MINUTES_CHOICES,))
+        key = (self._get_rotation(first_period_start), slot_minutes)
+        if key != self._slots_key:
+            busy_minutes = np.roll(self.counts > 0, -key[0])
+            self._slot_array = ~busy_minutes.reshape(-1, slot_minutes).any(axis=1)
+            self._slots_key, self._bitmap = key, None
+        return self._slot_array
+
+    def pack_slot_array(self, slot_array):
+        """Returns slot array packed with np.packbits, packing the slot array last returned only once."""
+        if slot_array is not self._slot_array: return np.packbits(slot_array)
+        if self._bitmap is None: self._bitmap = np.packbits(slot_array)
+        return self._bitmap
+
+    def convert_to_timeranges(self, first_period_start, first_period_end, slot_minutes, slot_array=None):
+        """Returns list of busy time ranges of the period, converting only busy runs not converted before."""
+        if slot_array is None: slot_array = self.get_slot_array(first_period_start, slot_minutes)
+        key = (first_period_start, first_period_start.utcoffset(), first_period_end)
+        if key != self._timeranges_key: self._timeranges_key, self._timeranges = key, {}
+        busy = np.concatenate(([False], slot_array == False, [False]))
+        run_bounds = (np.flatnonzero(busy[1:] != busy[:-1]) * slot_minutes).tolist()
+        timeranges = {}
+        for run in zip(run_bounds[::2], run_bounds[1::2]):
+            timerange = self._timeranges.get(run)
+            if timerange is None: timerange = _create_range(run[0], run[1], first_period_start, first_period_end,
+                                                            self.localtz)
+            timeranges[run] = timerange
+        self._timeranges = timeranges
+        return [dict(timerange) for timerange in timeranges.values()]
+
+    def _count_busy_minutes(self, busy_ranges):
+        """Returns array of the number of busy ranges provided mapped onto each minute of the period."""
+        busy_array = np.array(busy_ranges, dtype=np.int64).reshape(-1, 2)
+        if self.period == MONTH: start_minutes, end_minutes = _consolidate_months(busy_array, self.anchor, self.localtz)
+        else: start_minutes, end_minutes = _consolidate_days_or_weeks(busy_array, self.anchor, self.minutes_in_period,
+                                                                      self.localtz)
+        starts, ends = _clip_minutes(start_minutes, end_minutes, self.minutes_in_period)
+        difference = (np.bincount(starts, minlength=self.minutes_in_period + 1) -
+                      np.bincount(ends, minlength=self.minutes_in_period + 1))
+        return np.cumsum(difference[:self.minutes_in_period])
+
+    def _get_rotation(self, first_period_start):
+        """Returns number of minutes the minutes of the period starting at first_period_start are shifted by."""
+        seconds = int(first_period_start.timestamp() - self.anchor.timestamp())
+        dst_correction = int(is_dst(first_period_start, self.localtz)) - int(is_dst(self.anchor, self.localtz))
+        return seconds // SECONDS_IN_MINUTE + dst_correction * MINUTES_IN_HOUR
+
+
+def _get_consolidation(window_key, first_period_start, period, localtz):
+    """Returns consolidation kept under window key if it can be updated for the period, else a new one."""
+    with _consolidations_lock:
+        consolidation = _consolidations.get(window_key)
+        if consolidation is None or not consolidation.can_update(first_period_start, period, localtz):
+            consolidation = _consolidations[window_key] = IncrementalConsolidation(first_period_start, period, localtz)
+        _consolidations.move_to_end(window_key)
+        # Kept consolidations grow as they are updated, so their size is taken anew.
+        size = sum(kept.get_size() for kept in _consolidations.values())
+        while size > MAX_CONSOLIDATION_BYTES and len(_consolidations) > 1:
+            size -= _consolidations.popitem(last=False)[1].get_size()
+        return consolidation
+
+
+def _discard_consolidation(window_key, consolidation):
+    """Discards consolidation kept under window key, unless since replaced."""
+    with _consolidations_lock:
+        if _consolidations.get(window_key) is consolidation: del _consolidations[window_key]
+
+
+def clear_consolidations():
+    """Discards all incremental consolidations."""
+    with _consolidations_lock:
+        _consolidations.clear()
+
+
+def _make_slot_array(busy_array, first_period_start, period, localtz, slot_minutes):
+    """Returns array of slots in the consolidated period with values set to False for busy slots."""
+    if slot_minutes not in SLOT_MINUTES_CHOICES:
+        raise ValueError('slot_minutes must be one of %s' % (SLOT_MINUTES_CHOICES,))
     minutes_in_period = _get_minutes_in_period(period)
-    minute_array = _make_minute_array(period, minutes_in_period)
-    if period == MONTH: _consolidate_months(busy_ranges, first_period_start, minute_array, localtz)
-    else: _consolidate_days_or_weeks(busy_ranges, first_period_start, minutes_in_period, minute_array, localtz)
-    return _convert_array_to_timeranges(minute_array, first_period_start, first_period_end, localtz)
+    if period == MONTH: start_minutes, end_minutes = _consolidate_months(busy_array, first_period_start, localtz)
+    else: start_minutes, end_minutes = _consolidate_days_or_weeks(busy_array, first_period_start, minutes_in_period,
+                                                                  localtz)
+    slot_array = np.ones(minutes_in_period // slot_minutes, dtype=bool)
+    _mark_busy_slots(slot_array, minutes_in_period, start_minutes, end_minutes, slot_minutes)
+    return slot_array
+
+
+def _has_free_run(slot_array, first_period_start, localtz, slot_minutes, min_free_minutes, pack=np.packbits):
+    """Returns whether or not slots of the period may hold an event of min_free_minutes.
+
+    Slots are packed into a bitmap with pack. Runs of slots are wall clock minutes, so periods
+    spanning a change of utc offset are not searched.
+    """
+    if min_free_minutes <= 0: return True
+    minutes_in_period = len(slot_array) * slot_minutes
+    if is_dst(first_period_start, localtz) != is_dst(first_period_start + timedelta(minutes=minutes_in_period), localtz):
+        return True
+    run_length = -(-min_free_minutes // slot_minutes)
+    return find_free_run(pack(slot_array), len(slot_array), run_length) is not None
 
 
 def _get_minutes_in_period(period):
@@ -39,56 +282,81 @@ def _get_minutes_in_period(period):
     elif period == MONTH: return MINUTES_IN_HOUR * HOURS_IN_DAY * DAYS_IN_MONTH_ARRAY
 
 
-def _make_minute_array(period, minutes_in_period):
-    """Returns array of True values of size minutes_in_period."""
-    if period == DAY: return np.ones(minutes_in_period, dtype=bool)
-    elif period == WEEK: return np.ones(minutes_in_period, dtype=bool)
-    elif period == MONTH: return np.ones(minutes_in_period, dtype=bool)
-
-
-def _consolidate_days_or_weeks(busy_ranges, first_period_start, minutes_in_period, minute_array, localtz):
-    """Populates minute array for days or weeks with values set to False for busy ranges."""
-    for i in range(len(busy_ranges)):
-        busy_start, busy_end = get_range_freebusy(i, busy_ranges, localtz)
-        start_minute = int(_get_minutes_between(first_period_start, busy_start, localtz) % minutes_in_period)
-        end_minute = int(_get_minutes_between(first_period_start, busy_end, localtz) % minutes_in_period)
-        minute_array[start_minute:end_minute] = False
-        if end_minute < start_minute:
-            minute_array[start_minute:] = False
-            minute_array[:end_minute] = False
-
-
-def _consolidate_months(busy_ranges, first_period_start, minute_array, localtz):
-    """Populates minute array for months with values set to False for busy ranges."""
-    first_seven_days_week_nums = _get_first_seven_days_week_nums(first_period_start)
-    for i in range(len(busy_ranges)):
-        busy_start, busy_end = get_range_freebusy(i, busy_ranges, localtz)
-        busy_day_week_num = get_week_number(busy_start)
-        orig_day = first_seven_days_week_nums[get_weekday_index(busy_start)][0]
-        orig_day_week_num = first_seven_days_week_nums[get_weekday_index(busy_start)][1]
-        if busy_day_week_num < orig_day_week_num or busy_start.day > DAYS_IN_MONTH_ARRAY: continue
-        modulo = _get_month_modulo(first_period_start, busy_start, orig_day, busy_day_week_num, orig_day_week_num)
-        if not modulo == float('inf') and (busy_start - timedelta(minutes=modulo)) < first_period_start: continue
-        start_minute = int(_get_minutes_between(first_period_start, busy_start, localtz) % modulo)
-        end_minute = int(_get_minutes_between(first_period_start, busy_end, localtz) % modulo)
-        minute_array[start_minute:end_minute] = False
-
-
-def _convert_array_to_timeranges(minute_array_filled, first_period_start, first_period_end, localtz):
-    """Returns list of busy time ranges corresponding to minute indices with values set to False."""
-    busy_ranges = []
-    busy_minutes = [int(x) for x in np.where(minute_array_filled == False)[0]]
-    if len(busy_minutes) == 0: return busy_ranges # No busy times to convert to time ranges.
-    start_minute, end_minute = busy_minutes[0], busy_minutes[0]
-    for i in range(1, len(busy_minutes)):
-        if busy_minutes[i] - busy_minutes[i-1] != 1:
-            end_minute = busy_minutes[i-1] + 1
-            busy_ranges.append(_create_range(start_minute, end_minute, first_period_start, first_period_end, localtz))
-            start_minute = busy_minutes[i]
-    if end_minute != busy_minutes[-1] + 1:
-        end_minute = busy_minutes[-1] + 1
-        busy_ranges.append(_create_range(start_minute, end_minute, first_period_start, first_period_end, localtz))
-    return busy_ranges
+def _consolidate_days_or_weeks(busy_array, first_period_start, minutes_in_period, localtz):
+    """Returns start and end minutes of busy ranges for days or weeks, mapped into the first period.
+
+    Ranges that wrap around the end of the period are split in two, and ranges at least a period
+    long, ie busy times coalesced across calendars or multi-day events, cover the whole period.
+    """
+    busy_starts, busy_ends = busy_array[:, 0], busy_array[:, 1]
+    start_minutes = np.mod(_get_minutes_between_array(first_period_start, busy_starts,
+                                                      get_wall_seconds(busy_starts, localtz), localtz), minutes_in_period)
+    end_minutes = np.mod(_get_minutes_between_array(first_period_start, busy_ends,
+                                                    get_wall_seconds(busy_ends, localtz), localtz), minutes_in_period)
+    whole_period = busy_ends - busy_starts >= minutes_in_period * SECONDS_IN_MINUTE
+    start_minutes = np.where(whole_period, 0, start_minutes)
+    end_minutes = np.where(whole_period, minutes_in_period, end_minutes)
+    wrapped = end_minutes < start_minutes
+    return (np.concatenate((start_minutes, start_minutes[wrapped], np.zeros(np.count_nonzero(wrapped), np.int64))),
+            np.concatenate((end_minutes, np.full(np.count_nonzero(wrapped), minutes_in_period), end_minutes[wrapped])))
+
+
+def _consolidate_months(busy_array, first_period_start, localtz):
+    """Returns start and end minutes of busy ranges for months, mapped into the first period.
+
+    Maps each busy range to the same weekday of the same week of the first month with array arithmetic.
+    """
+    busy_starts, busy_ends = busy_array[:, 0], busy_array[:, 1]
+    busy_start_walls = get_wall_seconds(busy_starts, localtz)
+    busy_days = get_day_numbers(busy_start_walls)
+    busy_day_week_nums = get_week_numbers(busy_days)
+    weekday_indices = get_weekday_indices(busy_days)
+    orig_days, orig_day_week_nums = _get_first_seven_days_arrays(first_period_start)
+    orig_days, orig_day_week_nums = orig_days[weekday_indices], orig_day_week_nums[weekday_indices]
+
+    same_month = get_months(busy_days) == first_period_start.month
+    modulos = ((busy_days - orig_days) * MINUTES_IN_DAY -
+               (busy_day_week_nums - orig_day_week_nums) * MINUTES_IN_WEEK)
+    first_period_epoch = first_period_start.timestamp()
+    included = ((busy_day_week_nums >= orig_day_week_nums) & (get_days_of_month(busy_days) <= DAYS_IN_MONTH_ARRAY) &
+                (same_month | ((modulos != 0) & (busy_starts - modulos * SECONDS_IN_MINUTE >= first_period_epoch))))
+
+    start_minutes = _get_minutes_between_array(first_period_start, busy_starts, busy_start_walls, localtz)
+    end_minutes = _get_minutes_between_array(first_period_start, busy_ends, get_wall_seconds(busy_ends, localtz), localtz)
+    divisors = np.where(same_month | (modulos == 0), 1, modulos) # Ranges with zero modulo are not included.
+    start_minutes = np.where(same_month, start_minutes, np.mod(start_minutes, divisors))
+    end_minutes = np.where(same_month, end_minutes, np.mod(end_minutes, divisors))
+    return start_minutes[included], end_minutes[included]
+
+
+def _mark_busy_slots(slot_array, minutes_in_period, start_minutes, end_minutes, slot_minutes):
+    """Sets every slot touched by minutes [start:end] to False for each start and end minute pair provided.
+
+    Minutes are interpreted as slice indices into the minutes of the period. All pairs are
+    marked at once by summing a difference array.
+    """
+    starts, ends = _clip_minutes(start_minutes, end_minutes, minutes_in_period)
+    start_slots = starts // slot_minutes
+    end_slots = -(-ends // slot_minutes)
+    num_slots = len(slot_array)
+    difference = (np.bincount(start_slots, minlength=num_slots + 1) - np.bincount(end_slots, minlength=num_slots + 1))
+    slot_array[np.cumsum(difference[:num_slots]) > 0] = False
+
+
+def _clip_minutes(start_minutes, end_minutes, minutes_in_period):
+    """Returns start and end minutes of nonempty ranges, with negative minutes wrapped and all clipped to the period."""
+    starts = np.clip(np.where(start_minutes < 0, start_minutes + minutes_in_period, start_minutes), 0, minutes_in_period)
+    ends = np.clip(np.where(end_minutes < 0, end_minutes + minutes_in_period, end_minutes), 0, minutes_in_period)
+    nonempty = starts < ends
+    return starts[nonempty], ends[nonempty]
+
+
+def _convert_array_to_timeranges(slot_array_filled, first_period_start, first_period_end, localtz, slot_minutes):
+    """Returns list of busy time ranges corresponding to runs of slots with values set to False."""
+    busy = np.concatenate(([False], slot_array_filled == False, [False]))
+    run_bounds = np.flatnonzero(busy[1:] != busy[:-1]) * slot_minutes
+    return [_create_range(int(start_minute), int(end_minute), first_period_start, first_period_end, localtz)
+            for start_minute, end_minute in zip(run_bounds[::2], run_bounds[1::2])]
 
 
 def _create_range(start_minute, end_minute, first_period_start, first_period_end, localtz):
@@ -104,12 +372,14 @@ def _create_range(start_minute, end_minute, first_period_start, first_period_end
     }
 
 
-def _get_minutes_between(start_time, end_time, localtz):
-    """Returns number of minutes between the provided start and end times."""
-    minutes = (end_time - start_time).total_seconds() // SECONDS_IN_MINUTE
-    if not is_dst(start_time, localtz) and is_dst(end_time, localtz): return minutes + MINUTES_IN_HOUR
-    elif is_dst(start_time, localtz) and not is_dst(end_time, localtz): return minutes - MINUTES_IN_HOUR
-    else: return minutes
+def _get_minutes_between_array(start_time, end_epochs, end_walls, localtz):
+    """Returns array of number of minutes between the provided start time and each end time.
+
+    End times are given both as utc epoch seconds and as local wall clock seconds.
+    """
+    minutes = np.floor_divide(end_epochs - start_time.timestamp(), SECONDS_IN_MINUTE).astype(np.int64)
+    dst_correction = get_dst_flags(end_walls, localtz).astype(np.int64) - int(is_dst(start_time, localtz))
+    return minutes + dst_correction * MINUTES_IN_HOUR
 
 
 def _get_first_seven_days_week_nums(start_day):
@@ -122,13 +392,11 @@ def _get_first_seven_days_week_nums(start_day):
     return week_nums
 
 
-def _get_month_modulo(period_start_time, future_day, orig_day, future_day_week_num, orig_day_week_num):
-    """Returns the modulo needed to convert day in future month to corresponding day in current month.
-
-    For example, if future day is 3rd Monday of March and current month is January, will find minutes
-    needed to convert 3rd Monday of March to the 3rd Monday of January when used as modulus operator.
-    """
-    if future_day.month == period_start_time.month: return float('inf')
-    minutes_between_days = (future_day.date() - orig_day.date()).days * MINUTES_IN_DAY
-    minutes_between_week_nums = (future_day_week_num - orig_day_week_num) * MINUTES_IN_WEEK
-    return minutes_between_days - minutes_between_week_nums
+def _get_first_seven_days_arrays(start_day):
+    """Returns arrays, indexed by weekday, of day numbers and week numbers of the day provided and 6 proceeding days."""
+    orig_days = np.zeros(DAYS_IN_WEEK, dtype=np.int64)
+    orig_day_week_nums = np.zeros(DAYS_IN_WEEK, dtype=np.int64)
+    for day, week_num in _get_first_seven_days_week_nums(start_day):
+        orig_days[get_weekday_index(day)] = (day.date() - EPOCH.date()).days
+        orig_day_week_nums[get_weekday_index(day)] = week_num
+    return orig_days, orig_day_week_nums
@@ -0,0 +1,79 @@
+"""Module to schedule events for many users in parallel.
+
+Fans the CPU bound consolidation and placement work for batches of
+(user, habit) work items out to a pool of worker processes. All API
+requests happen up front in the calling process, and busy times are
+shipped to the workers as compact arrays of utc epoch seconds.
+
+Exported Functions
+------------------
+make_work_item(form, preferences, credentials, slot_minutes=DEFAULT_SLOT_MINUTES)
+schedule_work_items(work_items, max_workers=None)
+"""
+
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from os import cpu_count
+
+from pytz import timezone
+
+from intention_app.scheduling.consolidator import DEFAULT_SLOT_MINUTES
+from intention_app.scheduling.scheduler import place_events
+from intention_app.scheduling.utils.googleapi_utils import get_freebusy_in_range, get_localtz
+from intention_app.scheduling.utils.scheduling_utils import *
+
+# Number of work items handed to a worker process at a time per worker.
+CHUNKS_PER_WORKER = 4
+
+WorkItem = namedtuple('WorkItem', ['form', 'preferences', 'timezone_name', 'period_start_time', 'period_end_time',
+                                   'busy_array', 'user_id', 'slot_minutes'])
+
+
+class PreferencesSnapshot(namedtuple('PreferencesSnapshot', ['day_start_time', 'day_end_time', 'calendar_id',
+                                                             'calendars'])):
+    """Picklable copy of the user preferences needed for placement in a worker process."""
+
+    def get_calendars(self):
+        return list(self.calendars)
+
+
+def make_work_item(form, preferences, credentials, slot_minutes=DEFAULT_SLOT_MINUTES):
+    """Returns work item for scheduling form_data on behalf of user, or None if period already over.
+
+    Makes all API requests needed to schedule the events, so the work item can be placed offline
+    in slots of slot_minutes.
+    """
+    name, frequency, period, hours, minutes, timerange, startdate = unpack_form(form)
+    day_start_time, day_end_time, calendar_id, calendars = unpack_preferences(preferences)
+    localtz = get_localtz(credentials, calendar_id)
+
+    period_start_time = get_start_time(startdate, datetime.now(localtz), timerange, localtz, day_start_time, day_end_time)
+    period_end_time = get_end_of_period(period_start_time, period, timerange, localtz, day_start_time, day_end_time)
+    if period_start_time > period_end_time: return None # Can't schedule event by end of day/week
+    multi_period_end = get_end_of_multi_period(period_start_time, period, timerange, localtz, day_start_time, day_end_time)
+    freebusy_ranges = get_freebusy_in_range(credentials, period_start_time, multi_period_end, calendars)
+    snapshot = PreferencesSnapshot(day_start_time, day_end_time, calendar_id, tuple(calendars))
+    return WorkItem(dict(form), snapshot, localtz.zone, period_start_time, period_end_time,
+                    make_busy_array(freebusy_ranges), preferences.user_id, slot_minutes)
+
+
+def schedule_work_items(work_items, max_workers=None):
+    """Returns events to add to user calendar for each work item, in the order provided.
+
+    Work items that could not be scheduled based on availability, or that are None, map to None.
+    """
+    work_items = list(work_items)
+    if not work_items: return []
+    max_workers = max_workers or cpu_count() or 1
+    chunksize = max(1, len(work_items) // (max_workers * CHUNKS_PER_WORKER))
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(_schedule_work_item, work_items, chunksize=chunksize))
+
+
+def _schedule_work_item(work_item):
+    """Returns events to add to user calendar for single work item. Runs in worker process."""
+    if work_item is None: return None
+    localtz = timezone(work_item.timezone_name)
+    return place_events(work_item.form, work_item.preferences, localtz, work_item.period_start_time,
+                        work_item.period_end_time, work_item.busy_array, work_item.slot_minutes, work_item.user_id)
@@ -0,0 +1,64 @@
+"""Module to memoize computed event placements.
+
+Users often resubmit the same schedule form after an overbooked response
+or a double click. Placements are a pure function of the form, the user
+preferences, the timezone, the start of the first period and the busy times
+fetched, so the result of a previous submission, including a failure to
+place events, is returned again without recomputation. Adding events to the
+calendar changes its busy times, so a successful plan is not reused once
+its events have been added.
+
+Exported Functions
+------------------
+make_plan_key(form, preferences, localtz, period_start_time, busy_array, slot_minutes)
+get_plan(key)
+store_plan(key, events)
+clear_plans()
+"""
+
+import threading
+from collections import OrderedDict
+from copy import deepcopy
+from hashlib import sha256
+
+from intention_app.scheduling.utils.scheduling_utils import unpack_form, unpack_preferences
+
+# Maximum number of plans kept, least recently used plans are evicted first.
+MAX_PLANS = 1024
+
+_plans = OrderedDict()
+_plans_lock = threading.Lock()
+
+
+def make_plan_key(form, preferences, localtz, period_start_time, busy_array, slot_minutes):
+    """Returns key identifying the placement computed from the inputs provided."""
+    digest = sha256()
+    digest.update(repr(unpack_form(form)).encode())
+    digest.update(repr(unpack_preferences(preferences)).encode())
+    digest.update(repr((str(localtz), period_start_time.isoformat(), slot_minutes)).encode())
+    digest.update(busy_array.tobytes())
+    return digest.hexdigest()
+
+
+def get_plan(key):
+    """Returns whether or not a plan is cached for key, and the events of the plan (None if it failed)."""
+    with _plans_lock:
+        if key not in _plans: return False, None
+        _plans.move_to_end(key)
+        events = _plans[key]
+    return True, deepcopy(events)
+
+
+def store_plan(key, events):
+    """Caches events placed for key, or None if events could not be placed."""
+    with _plans_lock:
+        _plans[key] = deepcopy(events)
+        _plans.move_to_end(key)
+        while len(_plans) > MAX_PLANS:
+            _plans.popitem(last=False)
+
+
+def clear_plans():
+    """Removes all cached plans."""
+    with _plans_lock:
+        _plans.clear()
@@ -5,79 +5,121 @@ this cal to determine when to schedule new events on behalf of the user.
 
 Exported Functions
 ------------------
-schedule(form, preferences, credentials)
+schedule(form, preferences, credentials, slot_minutes=DEFAULT_SLOT_MINUTES, get_freebusy=None)
+plan_events(form, preferences, credentials, slot_minutes=DEFAULT_SLOT_MINUTES, get_freebusy=None, localtz=None)
+place_events(form, preferences, localtz, period_start_time, period_end_time, busy_array, slot_minutes=DEFAULT_SLOT_MINUTES,
+             user_id=None)
 """
 
 from __future__ import print_function
 
 from datetime import datetime
 
-from intention_app.scheduling.consolidator import consolidate_multiple_periods
+import numpy as np
+
+from intention_app.scheduling.consolidator import consolidate_busy_array, DEFAULT_SLOT_MINUTES
+from intention_app.scheduling.plan_cache import get_plan, make_plan_key, store_plan
+from intention_app.scheduling.utils.availability_index import make_availability_index
+from intention_app.scheduling.utils.datetime_array_utils import add_timedeltas, format_wall_seconds, get_wall_seconds, \
+    SECONDS_IN_DAY
 from intention_app.scheduling.utils.googleapi_utils import *
 from intention_app.scheduling.utils.scheduling_utils import *
 
 
-def schedule(form, preferences, credentials):
+def schedule(form, preferences, credentials, slot_minutes=DEFAULT_SLOT_MINUTES, get_freebusy=None):
     """Schedules events based on form_data and adds them to user Google calendar.
 
     Returns whether or not events were successfully scheduled based on availability.
+    Consolidated availability is tracked in slots of slot_minutes length. Free/busy
+    information is read with get_freebusy if provided, else from the Google API.
     """
-    events = _schedule_events(form, preferences, credentials)
+    events = plan_events(form, preferences, credentials, slot_minutes, get_freebusy)
     if not events: return False
     add_events_to_calendar(credentials, events, preferences.calendar_id)
     return True
 
 
-def _schedule_events(form, preferences, credentials):
-    """Returns events to add to user calendar for multiple consecutive time periods.
+def plan_events(form, preferences, credentials, slot_minutes=DEFAULT_SLOT_MINUTES, get_freebusy=None, localtz=None):
+    """Returns events to add to user calendar for multiple consecutive time periods, without adding them.
 
     If period is day, schedules events daily until the end of the week. If week,
     schedules events weekly until the 2nd to last week of the current month. If
     month, schedules events monthly for the current month and 2 months further.
+    Reuses the plan of a previous identical submission if busy times are unchanged.
+    The timezone of the user calendar is read from Google unless localtz is provided.
     """
     name, frequency, period, hours, minutes, timerange, startdate = unpack_form(form)
     day_start_time, day_end_time, calendar_id, calendars = unpack_preferences(preferences)
-    localtz = get_localtz(credentials, calendar_id)
+    localtz = localtz or get_localtz(credentials, calendar_id)
 
     period_start_time = get_start_time(startdate, datetime.now(localtz), timerange, localtz, day_start_time, day_end_time)
     period_end_time = get_end_of_period(period_start_time, period, timerange, localtz, day_start_time, day_end_time)
     if period_start_time > period_end_time: return None # Can't schedule event by end of day/week
+    multi_period_end = get_end_of_multi_period(period_start_time, period, timerange, localtz, day_start_time, day_end_time)
+    get_freebusy = get_freebusy or get_freebusy_in_range
+    freebusy_ranges = get_freebusy(credentials, period_start_time, multi_period_end, calendars)
+    busy_array = make_busy_array(freebusy_ranges)
+    plan_key = make_plan_key(form, preferences, localtz, period_start_time, busy_array, slot_minutes)
+    cached, events = get_plan(plan_key)
+    if cached: return events
+    events = place_events(form, preferences, localtz, period_start_time, period_end_time, busy_array, slot_minutes,
+                          preferences.user_id)
+    store_plan(plan_key, events)
+    return events
+
+
+def place_events(form, preferences, localtz, period_start_time, period_end_time, busy_array,
+                 slot_minutes=DEFAULT_SLOT_MINUTES, user_id=None):
+    """Returns events to add to user calendar given busy times for the full multi-period.
+
+    Performs no API requests, so may be run for many users at once outside the request cycle.
+    Busy times of the user with user_id are reconsolidated incrementally from their last placement.
+    """
+    name, frequency, period, hours, minutes, timerange, startdate = unpack_form(form)
+    day_start_time, day_end_time, calendar_id, calendars = unpack_preferences(preferences)
     day_start, day_end = get_timerange_start_end_time(period_start_time, timerange, day_start_time, day_end_time)
     event_start = period_start_time
     event_length = get_event_duration(hours, minutes)
     event_start_max = period_end_time - event_length
 
-    events_consolidated = _schedule_events_consolidated_periods(form, preferences, credentials, localtz, period_start_time,
+    events_consolidated = _schedule_events_consolidated_periods(form, preferences, localtz, period_start_time,
                                                                 period_end_time, day_start, day_end, event_start,
-                                                                event_length, event_start_max)
+                                                                event_length, event_start_max, busy_array, slot_minutes,
+                                                                user_id)
     if events_consolidated: return events_consolidated
-    events_multiple = _schedule_events_multiple_periods(form, preferences, credentials, localtz, period_start_time, period_end_time,
-                                                        day_start, day_end, event_start, event_length, event_start_max)
+    events_multiple = _schedule_events_multiple_periods(form, preferences, localtz, period_start_time, period_end_time,
+                                                        day_start, day_end, event_start, event_length, event_start_max,
+                                                        busy_array)
     return events_multiple
 
 
-def _schedule_events_consolidated_periods(form, preferences, credentials, localtz, first_period_start, first_period_end,
-                                          day_start, day_end, event_start, event_length, event_start_max):
+def _schedule_events_consolidated_periods(form, preferences, localtz, first_period_start, first_period_end,
+                                          day_start, day_end, event_start, event_length, event_start_max, busy_array,
+                                          slot_minutes, user_id):
     """Returns events to add to user calendar using consolidated time periods.
 
     Consolidates user calendar free busy information across multiple periods into a
     single period timeframe and attempts to schedule events within that timeframe.
+    The consolidation is kept per user, calendars, and period to be updated next time, if the user is known.
     """
     name, frequency, period, hours, minutes, timerange, startdate = unpack_form(form)
     day_start_time, day_end_time, calendar_id, calendars = unpack_preferences(preferences)
     if period == MONTH: event_start_max = get_28th_of_month(first_period_start, timerange, day_start_time, day_end_time) - event_length
-    multi_period_end = get_end_of_multi_period(first_period_start, period, timerange, localtz, day_start_time, day_end_time)
-    freebusy_ranges = get_freebusy_in_range(credentials, first_period_start, multi_period_end, calendars)
-    consolidated = consolidate_multiple_periods(freebusy_ranges, first_period_start, first_period_end, period, localtz)
+    # Consecutive submissions of the same user mostly share busy ranges, so reconsolidate incrementally.
+    window_key = (user_id, tuple(calendars), period) if user_id is not None else None
+    consolidated = consolidate_busy_array(busy_array, first_period_start, first_period_end, period, localtz, slot_minutes,
+                                          window_key, int(event_length.total_seconds()) // SECONDS_IN_MINUTE)
+    if consolidated is None: return None # No room for a single event.
+    availability = make_availability_index(make_busy_array(consolidated), localtz)
     events = _schedule_events_single_period(form, preferences, localtz, day_start, day_end, event_start, event_length,
-                                            event_start_max, consolidated)
+                                            event_start_max, availability)
     if not events: return None
     num_copies = get_number_periods(first_period_start, period, localtz) - 1
     return _copy_events(events, num_copies, period, name, localtz)
 
 
-def _schedule_events_multiple_periods(form, preferences, credentials, localtz, period_start_time, period_end_time,
-                                      day_start, day_end, event_start, event_length, event_start_max):
+def _schedule_events_multiple_periods(form, preferences, localtz, period_start_time, period_end_time, day_start, day_end,
+                                      event_start, event_length, event_start_max, busy_array):
     """Returns events to add to user calendar for multiple consecutive time periods.
 
     Does not consolidate user calendar free busy information. Rather, schedules across
@@ -86,11 +128,11 @@ def _schedule_events_multiple_periods(form, preferences, credentials, localtz, p
     events = []
     name, frequency, period, hours, minutes, timerange, startdate = unpack_form(form)
     day_start_time, day_end_time, calendar_id, calendars = unpack_preferences(preferences)
-    freebusy_ranges = get_freebusy_in_range(credentials, period_start_time, period_end_time, calendars)
+    availability = make_availability_index(busy_array, localtz)
     num_periods = get_number_periods(period_start_time, period, localtz)
     for i in range(num_periods):
         events_for_single_period = _schedule_events_single_period(form, preferences, localtz, day_start, day_end,
-                                                                  event_start, event_length, event_start_max, freebusy_ranges)
+                                                                  event_start, event_length, event_start_max, availability)
         if not events_for_single_period: return None
         else: events.extend(events_for_single_period)
         period_start_time = get_start_of_next_period(period_start_time, period, timerange, localtz, day_start_time)
@@ -98,64 +140,54 @@ def _schedule_events_multiple_periods(form, preferences, credentials, localtz, p
         event_start = period_start_time
         event_start_max = period_end_time - event_length
         day_start, day_end = get_timerange_start_end_time(period_start_time, timerange, day_start_time, day_end_time)
-        freebusy_ranges = get_freebusy_in_range(credentials, period_start_time, period_end_time, calendars)
     return events
 
 
 def _schedule_events_single_period(form, preferences, localtz, day_start, day_end, event_start, event_length,
-                                   event_start_max, freebusy_ranges):
-    """Returns events to add to user calendar for single period of time."""
+                                   event_start_max, availability):
+    """Returns events to add to user calendar for single period of time.
+
+    Marks each event placed as busy in the availability index provided.
+    """
     events = []
-    freebusy_index = 0
     name, frequency, period, hours, minutes, timerange, startdate = unpack_form(form)
     day_start_time, day_end_time, calendar_id, calendars = unpack_preferences(preferences)
     for i in range(frequency):
         if event_start > event_start_max: return None
-        success, start_time = _find_time_for_single_event(localtz, day_start, day_end, event_start, event_length,
-                                                          event_start_max, freebusy_ranges, freebusy_index)
+        success, start_time = availability.find_first_fit(event_start, event_length, event_start_max, day_start, day_end)
         if not success: return None
+        availability.mark_busy(start_time, start_time + event_length)
         events.append(create_event(name, start_time, start_time + event_length))
         event_start = get_start_of_next_event(start_time, start_time + event_length, period, timerange, localtz, day_start_time)
         if period != DAY: day_start, day_end = get_timerange_start_end_time(event_start, timerange, day_start_time, day_end_time)
-        freebusy_index = update_index_freebusy(freebusy_index, freebusy_ranges, event_start)
     return events
 
 
-def _find_time_for_single_event(localtz, day_start, day_end, event_start, event_length, max_start_time,
-                                freebusy_ranges, freebusy_index):
-    """Returns start and end bounds for single event within timerange provided."""
-    while freebusy_index < len(freebusy_ranges) and event_start <= max_start_time:
-        event_end = event_start + event_length
-        freebusy_index = update_index_freebusy(freebusy_index, freebusy_ranges, event_start)
-        busy_start, busy_end = get_range_freebusy(freebusy_index, freebusy_ranges, localtz)
-
-        # Conflicts with existing event on calendar.
-        if busy_start and is_conflicting(busy_start, busy_end, event_start, event_end):
-            event_start = busy_end
-
-        # If not conflicting above, and in desired timerange, success.
-        elif in_timerange(day_start, day_end, event_start, event_end):
-            break
-
-        # Check if updated start time is outside the desired timerange.
-        if not in_timerange(day_start, day_end, event_start, event_end):
-            day_start += timedelta(days=1)
-            day_end += timedelta(days=1)
-            event_start = day_start
+def _copy_events(events, num_copies, period, name, localtz):
+    """Returns copies of events from one period for num_copies additional periods."""
+    return events + list(_iter_event_copies(events, num_copies, period, name, localtz))
 
-    search_successful = event_start <= max_start_time
-    return search_successful, event_start
 
+def _iter_event_copies(events, num_copies, period, name, localtz):
+    """Yields copies of each event in turn for num_copies additional periods.
 
-def _copy_events(events, num_copies, period, name, localtz):
-    """Returns copies of events from one period for num_copies additional periods."""
-    all_events = events.copy()
-    for event in events:
-        event_start = parse_datetime(event['start']['dateTime']).astimezone(localtz)
-        event_end = parse_datetime(event['end']['dateTime']).astimezone(localtz)
-        for i in range(1, num_copies + 1):
-            delta_to_future_period = get_timedelta_to_future_period(event_start, period, i, localtz)
-            range_start = add_timedelta(delta_to_future_period, event_start, localtz)
-            range_end = add_timedelta(delta_to_future_period, event_end, localtz)
-            all_events.append(create_event(name, range_start, range_end))
-    return all_events
+    Start and end times of all copies are computed at once as arrays of wall clock seconds, in the utc
+    offset of the event copied as add_timedelta keeps it, and are formatted into events as they are yielded.
+    """
+    if not events or num_copies < 1: return
+    starts = [parse_isoformat(event['start']['dateTime']).astimezone(localtz) for event in events]
+    ends = [parse_isoformat(event['end']['dateTime']).astimezone(localtz) for event in events]
+    start_epochs, end_epochs = [np.array([int(dt.timestamp()) for dt in dts], dtype=np.int64) for dts in (starts, ends)]
+    delta_seconds = get_days_to_future_periods(start_epochs, period, num_copies, localtz) * SECONDS_IN_DAY
+    copy_starts, copy_ends = [format_wall_seconds(add_timedeltas(delta_seconds, get_wall_seconds(epochs, localtz)[:, None],
+                                                                 localtz))
+                              for epochs in (start_epochs, end_epochs)]
+    for i in range(len(events)):
+        start_suffix, end_suffix = _get_isoformat_suffix(starts[i]), _get_isoformat_suffix(ends[i])
+        for j in range(num_copies):
+            yield create_event_from_isoformat(name, copy_starts[i, j] + start_suffix, copy_ends[i, j] + end_suffix)
+
+
+def _get_isoformat_suffix(dt):
+    """Returns the part of the isoformat of datetime following its seconds: microseconds, if any, and utc offset."""
+    return dt.isoformat()[len('YYYY-MM-DDTHH:MM:SS'):]
@@ -0,0 +1,89 @@
+"""Module to index free time in a user calendar.
+
+Keeps busy time as a sorted list of disjoint ranges of utc epoch seconds,
+so that the first busy range after any time is found by bisection rather
+than by walking the calendar from the start of each search. Events placed
+by the scheduler or rescheduler are marked busy in the index as they are
+placed, so later searches account for them without further bookkeeping.
+
+Exported Functions
+------------------
+make_availability_index(busy_array, localtz)
+make_availability_index_from_events(events, localtz)
+"""
+
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timedelta
+
+from intention_app.scheduling.utils.scheduling_utils import in_timerange, make_busy_array
+
+
+def make_availability_index(busy_array, localtz):
+    """Returns availability index of busy array rows, as returned by make_busy_array."""
+    index = AvailabilityIndex(localtz)
+    for start, end in busy_array[busy_array[:, 0].argsort()].tolist():
+        index.mark_busy_seconds(start, end)
+    return index
+
+
+def make_availability_index_from_events(events, localtz):
+    """Returns availability index of google calendar events in event resource representation."""
+    freebusy_ranges = [{'start': event['start']['dateTime'], 'end': event['end']['dateTime']} for event in events]
+    return make_availability_index(make_busy_array(freebusy_ranges), localtz)
+
+
+class AvailabilityIndex(object):
+    """Sorted disjoint busy ranges, in utc epoch seconds, of a user calendar.
+
+    Ranges that overlap or touch are merged, so that the range following a
+    busy range always starts strictly after it ends.
+    """
+
+    def __init__(self, localtz):
+        self.localtz = localtz
+        self.starts = []
+        self.ends = []
+
+    def __len__(self):
+        return len(self.starts)
+
+    def mark_busy(self, range_start, range_end):
+        """Marks time between the datetimes provided as busy."""
+        self.mark_busy_seconds(range_start.timestamp(), range_end.timestamp())
+
+    def mark_busy_seconds(self, range_start, range_end):
+        """Marks time between the utc epoch seconds provided as busy, merging it with ranges it touches."""
+        first = bisect_left(self.ends, range_start)
+        last = bisect_right(self.starts, range_end)
+        if first < last:
+            range_start = min(range_start, self.starts[first])
+            range_end = max(range_end, self.ends[last - 1])
+        self.starts[first:last] = [range_start]
+        self.ends[first:last] = [range_end]
+
+    def find_first_fit(self, event_start, event_length, max_start_time, day_start, day_end):
+        """Returns whether or not an event fits by max_start_time, and the earliest start time it fits.
+
+        Searches forward from event_start within the daily window from day_start to day_end,
+        moving to the same window of the following day whenever the event no longer fits in it.
+        """
+        while event_start <= max_start_time:
+            event_end = event_start + event_length
+            index = bisect_right(self.ends, event_start.timestamp())
+
+            # Conflicts with busy range, which is followed by a gap as ranges are merged.
+            if index < len(self.starts) and self.starts[index] < event_end.timestamp():
+                event_start = datetime.fromtimestamp(self.ends[index], self.localtz)
+
+            # If not conflicting above, and in desired timerange, success.
+            elif in_timerange(day_start, day_end, event_start, event_end):
+                break
+
+            # Check if updated start time is outside the desired timerange.
+            if not in_timerange(day_start, day_end, event_start, event_start + event_length):
+                day_start += timedelta(days=1)
+                day_end += timedelta(days=1)
+                event_start = day_start
+
+        search_successful = event_start <= max_start_time
+        return search_successful, event_start
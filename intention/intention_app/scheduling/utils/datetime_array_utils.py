@@ -0,0 +1,145 @@
+"""Module to manipulate arrays of datetimes.
+
+Vectorized counterparts of datetime_utils helpers for arrays of utc epoch
+seconds, using the transition data of pytz timezones so that daylight
+savings information is computed for every element at once.
+
+Exported Functions
+------------------
+get_utc_offsets(epoch_seconds, localtz)
+get_wall_seconds(epoch_seconds, localtz)
+get_dst_flags(wall_seconds, localtz)
+get_day_numbers(wall_seconds)
+get_days_of_month(day_numbers)
+get_months(day_numbers)
+get_weekday_indices(day_numbers)
+get_week_numbers(day_numbers)
+get_days_in_months(day_numbers)
+get_month_timedeltas(epoch_seconds, num_periods, localtz)
+add_timedeltas(delta_seconds, wall_seconds, localtz)
+format_wall_seconds(wall_seconds)
+"""
+
+from datetime import datetime
+from functools import lru_cache
+
+import numpy as np
+
+from intention_app.scheduling.utils.datetime_utils import DAYS_IN_WEEK, SECONDS_IN_MINUTE, MINUTES_IN_HOUR, \
+    HOURS_IN_DAY
+
+SECONDS_IN_HOUR = SECONDS_IN_MINUTE * MINUTES_IN_HOUR
+SECONDS_IN_DAY = SECONDS_IN_HOUR * HOURS_IN_DAY
+
+# Weekday index, zero-indexed from Sunday, of day number 0 (Thursday, January 1st 1970).
+EPOCH_WEEKDAY_INDEX = 4
+
+EPOCH = datetime(1970, 1, 1)
+
+
+def get_utc_offsets(epoch_seconds, localtz):
+    """Returns array of utc offsets in seconds of localtz at each utc epoch second provided."""
+    transition_times, utc_offsets, wall_thresholds, dst_flags = _get_transitions(localtz)
+    indices = np.searchsorted(transition_times, epoch_seconds, side='right') - 1
+    return utc_offsets[np.maximum(indices, 0)]
+
+
+def get_wall_seconds(epoch_seconds, localtz):
+    """Returns array of local wall clock times, as seconds since the epoch, for utc epoch seconds provided."""
+    return np.asarray(epoch_seconds, dtype=np.int64) + get_utc_offsets(epoch_seconds, localtz)
+
+
+def get_dst_flags(wall_seconds, localtz):
+    """Returns array of whether or not each local wall clock time provided is in daylight savings time.
+
+    Matches datetime_utils.is_dst, which treats ambiguous and non-existent wall clock times as standard time.
+    """
+    transition_times, utc_offsets, wall_thresholds, dst_flags = _get_transitions(localtz)
+    indices = np.searchsorted(wall_thresholds, wall_seconds, side='right') - 1
+    return dst_flags[np.maximum(indices, 0)]
+
+
+def get_day_numbers(wall_seconds):
+    """Returns array of days since the epoch of the local wall clock times provided."""
+    return np.floor_divide(wall_seconds, SECONDS_IN_DAY).astype(np.int64)
+
+
+def get_days_of_month(day_numbers):
+    """Returns array of the day of the month, starting from 1, of each day number provided."""
+    days = day_numbers.astype('datetime64[D]')
+    month_starts = days.astype('datetime64[M]').astype('datetime64[D]')
+    return (days - month_starts).astype(np.int64) + 1
+
+
+def get_months(day_numbers):
+    """Returns array of the month, starting from 1, of each day number provided."""
+    return day_numbers.astype('datetime64[D]').astype('datetime64[M]').astype(np.int64) % 12 + 1
+
+
+def get_weekday_indices(day_numbers):
+    """Returns array of the weekday index of each day number provided, zero-indexed from Sunday."""
+    return (day_numbers + EPOCH_WEEKDAY_INDEX) % DAYS_IN_WEEK
+
+
+def get_week_numbers(day_numbers):
+    """Returns array of the number of weeks preceding each day number provided in its month."""
+    return (get_days_of_month(day_numbers) - 1) // DAYS_IN_WEEK
+
+
+def get_days_in_months(day_numbers):
+    """Returns array of the number of days in the month of each day number provided."""
+    months = day_numbers.astype('datetime64[D]').astype('datetime64[M]')
+    return ((months + 1).astype('datetime64[D]') - months.astype('datetime64[D]')).astype(np.int64)
+
+
+def get_month_timedeltas(epoch_seconds, num_periods, localtz):
+    """Returns array of days to the day num_periods months in the future corresponding to each utc epoch second.
+
+    Matches datetime_utils.get_month_timedelta, including the first days of months being reached in steps
+    of 24 hours, so that they may land on another wall clock day than midnight would across daylight savings.
+    """
+    epoch_seconds = np.asarray(epoch_seconds, dtype=np.int64)
+    days = get_day_numbers(get_wall_seconds(epoch_seconds, localtz))
+    month_first_seconds, total_days = epoch_seconds, np.zeros(len(epoch_seconds), dtype=np.int64)
+    for i in range(num_periods):
+        month_days = get_day_numbers(get_wall_seconds(month_first_seconds, localtz))
+        days_left = get_days_in_months(month_days) - get_days_of_month(month_days) + 1
+        month_first_seconds = month_first_seconds + days_left * SECONDS_IN_DAY
+        total_days += days_left
+    month_first_days = get_day_numbers(get_wall_seconds(month_first_seconds, localtz))
+    days_to_target = (get_weekday_indices(days) - get_weekday_indices(month_first_days)) % DAYS_IN_WEEK
+    return total_days + get_week_numbers(days) * DAYS_IN_WEEK + days_to_target
+
+
+def add_timedeltas(delta_seconds, wall_seconds, localtz):
+    """Returns array of local wall clock times incremented by deltas, accounting for daylight savings.
+
+    Matches datetime_utils.add_timedelta, which keeps the utc offset of the time incremented.
+    """
+    new_wall_seconds = wall_seconds + delta_seconds
+    dst_correction = (get_dst_flags(wall_seconds, localtz).astype(np.int64) -
+                      get_dst_flags(new_wall_seconds, localtz).astype(np.int64))
+    return new_wall_seconds + dst_correction * SECONDS_IN_HOUR
+
+
+def format_wall_seconds(wall_seconds):
+    """Returns array of local wall clock times provided in isoformat without utc offset, ie 2019-01-07T09:00:00."""
+    return np.datetime_as_string(np.asarray(wall_seconds, dtype=np.int64).astype('datetime64[s]'), unit='s')
+
+
+@lru_cache(maxsize=None)
+def _get_transitions(localtz):
+    """Returns utc transition times, utc offsets, wall clock transition thresholds, and dst flags of localtz.
+
+    A wall clock time belongs to the period following a transition once it reaches the transition
+    time expressed in the utc offset of that following period, so that wall clock times skipped or
+    repeated around a transition resolve to standard time as in datetime_utils.is_dst.
+    """
+    if not hasattr(localtz, '_utc_transition_times'):
+        utc_offset = int(localtz.utcoffset(EPOCH).total_seconds())
+        return (np.zeros(1, dtype=np.int64), np.array([utc_offset], dtype=np.int64),
+                np.zeros(1, dtype=np.int64), np.zeros(1, dtype=bool))
+    transition_times = np.array([(t - EPOCH).total_seconds() for t in localtz._utc_transition_times], dtype=np.int64)
+    utc_offsets = np.array([info[0].total_seconds() for info in localtz._transition_info], dtype=np.int64)
+    dst_flags = np.array([bool(info[1]) for info in localtz._transition_info], dtype=bool)
+    return transition_times, utc_offsets, transition_times + utc_offsets, dst_flags
@@ -1,6 +1,9 @@
 """Module to manipulate datetime objects.
 
-Manipulates datetime objects over days, weeks, and months.
+Manipulates datetime objects over days, weeks, and months. Period boundaries,
+ie the start of the next week or end of the month, are memoized in boundary
+tables kept per timezone and day settings, so that the scheduler looking up
+the same boundaries every period pays for each only once.
 
 Exported Functions
 ------------------
@@ -29,20 +32,26 @@ get_timerange_start_end_time(day, timerange, day_start_time, day_end_time)
 get_day_start_end_time(day, day_start_time, day_end_time)
 add_timedelta(td, dt, localtz)
 parse_datetime(dt_str)
+parse_isoformat(dt_str)
+parse_epoch_seconds(dt_str)
 is_dst(dt, localtz)
 is_whole_hour(dt)
 get_week_number(day)
 get_weekday_index(day)
 get_month_timedelta(day, num_periods, localtz)
 get_28th_of_month(day, timerange, day_start_time, day_end_time)
+clear_boundary_tables()
 convert_to_military(h, m, ap)
 convert_to_ampm(dt_str)
 """
 
+from collections import OrderedDict
 from datetime import timedelta, time
+from functools import lru_cache, wraps
+from threading import Lock
 from pytz import timezone
 from calendar import monthrange
-from dateutil.parser import parse
+from dateutil.parser import isoparse, parse
 
 # Basic time rates
 SECONDS_IN_MINUTE, MINUTES_IN_HOUR, HOURS_IN_DAY, DAYS_IN_WEEK = 60, 60, 24, 7
@@ -62,6 +71,57 @@ MORNING, AFTERNOON, EVENING = "MORNING", "AFTERNOON", "EVENING"
 # Timerange hours
 AFTERNOON_START, EVENING_START = time(12), time(18) # Military time.
 
+# Boundary tables kept, least recently used evicted first, and boundaries kept per table.
+MAX_BOUNDARY_TABLES, MAX_BOUNDARIES_PER_TABLE = 256, 4096
+
+# Datetime strings kept parsed into epoch seconds, least recently used evicted first.
+MAX_PARSED_INSTANTS = 8192
+
+_boundary_tables = OrderedDict()
+_boundary_tables_lock = Lock()
+
+
+def _memoize_boundary(function):
+    """Memoizes period boundary helper taking a day followed by the timezone and day settings it depends on.
+
+    Boundaries are kept in the table of those settings, least recently used evicted first. A boundary only
+    changes where the local date or utc offset of days a whole number of days away does, which is always
+    on a quarter hour, so days are keyed by their local date, quarter hour and tzinfo, and days from now()
+    in the same quarter hour share a boundary. Days with unhashable tzinfo, ie as parsed by dateutil, are
+    not memoized.
+    """
+    name = function.__name__
+
+    @wraps(function)
+    def memoized(day, *args):
+        key = (name, day.date(), day.hour * 4 + day.minute // 15, day.tzinfo)
+        try:
+            hash(key)
+        except TypeError:
+            return function(day, *args)
+        with _boundary_tables_lock:
+            table = _boundary_tables.get(args)
+            if table is None:
+                table = _boundary_tables[args] = OrderedDict()
+                if len(_boundary_tables) > MAX_BOUNDARY_TABLES: _boundary_tables.popitem(last=False)
+            else:
+                _boundary_tables.move_to_end(args)
+            if key in table:
+                table.move_to_end(key)
+                return table[key]
+        boundary = function(day, *args)
+        with _boundary_tables_lock:
+            table[key] = boundary
+            if len(table) > MAX_BOUNDARIES_PER_TABLE: table.popitem(last=False)
+        return boundary
+    return memoized
+
+
+def clear_boundary_tables():
+    """Discards all memoized period boundaries."""
+    with _boundary_tables_lock:
+        _boundary_tables.clear()
+
 
 def get_start_of_day(day, timerange, day_start_time):
     """Returns day provided set to start hour."""
@@ -73,14 +133,16 @@ def get_start_of_next_day(day, timerange, localtz, day_start_time):
     if day.time() < day_start_time: # Day is past midnight.
         return make_start_hour(day, timerange, day_start_time)
     else:
-        return make_start_hour(get_next_day(day, localtz), timerange, day_start_time)
+        return _get_start_of_following_day(day, timerange, localtz, day_start_time)
 
 
+@_memoize_boundary
 def get_start_of_next_week(day, timerange, localtz, day_start_time):
     """Returns the Sunday of the next week set to start hour."""
     return make_start_hour(get_next_week(day, localtz), timerange, day_start_time)
 
 
+@_memoize_boundary
 def get_start_of_next_month(day, timerange, localtz, day_start_time):
     """Returns the first day of the next month set to start hour."""
     return make_start_hour(get_next_month(day, localtz), timerange, day_start_time)
@@ -91,18 +153,21 @@ def get_end_of_day(day, timerange, day_start_time, day_end_time):
     return make_end_hour(day, timerange, day_start_time, day_end_time)
 
 
+@_memoize_boundary
 def get_end_of_week(day, timerange, localtz, day_start_time, day_end_time):
     """Returns the Saturday of current week set to end hour."""
     last_day_of_week = get_next_week(day, localtz) - timedelta(days=1)
     return make_end_hour(last_day_of_week, timerange, day_start_time, day_end_time)
 
 
+@_memoize_boundary
 def get_end_of_month(day, timerange, localtz, day_start_time, day_end_time):
     """Returns the last day of the current month set to end hour."""
     last_day_of_month = get_next_month(day, localtz) - timedelta(days=1)
     return make_end_hour(last_day_of_month, timerange, day_start_time, day_end_time)
 
 
+@_memoize_boundary
 def get_end_of_quarter(day, timerange, localtz, day_start_time, day_end_time):
     """Returns the last day of the last month in the current quarter set to end hour."""
     last_day_of_quarter = get_next_quarter(day, localtz) - timedelta(days=1)
@@ -148,6 +213,7 @@ def get_days_left_in_quarter(day):
     return days_left
 
 
+@_memoize_boundary
 def get_weeks_left_in_month(day, localtz):
     """Returns number of weeks left in the current month."""
     last_sunday = _get_last_sunday_in_month(day, localtz)
@@ -216,6 +282,23 @@ def parse_datetime(dt_str):
     return parse(dt_str)
 
 
+def parse_isoformat(dt_str):
+    """Returns provided isoformat datetime string, ie of events created by the app, parsed into datetime object.
+
+    Several times faster than parse_datetime, which accepts any format.
+    """
+    return isoparse(dt_str)
+
+
+@lru_cache(maxsize=MAX_PARSED_INSTANTS)
+def parse_epoch_seconds(dt_str):
+    """Returns provided datetime string parsed into utc epoch seconds.
+
+    Memoized, as the busy ranges of a free/busy response are parsed when merged and again when made into an array.
+    """
+    return parse_datetime(dt_str).timestamp()
+
+
 def is_dst(dt, localtz):
     """Returns whether or not datetime provided is in daylight savings time."""
     dt_loc = localtz.localize(dt.replace(tzinfo=None))
@@ -237,6 +320,7 @@ def get_weekday_index(day):
     return (day.weekday() + 1) % DAYS_IN_WEEK
 
 
+@_memoize_boundary
 def get_month_timedelta(day, num_periods, localtz):
     """Returns the timedelta to the day num_periods months in the future corresponding to the provided day.
 
@@ -292,6 +376,12 @@ def _get_last_sunday_in_month(day, localtz):
     return end_of_month - timedelta(days=days_from_sunday)
 
 
+@_memoize_boundary
+def _get_start_of_following_day(day, timerange, localtz, day_start_time):
+    """Returns the day after that provided set to start hour, regardless of day_start_time."""
+    return make_start_hour(get_next_day(day, localtz), timerange, day_start_time)
+
+
 def _get_days_in_month(year, month):
     """Returns number of days in the month provided."""
     return monthrange(year, month)[1]
@@ -0,0 +1,215 @@
+"""Module to interface with Google calendar API asynchronously.
+
+Asyncio counterpart of googleapi_utils for batch jobs that fetch calendars
+for many users at once. Requests share a pooled aiohttp session that bounds
+the total number of open connections, and each user is additionally limited
+in concurrency. Requests draw from the same per user and global token
+buckets of rate_limiter as googleapi_utils, off the event loop, and are
+retried with the same backoff when rejected by Google for exceeding a rate
+limit. Concurrent requests of a user with an expired access token refresh it
+only once. Request bodies and response shapes match those of googleapi_utils,
+and events with ids that already exist are skipped when inserted.
+
+Exported Functions
+------------------
+make_session(max_connections=MAX_CONNECTIONS)
+get_localtz(session, credentials, cid='primary')
+add_events_to_calendar(session, credentials, events, cid='primary')
+update_events_in_calendar(session, credentials, events)
+get_calendars(session, credentials, profile=MINIMAL)
+get_freebusy_in_range(session, credentials, timeMin, timeMax, calendars=['primary'], coalesce=False)
+get_events_in_range(session, credentials, timeMin, timeMax, calendars=['primary'], profile=MINIMAL)
+"""
+
+import asyncio
+from heapq import merge
+from urllib.parse import quote
+from weakref import WeakKeyDictionary
+
+import aiohttp
+from google.auth.transport.requests import Request
+from pytz import timezone
+
+from intention_app.scheduling.utils.googleapi_utils import get_fields, CALENDAR_FIELDS, CALENDAR_LIST_FIELDS, \
+    EVENT_LIST_FIELDS, FREEBUSY_FIELDS, MINIMAL
+from intention_app.scheduling.utils.rate_limiter import drain, get_backoff, get_user_key, is_rate_limit_response, \
+    try_acquire, MAX_RETRIES
+from intention_app.scheduling.utils.scheduling_utils import merge_freebusy, parse_datetime
+
+API_BASE_URL = 'https://www.googleapis.com/calendar/v3'
+
+# Google only serves gzip responses to user agents containing "gzip".
+GZIP_HEADERS = {'Accept-Encoding': 'gzip', 'User-Agent': 'intention (gzip)'}
+
+# Connection pool and per user limits.
+MAX_CONNECTIONS = 100
+MAX_CONCURRENT_REQUESTS_PER_USER = 5
+
+# Per session map of user keys to (semaphore, token refresh lock).
+_user_limits = WeakKeyDictionary()
+
+
+def make_session(max_connections=MAX_CONNECTIONS):
+    """Returns pooled http session to share across all requests of a batch job.
+
+    Must be called from within a running event loop and closed once the job finishes. Error
+    responses are raised by the requests of this module once they are not to be retried.
+    """
+    connector = aiohttp.TCPConnector(limit=max_connections)
+    return aiohttp.ClientSession(connector=connector)
+
+
+async def get_localtz(session, credentials, cid='primary'):
+    """Returns timezone associated with user calendar."""
+    calendar = await _request(session, credentials, 'GET', '/calendars/%s' % quote(cid, safe=''),
+                              params=get_fields(CALENDAR_FIELDS, MINIMAL))
+    timezone_name = calendar['timeZone']
+    return timezone(timezone_name)
+
+
+async def add_events_to_calendar(session, credentials, events, cid='primary'):
+    """Makes API requests to insert new events into user calendar.
+
+    Events with ids that already exist in the calendar are skipped, so inserting them again is idempotent.
+    """
+    path = '/calendars/%s/events' % quote(cid, safe='')
+    await asyncio.gather(*[_insert_event(session, credentials, path, event) for event in events])
+
+
+async def update_events_in_calendar(session, credentials, events):
+    """Makes API requests to update events into user calendar."""
+    cid = None
+    requests = []
+    for event in events:
+        cid = event['organizer']['email']
+        path = '/calendars/%s/events/%s' % (quote(cid, safe=''), quote(event['id'], safe=''))
+        requests.append(_request(session, credentials, 'PUT', path, body=event))
+    await asyncio.gather(*requests)
+    return cid
+
+
+async def get_calendars(session, credentials, profile=MINIMAL):
+    """Returns list of user calendars."""
+    calendars = []
+    page_token = None
+    while True:
+        params = get_fields(CALENDAR_LIST_FIELDS, profile)
+        if page_token: params['pageToken'] = page_token
+        calendar_list = await _request(session, credentials, 'GET', '/users/me/calendarList', params=params)
+        calendars.extend(calendar_list['items'])
+        page_token = calendar_list.get('nextPageToken')
+        if not page_token:
+            break
+    return calendars
+
+
+async def get_freebusy_in_range(session, credentials, timeMin, timeMax, calendars=['primary'], coalesce=False):
+    """Returns free/busy information for user calendar between timeMin and timeMax."""
+    responses = await asyncio.gather(*[_get_freebusy_single_calendar(session, credentials, timeMin, timeMax, cid)
+                                       for cid in calendars])
+    return merge_freebusy(responses, coalesce)
+
+
+async def get_events_in_range(session, credentials, timeMin, timeMax, calendars=['primary'], profile=MINIMAL):
+    """Returns events in user calendar between timeMin and timeMax in order of start time."""
+    responses = await asyncio.gather(*[_get_events_single_calendar(session, credentials, timeMin, timeMax, cid,
+                                                                   profile) for cid in calendars])
+    streams = [[x for x in calendar_events if 'dateTime' in x.get('start', {})] for calendar_events in responses]
+    return list(merge(*streams, key=lambda x : parse_datetime(x['start']['dateTime'])))
+
+
+async def _insert_event(session, credentials, path, event):
+    """Makes API request to insert event, unless it has an id that already exists."""
+    try:
+        await _request(session, credentials, 'POST', path, body=event)
+    except aiohttp.ClientResponseError as error:
+        if 'id' not in event or error.status != 409: raise
+
+
+async def _get_freebusy_single_calendar(session, credentials, timeMin, timeMax, cid):
+    """Returns free/busy information for a single user calendar between timeMin and timeMax."""
+    params = {
+        'timeMin': timeMin.isoformat(),
+        'timeMax': timeMax.isoformat(),
+        'items': [{'id': cid}],
+    }
+    busy_ranges = await _request(session, credentials, 'POST', '/freeBusy', body=params,
+                                 params=get_fields(FREEBUSY_FIELDS, MINIMAL))
+    return busy_ranges['calendars'][cid]['busy']
+
+
+async def _get_events_single_calendar(session, credentials, timeMin, timeMax, cid, profile):
+    """Returns events in a single user calendar between timeMin and timeMax."""
+    events = []
+    page_token = None
+    path = '/calendars/%s/events' % quote(cid, safe='')
+    while True:
+        params = get_fields(EVENT_LIST_FIELDS, profile)
+        params.update({'singleEvents': 'true', 'orderBy': 'startTime', 'showDeleted': 'false', 'maxResults': 1000,
+                       'timeMin': timeMin.isoformat(), 'timeMax': timeMax.isoformat()})
+        if page_token: params['pageToken'] = page_token
+        events_list = await _request(session, credentials, 'GET', path, params=params)
+        events.extend(events_list['items'])
+        page_token = events_list.get('nextPageToken')
+        if not page_token:
+            break
+    return events
+
+
+async def _request(session, credentials, method, path, params=None, body=None):
+    """Returns decoded JSON response of API request made on behalf of user within their limits.
+
+    Retries with backoff if rejected for rate limits, and raises aiohttp.ClientResponseError for other errors.
+    """
+    user_key = get_user_key(credentials)
+    semaphore, refresh_lock = _get_user_limits(session, user_key)
+    loop = asyncio.get_event_loop()
+    for attempt in range(MAX_RETRIES + 1):
+        async with semaphore:
+            await _acquire(user_key)
+            headers = await _get_auth_headers(credentials, refresh_lock)
+            async with session.request(method, API_BASE_URL + path, params=params, json=body,
+                                       headers=headers) as response:
+                if attempt == MAX_RETRIES or not await _is_rate_limit_response(response):
+                    response.raise_for_status()
+                    return await response.json()
+        # Hold back the other requests of the user, in every process, as well.
+        await loop.run_in_executor(None, drain, user_key)
+        await asyncio.sleep(get_backoff(attempt))
+
+
+def _get_user_limits(session, user_key):
+    """Returns concurrency semaphore and token refresh lock for user in session provided."""
+    session_limits = _user_limits.setdefault(session, {})
+    if user_key not in session_limits:
+        session_limits[user_key] = (asyncio.Semaphore(MAX_CONCURRENT_REQUESTS_PER_USER), asyncio.Lock())
+    return session_limits[user_key]
+
+
+async def _acquire(user_key):
+    """Waits until a request of user is within the rate limit buckets, querying them off the event loop."""
+    loop = asyncio.get_event_loop()
+    while True:
+        wait = await loop.run_in_executor(None, try_acquire, user_key)
+        if wait <= 0: return
+        await asyncio.sleep(wait)
+
+
+async def _get_auth_headers(credentials, refresh_lock):
+    """Returns authorization headers for user, refreshing expired access tokens off the event loop.
+
+    Requests waiting on refresh_lock while another request refreshes the token use the refreshed token.
+    """
+    if not credentials.valid:
+        async with refresh_lock:
+            if not credentials.valid:
+                loop = asyncio.get_event_loop()
+                await loop.run_in_executor(None, credentials.refresh, Request())
+    headers = dict(GZIP_HEADERS)
+    credentials.apply(headers)
+    return headers
+
+
+async def _is_rate_limit_response(response):
+    """Returns whether or not the API response is a rejection for exceeding a rate limit."""
+    return response.status >= 400 and is_rate_limit_response(response.status, await response.read())
@@ -0,0 +1,186 @@
+"""Module to record and replay Google calendar API traffic.
+
+Captures every request and response made through googleapi_utils to a
+compact gzipped cassette on disk, with access tokens redacted, and serves
+recorded cassettes back deterministically. Enables repeated offline
+profiling of scheduling and rescheduling against real calendar shapes.
+
+A cassette is activated with the use_cassette context manager, or for a
+whole process with the INTENTION_GOOGLE_API_CASSETTE environment variable
+(and INTENTION_GOOGLE_API_CASSETTE_MODE set to RECORD or REPLAY).
+
+Exported Functions
+------------------
+use_cassette(path, mode=REPLAY, reproduce_latency=False)
+get_cassette_http(credentials)
+is_replaying()
+"""
+
+import gzip
+import json
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+import httplib2
+from google_auth_httplib2 import AuthorizedHttp
+
+# Cassette modes.
+RECORD, REPLAY = 'RECORD', 'REPLAY'
+
+# Query parameters and JSON fields never written to a cassette.
+REDACTED = 'REDACTED'
+REDACTED_PARAMS = ('access_token', 'key', 'token')
+REDACTED_FIELDS = ('access_token', 'refresh_token', 'id_token', 'client_secret')
+
+# Response headers kept in a cassette.
+RECORDED_HEADERS = ('content-type',)
+
+CASSETTE_ENV = 'INTENTION_GOOGLE_API_CASSETTE'
+CASSETTE_MODE_ENV = 'INTENTION_GOOGLE_API_CASSETTE_MODE'
+
+_state = {'cassette': None, 'env_loaded': False}
+_state_lock = threading.Lock()
+
+
+@contextmanager
+def use_cassette(path, mode=REPLAY, reproduce_latency=False):
+    """Routes API requests made within the context through the cassette at path provided."""
+    previous = _state['cassette']
+    _state['cassette'] = _make_cassette(path, mode, reproduce_latency)
+    try:
+        yield
+    finally:
+        _state['cassette'] = previous
+
+
+def get_cassette_http(credentials):
+    """Returns http object to build API services with under the active cassette, or None if none active."""
+    cassette = _get_active_cassette()
+    if cassette is None: return None
+    if cassette['mode'] == REPLAY: return ReplayHttp(cassette)
+    return RecordingHttp(AuthorizedHttp(credentials, http=httplib2.Http()), cassette)
+
+
+def is_replaying():
+    """Returns whether or not API requests are currently served from a recorded cassette."""
+    cassette = _get_active_cassette()
+    return cassette is not None and cassette['mode'] == REPLAY
+
+
+class RecordingHttp(object):
+    """Http object that makes real requests and appends each exchange to the cassette."""
+
+    def __init__(self, http, cassette):
+        self.http = http
+        self.cassette = cassette
+
+    def request(self, uri, method='GET', body=None, headers=None, **kwargs):
+        start = time.time()
+        response, content = self.http.request(uri, method=method, body=body, headers=headers, **kwargs)
+        latency = time.time() - start
+        _write_interaction(self.cassette, {
+            'method': method,
+            'uri': _redact_uri(uri),
+            'body': _redact_body(body),
+            'status': response.status,
+            'headers': {k: v for k, v in response.items() if k in RECORDED_HEADERS},
+            'content': _redact_body(content),
+            'latency': round(latency, 4),
+        })
+        return response, content
+
+
+class ReplayHttp(object):
+    """Http object that serves responses from the cassette instead of making requests."""
+
+    def __init__(self, cassette):
+        self.cassette = cassette
+
+    def request(self, uri, method='GET', body=None, headers=None, **kwargs):
+        interaction = _find_interaction(self.cassette, method, uri, body)
+        if self.cassette['reproduce_latency']: time.sleep(interaction['latency'])
+        response = httplib2.Response(dict(interaction['headers'], status=str(interaction['status'])))
+        return response, (interaction['content'] or '').encode('utf-8')
+
+
+def _make_cassette(path, mode, reproduce_latency):
+    """Returns state of cassette at path, loading recorded interactions if replaying."""
+    cassette = {'path': path, 'mode': mode, 'reproduce_latency': reproduce_latency, 'lock': threading.Lock()}
+    if mode == REPLAY:
+        cassette['exact'] = defaultdict(deque)
+        cassette['by_path'] = defaultdict(deque)
+        cassette['served'] = set()
+        with gzip.open(path, 'rt') as f:
+            for line in f:
+                interaction = json.loads(line)
+                key = (interaction['method'], interaction['uri'], interaction['body'])
+                cassette['exact'][key].append(interaction)
+                cassette['by_path'][(interaction['method'], _get_path(interaction['uri']))].append(interaction)
+    return cassette
+
+
+def _get_active_cassette():
+    """Returns the active cassette, activating the one named in the environment on first use."""
+    if _state['cassette'] is None and not _state['env_loaded']:
+        with _state_lock:
+            if not _state['env_loaded'] and os.environ.get(CASSETTE_ENV):
+                mode = os.environ.get(CASSETTE_MODE_ENV, REPLAY)
+                _state['cassette'] = _make_cassette(os.environ[CASSETTE_ENV], mode, False)
+            _state['env_loaded'] = True
+    return _state['cassette']
+
+
+def _write_interaction(cassette, interaction):
+    """Appends interaction to the cassette file as a line of JSON."""
+    with cassette['lock']:
+        with gzip.open(cassette['path'], 'at') as f:
+            f.write(json.dumps(interaction, sort_keys=True) + '\n')
+
+
+def _find_interaction(cassette, method, uri, body):
+    """Returns next recorded interaction matching the request.
+
+    Requests are matched exactly when possible, and otherwise by method and path in recording
+    order, so that requests with time dependent parameters still replay. An interaction served
+    from either queue is skipped in both. The last interaction for a request is served again
+    once all of its recordings have been replayed.
+    """
+    with cassette['lock']:
+        exact = cassette['exact'].get((method, _redact_uri(uri), _redact_body(body)))
+        queue = exact or cassette['by_path'].get((method, _get_path(uri)))
+        if not queue: raise KeyError('No recorded response for %s %s' % (method, _get_path(uri)))
+        while len(queue) > 1 and id(queue[0]) in cassette['served']:
+            queue.popleft()
+        interaction = queue.popleft() if len(queue) > 1 else queue[0]
+        cassette['served'].add(id(interaction))
+        return interaction
+
+
+def _get_path(uri):
+    """Returns uri without its query string."""
+    return urlsplit(uri).path
+
+
+def _redact_uri(uri):
+    """Returns uri with sensitive query parameters redacted and the remaining parameters sorted."""
+    parts = urlsplit(uri)
+    query = sorted((k, REDACTED if k in REDACTED_PARAMS else v) for k, v in parse_qsl(parts.query))
+    return urlunsplit((parts.scheme, parts.netloc, parts.path, urlencode(query), ''))
+
+
+def _redact_body(body):
+    """Returns request or response body as text with sensitive JSON fields redacted."""
+    if body is None: return None
+    if isinstance(body, bytes): body = body.decode('utf-8')
+    try:
+        decoded = json.loads(body)
+    except ValueError:
+        return body
+    if isinstance(decoded, dict) and any(field in decoded for field in REDACTED_FIELDS):
+        decoded.update({field: REDACTED for field in REDACTED_FIELDS if field in decoded})
+        return json.dumps(decoded)
+    return body
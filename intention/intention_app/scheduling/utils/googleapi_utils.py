@@ -7,100 +7,196 @@ Exported Functions
 get_localtz(credentials, cid='primary')
 add_events_to_calendar(credentials, events, cid='primary')
 update_events_in_calendar(credentials, events, cid="primary")
-get_calendars(credentials)
-get_freebusy_in_range(credentials, timeMin, timeMax, cid='primary')
-get_events_in_range(credentials, timeMin, timeMax, cid='primary')
+get_calendars(credentials, profile=MINIMAL)
+iter_calendars(credentials, profile=MINIMAL)
+get_freebusy_in_range(credentials, timeMin, timeMax, cid='primary', coalesce=False)
+get_events_in_range(credentials, timeMin, timeMax, cid='primary', profile=MINIMAL)
+iter_events_in_range(credentials, timeMin, timeMax, cid='primary', profile=MINIMAL)
+watch_events(credentials, cid, channel_id, address, token, ttl_seconds)
+stop_channel(credentials, channel_id, resource_id)
 create_event(event_name, start_time, end_time)
+create_event_from_isoformat(event_name, start_isoformat, end_isoformat)
+get_fields(fields_by_profile, profile)
 """
 
-from googleapiclient.discovery import build
+from heapq import merge
+
 from pytz import timezone
 
+from intention_app.scheduling.utils.datetime_utils import parse_datetime
+from intention_app.scheduling.utils.googleapi_cassette import get_cassette_http, is_replaying
+from intention_app.scheduling.utils.rate_limiter import execute_with_backoff, get_user_key
+from intention_app.scheduling.utils.scheduling_utils import merge_freebusy
+
 API_SERVICE_NAME = 'calendar'
 API_VERSION = 'v3'
 
+# Response projection profiles. Minimal requests only the fields used for scheduling,
+# full requests complete resources, ie for event bodies sent back in update requests.
+MINIMAL, FULL = 'MINIMAL', 'FULL'
+
+# Partial response fields requested per call site for each projection profile.
+CALENDAR_FIELDS = {MINIMAL: 'timeZone', FULL: None}
+CALENDAR_LIST_FIELDS = {MINIMAL: 'nextPageToken,items(id,summary)', FULL: None}
+FREEBUSY_FIELDS = {MINIMAL: 'calendars', FULL: None}
+EVENT_LIST_FIELDS = {MINIMAL: 'nextPageToken,items(id,summary,start/dateTime,end/dateTime,organizer/email)',
+                     FULL: None}
+
 
 def get_localtz(credentials, cid='primary'):
     """Returns timezone associated with user calendar."""
-    service = build(API_SERVICE_NAME, API_VERSION, credentials=credentials)
-    calendar = service.calendars().get(calendarId=cid).execute()
+    service = _build_service(credentials)
+    calendar = _execute(service.calendars().get(calendarId=cid, **get_fields(CALENDAR_FIELDS, MINIMAL)), credentials)
     timezone_name = calendar['timeZone']
     return timezone(timezone_name)
 
 
 def add_events_to_calendar(credentials, events, cid='primary'):
-    """Makes API requests to insert new events into user calendar."""
+    """Makes API requests to insert new events into user calendar.
+
+    Events with ids that already exist in the calendar are skipped, so inserting them again is idempotent.
+    """
+    from googleapiclient.errors import HttpError
     for event in events:
-        service = build(API_SERVICE_NAME, API_VERSION, credentials=credentials)
-        service.events().insert(calendarId=cid, body=event).execute()
+        service = _build_service(credentials)
+        try:
+            _execute(service.events().insert(calendarId=cid, body=event), credentials)
+        except HttpError as error:
+            if 'id' not in event or error.resp.status != 409: raise
 
 
 def update_events_in_calendar(credentials, events):
     """Makes API requests to update events into user calendar."""
     cid = None
     for event in events:
-        service = build(API_SERVICE_NAME, API_VERSION, credentials=credentials)
+        service = _build_service(credentials)
         cid = event['organizer']['email']
-        service.events().update(calendarId=cid, eventId=event['id'], body=event).execute()
+        _execute(service.events().update(calendarId=cid, eventId=event['id'], body=event), credentials)
     return cid
 
 
-def get_calendars(credentials):
+def get_calendars(credentials, profile=MINIMAL):
     """Returns list of user calendars."""
-    calendars = []
+    return list(iter_calendars(credentials, profile))
+
+
+def iter_calendars(credentials, profile=MINIMAL):
+    """Yields user calendars, requesting each page only once the previous one is consumed."""
     page_token = None
+    fields = get_fields(CALENDAR_LIST_FIELDS, profile)
+    service = _build_service(credentials)
     while True:
-        service = build(API_SERVICE_NAME, API_VERSION, credentials=credentials)
-        calendar_list = service.calendarList().list(pageToken=page_token).execute()
-        calendars.extend(calendar_list['items'])
+        calendar_list = _execute(service.calendarList().list(pageToken=page_token, **fields), credentials)
+        yield from calendar_list['items']
         page_token = calendar_list.get('nextPageToken')
         if not page_token:
             break
-    return calendars
 
 
-def get_freebusy_in_range(credentials, timeMin, timeMax, calendars=['primary']):
-    """Returns free/busy information for user calendar between timeMin and timeMax."""
-    freebusy = []
+def get_freebusy_in_range(credentials, timeMin, timeMax, calendars=['primary'], coalesce=False):
+    """Returns free/busy information for user calendar between timeMin and timeMax.
+
+    Busy ranges of each calendar are merged in order of start time, and combined where
+    they overlap across calendars if coalesce.
+    """
+    freebusy_lists = []
     for cid in calendars:
         params = {
             'timeMin': timeMin.isoformat(),
             'timeMax': timeMax.isoformat(),
             'items': [{'id': cid}],
         }
-        service = build(API_SERVICE_NAME, API_VERSION, credentials=credentials)
-        busy_ranges = service.freebusy().query(body=params).execute()
-        freebusy.extend(busy_ranges['calendars'][cid]['busy'])
-    freebusy.sort(key=lambda x : x['start'])
-    return freebusy
+        service = _build_service(credentials)
+        busy_ranges = _execute(service.freebusy().query(body=params, **get_fields(FREEBUSY_FIELDS, MINIMAL)),
+                               credentials)
+        freebusy_lists.append(busy_ranges['calendars'][cid]['busy'])
+    return merge_freebusy(freebusy_lists, coalesce)
 
 
-def get_events_in_range(credentials, timeMin, timeMax, calendars=['primary']):
+def get_events_in_range(credentials, timeMin, timeMax, calendars=['primary'], profile=MINIMAL):
     """Returns events in user calendar between timeMin and timeMax."""
-    events = []
-    for cid in calendars:
-        page_token = None
-        while True:
-            service = build(API_SERVICE_NAME, API_VERSION, credentials=credentials)
-            events_list = service.events().list(calendarId=cid, pageToken=page_token, singleEvents=True, showDeleted=False,
-                                                maxResults=1000, timeMin=timeMin.isoformat(), timeMax=timeMax.isoformat()).execute()
-            events.extend(events_list['items'])
-            page_token = events_list.get('nextPageToken')
-            if not page_token:
-                break
-    events = [x for x in events if 'dateTime' in x['start']]
-    events.sort(key=lambda x : x['start']['dateTime'])
-    return events
+    return list(iter_events_in_range(credentials, timeMin, timeMax, calendars, profile))
+
+
+def iter_events_in_range(credentials, timeMin, timeMax, calendars=['primary'], profile=MINIMAL):
+    """Yields events in user calendars between timeMin and timeMax in order of start time.
+
+    Each calendar is streamed page by page in start time order and the streams are merged,
+    so consumers that stop early never request the remaining pages. All-day events are skipped.
+    """
+    streams = [_iter_events_single_calendar(credentials, timeMin, timeMax, cid, profile) for cid in calendars]
+    return merge(*streams, key=lambda x : parse_datetime(x['start']['dateTime']))
+
+
+def _iter_events_single_calendar(credentials, timeMin, timeMax, cid, profile):
+    """Yields events in a single user calendar between timeMin and timeMax in order of start time."""
+    page_token = None
+    fields = get_fields(EVENT_LIST_FIELDS, profile)
+    service = _build_service(credentials)
+    while True:
+        events_list = _execute(service.events().list(calendarId=cid, pageToken=page_token, singleEvents=True,
+                                                     orderBy='startTime', showDeleted=False, maxResults=1000,
+                                                     timeMin=timeMin.isoformat(), timeMax=timeMax.isoformat(),
+                                                     **fields), credentials)
+        for event in events_list['items']:
+            if 'dateTime' in event.get('start', {}): yield event
+        page_token = events_list.get('nextPageToken')
+        if not page_token:
+            break
+
+
+def watch_events(credentials, cid, channel_id, address, token, ttl_seconds):
+    """Makes API request to open a channel pushing notifications of event changes in user calendar to address."""
+    body = {
+        'id': channel_id,
+        'type': 'web_hook',
+        'address': address,
+        'token': token,
+        'params': {'ttl': str(ttl_seconds)},
+    }
+    service = _build_service(credentials)
+    return _execute(service.events().watch(calendarId=cid, body=body), credentials)
+
+
+def stop_channel(credentials, channel_id, resource_id):
+    """Makes API request to stop notifications of a channel opened with watch_events."""
+    service = _build_service(credentials)
+    _execute(service.channels().stop(body={'id': channel_id, 'resourceId': resource_id}), credentials)
 
 
 def create_event(event_name, start_time, end_time):
     """Returns body for API request to insert new event."""
+    return create_event_from_isoformat(event_name, start_time.isoformat(), end_time.isoformat())
+
+
+def create_event_from_isoformat(event_name, start_isoformat, end_isoformat):
+    """Returns body for API request to insert new event from times already formatted."""
     return {
             'summary': event_name,
             'start': {
-                'dateTime': start_time.isoformat(),
+                'dateTime': start_isoformat,
             },
             'end': {
-                'dateTime': end_time.isoformat(),
+                'dateTime': end_isoformat,
             },
         }
+
+
+def get_fields(fields_by_profile, profile):
+    """Returns partial response keyword argument, or query parameter, for API request under projection profile."""
+    fields = fields_by_profile[profile]
+    return {'fields': fields} if fields else {}
+
+
+def _build_service(credentials):
+    """Returns calendar API service, routed through the active cassette when recording or replaying."""
+    from googleapiclient.discovery import build # Loaded on first request, as it is slow to import.
+    http = get_cassette_http(credentials)
+    if http: return build(API_SERVICE_NAME, API_VERSION, http=http)
+    return build(API_SERVICE_NAME, API_VERSION, credentials=credentials)
+
+
+def _execute(request, credentials):
+    """Returns response of API request, made within the user and global rate limits."""
+    if is_replaying(): return request.execute() # Replayed requests never reach Google.
+    return execute_with_backoff(request, get_user_key(credentials))
@@ -0,0 +1,134 @@
+"""Module to keep Google API requests within quota across processes.
+
+Token buckets are stored in a local SQLite database so that every worker
+process on the machine draws from the same per user and global buckets
+without the need for an external service. Requests rejected by Google for
+exceeding a rate limit are retried with exponential backoff and jitter.
+
+Exported Functions
+------------------
+get_user_key(credentials)
+acquire(user_key, tokens=1)
+try_acquire(user_key, tokens=1)
+drain(user_key)
+execute_with_backoff(request, user_key)
+is_rate_limit_response(status, content)
+get_backoff(attempt)
+"""
+
+import json
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+from hashlib import sha256
+
+from googleapiclient.errors import HttpError
+
+RATE_LIMIT_DB_PATH = os.environ.get('INTENTION_RATE_LIMIT_DB',
+                                    os.path.join(tempfile.gettempdir(), 'intention_rate_limits.sqlite3'))
+
+# Bucket refill rates (tokens per second) and capacities.
+USER_REQUESTS_PER_SECOND, USER_BURST = 5.0, 10.0
+GLOBAL_REQUESTS_PER_SECOND, GLOBAL_BURST = 50.0, 100.0
+GLOBAL_KEY = 'global'
+
+# Retry parameters for requests rejected for exceeding a rate limit.
+MAX_RETRIES = 5
+BACKOFF_BASE_SECONDS, MAX_BACKOFF_SECONDS = 1.0, 32.0
+RATE_LIMIT_REASONS = ('rateLimitExceeded', 'userRateLimitExceeded')
+
+# Seconds to wait on another process holding the database lock.
+DB_TIMEOUT_SECONDS = 10
+
+_local = threading.local()
+
+
+def get_user_key(credentials):
+    """Returns bucket key for user associated with credentials. Does not store tokens themselves."""
+    token = credentials.refresh_token or credentials.token or ''
+    return 'user:' + sha256(token.encode()).hexdigest()[:32]
+
+
+def acquire(user_key, tokens=1):
+    """Blocks until tokens are available in both the user and global buckets, then consumes them."""
+    while True:
+        wait = try_acquire(user_key, tokens)
+        if wait <= 0: return
+        time.sleep(wait)
+
+
+def execute_with_backoff(request, user_key):
+    """Returns response of executed API request, retrying with backoff if rejected for rate limits."""
+    for attempt in range(MAX_RETRIES + 1):
+        acquire(user_key)
+        try:
+            return request.execute()
+        except HttpError as error:
+            if attempt == MAX_RETRIES or not is_rate_limit_response(error.resp.status, error.content): raise
+            drain(user_key)
+            time.sleep(get_backoff(attempt))
+
+
+def try_acquire(user_key, tokens=1):
+    """Consumes tokens and returns 0 if available in both buckets, else seconds to wait before retrying."""
+    conn = _get_connection()
+    now = time.time()
+    with conn:
+        conn.execute('BEGIN IMMEDIATE')
+        user_tokens = _refill(conn, user_key, USER_REQUESTS_PER_SECOND, USER_BURST, now)
+        global_tokens = _refill(conn, GLOBAL_KEY, GLOBAL_REQUESTS_PER_SECOND, GLOBAL_BURST, now)
+        wait = max((tokens - user_tokens) / USER_REQUESTS_PER_SECOND,
+                   (tokens - global_tokens) / GLOBAL_REQUESTS_PER_SECOND)
+        if wait > 0: return wait
+        _store(conn, user_key, user_tokens - tokens, now)
+        _store(conn, GLOBAL_KEY, global_tokens - tokens, now)
+    return 0
+
+
+def drain(user_key):
+    """Empties user bucket so that all processes back off after a rate limit rejection."""
+    conn = _get_connection()
+    with conn:
+        _store(conn, user_key, 0.0, time.time())
+
+
+def _refill(conn, key, rate, capacity, now):
+    """Returns number of tokens in bucket after refilling for time elapsed since its last update."""
+    row = conn.execute('SELECT tokens, updated FROM buckets WHERE key = ?', (key,)).fetchone()
+    if row is None: return capacity
+    tokens, updated = row
+    return min(capacity, tokens + max(0.0, now - updated) * rate)
+
+
+def _store(conn, key, tokens, now):
+    """Writes token count of bucket to the database."""
+    conn.execute('INSERT OR REPLACE INTO buckets (key, tokens, updated) VALUES (?, ?, ?)', (key, tokens, now))
+
+
+def _get_connection():
+    """Returns connection to rate limit database for the current thread, creating the table if needed."""
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        conn = sqlite3.connect(RATE_LIMIT_DB_PATH, timeout=DB_TIMEOUT_SECONDS, isolation_level=None)
+        conn.execute('CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, tokens REAL, updated REAL)')
+        _local.conn = conn
+    return conn
+
+
+def is_rate_limit_response(status, content):
+    """Returns whether or not the API response of status and content bytes indicates a rate limit was exceeded."""
+    if status == 429: return True
+    if status != 403: return False
+    try:
+        errors = json.loads(content.decode('utf-8'))['error']['errors']
+    except (ValueError, KeyError, TypeError):
+        return False
+    return any(err.get('reason') in RATE_LIMIT_REASONS for err in errors)
+
+
+def get_backoff(attempt):
+    """Returns seconds to wait before retry attempt, exponential in attempt with full jitter."""
+    return random.uniform(0, min(MAX_BACKOFF_SECONDS, BACKOFF_BASE_SECONDS * 2 ** attempt))
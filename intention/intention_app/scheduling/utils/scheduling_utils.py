@@ -11,6 +11,7 @@ unpack_preferences(preferences)
 get_start_time(start_date, curr_time, timerange, localtz, day_start_time, day_end_time)
 get_number_periods(day, period, localtz)
 get_timedelta_to_future_period(day, period, num_periods, localtz)
+get_days_to_future_periods(epoch_seconds, period, num_periods, localtz)
 get_start_of_next_period(curr_period_start_time, period, timerange, localtz, day_start_time)
 get_start_of_next_event(curr_event_start_time, last_scheduled_event_end_time, period, timerange, localtz, day_start_time)
 get_end_of_multi_period(day, period, timerange, localtz, day_start_time, day_end_time)
@@ -22,14 +23,16 @@ get_event_length(event)
 get_event_duration(hours, minutes)
 is_conflicting(range_start, range_end, event_start, event_end)
 in_timerange(range_start, range_end, event_start, event_end)
-get_range_freebusy(index, freebusy_ranges, localtz)
-get_range_gcal_events(index, gcal_events, localtz)
-get_range_rescheduled(index, rescheduled_events)
-update_index_freebusy(index, freebusy_ranges, threshold_time)
-update_index_gcal_events(index, gcal_events, threshold_time)
-update_index_rescheduled(index, rescheduled_events, threshold_time)
+make_busy_array(freebusy_ranges)
+merge_freebusy(freebusy_lists, coalesce=False)
 """
 
+from heapq import merge
+from operator import itemgetter
+
+import numpy as np
+
+from intention_app.scheduling.utils.datetime_array_utils import get_month_timedeltas
 from intention_app.scheduling.utils.datetime_utils import *
 
 # Length scheduled when period is months.
@@ -84,6 +87,18 @@ def get_timedelta_to_future_period(day, period, num_periods, localtz):
     elif period == MONTH: return get_month_timedelta(day, num_periods, localtz)
 
 
+def get_days_to_future_periods(epoch_seconds, period, num_periods, localtz):
+    """Returns array of days to increment each utc epoch second 1 to num_periods periods into the future.
+
+    Row i holds the days of epoch_seconds[i] to each future period, as get_timedelta_to_future_period does.
+    """
+    periods = np.arange(1, num_periods + 1, dtype=np.int64)
+    if period == DAY: return np.tile(periods, (len(epoch_seconds), 1))
+    elif period == WEEK: return np.tile(periods * DAYS_IN_WEEK, (len(epoch_seconds), 1))
+    elif period == MONTH:
+        return np.stack([get_month_timedeltas(epoch_seconds, i, localtz) for i in periods], axis=1)
+
+
 def get_start_of_next_period(curr_period_start_time, period, timerange, localtz, day_start_time):
     """Returns the first day of the next period set to start hour."""
     if period == DAY: return get_start_of_next_day(curr_period_start_time, timerange, localtz, day_start_time)
@@ -172,70 +187,37 @@ def in_timerange(range_start, range_end, event_start, event_end):
             range_start <= event_end <= range_end)
 
 
-def get_range_freebusy(index, freebusy_ranges, localtz):
-    """Returns start and end datetime objects of the event list at index provided.
-
-    Expects list of google calendar freebusy time ranges.
-    """
-    if index < len(freebusy_ranges):
-        range_start = parse_datetime(freebusy_ranges[index]['start']).astimezone(localtz)
-        range_end = parse_datetime(freebusy_ranges[index]['end']).astimezone(localtz)
-        return range_start, range_end
-    else:
-        return None, None
-
-
-def get_range_gcal_events(index, gcal_events, localtz):
-    """Returns start and end datetime objects of the event list at index provided.
-
-    Expects list of google calendar events in event resource representation.
-    """
-    if index < len(gcal_events):
-        range_start = parse_datetime(gcal_events[index]['start']['dateTime']).astimezone(localtz)
-        range_end = parse_datetime(gcal_events[index]['end']['dateTime']).astimezone(localtz)
-        return range_start, range_end
-    else:
-        return None, None
-
-
-def get_range_rescheduled(index, rescheduled_events):
-    """Returns start and end datetime objects of the event list at index provided.
-
-    Expects list of rescheduled events in format (event_object, new_start_time, new_end_time)
-    """
-    if index < len(rescheduled_events):
-        range_start = rescheduled_events[index][1]
-        range_end = rescheduled_events[index][2]
-        return range_start, range_end
-    else:
-        return None, None
-
-
-def update_index_freebusy(index, freebusy_ranges, threshold_time):
-    """Returns index of first event with end time proceeding the threshold time.
-
-    Expects list of google calendar freebusy time ranges.
-    """
-    while index < len(freebusy_ranges) and parse_datetime(freebusy_ranges[index]['end']) <= threshold_time:
-        index += 1
-    return index
-
-
-def update_index_gcal_events(index, gcal_events, threshold_time):
-    """Returns index of first event with end time proceeding the threshold time.
+def make_busy_array(freebusy_ranges):
+    """Returns google calendar freebusy time ranges as an array of (start, end) utc epoch seconds.
 
-    Expects list of google calendar events in event resource representation.
+    The array is compact and picklable, so can be cheaply shipped to worker processes.
     """
-    while index < len(gcal_events) and parse_datetime(gcal_events[index]['end']['dateTime']) <= threshold_time:
-        index += 1
-    return index
+    busy_array = np.empty((len(freebusy_ranges), 2), dtype=np.int64)
+    for i, busy_range in enumerate(freebusy_ranges):
+        busy_array[i, 0] = parse_epoch_seconds(busy_range['start'])
+        busy_array[i, 1] = parse_epoch_seconds(busy_range['end'])
+    return busy_array
 
 
-def update_index_rescheduled(index, rescheduled_events, threshold_time):
-    """Returns index of first event with end time proceeding the threshold time.
+def merge_freebusy(freebusy_lists, coalesce=False):
+    """Returns google calendar freebusy time ranges of lists sorted by start time merged into one sorted list.
 
-    Expects list of rescheduled events in format (event_object, new_start_time, new_end_time)
+    Ranges are ordered by parsed start instant, so lists in differing utc offsets merge correctly.
+    If coalesce, ranges that overlap or touch are combined into a single range. End instants are
+    only parsed if coalesce, and instants are memoized for make_busy_array to look up.
     """
-    while index < len(rescheduled_events) and rescheduled_events[index][2] <= threshold_time:
-        index += 1
-    return index
+    streams = [[(parse_epoch_seconds(busy_range['start']), busy_range) for busy_range in freebusy_ranges]
+               for freebusy_ranges in freebusy_lists]
+    if not coalesce: return [busy_range for range_start, busy_range in merge(*streams, key=itemgetter(0))]
+    freebusy = []
+    last_end = None
+    for range_start, busy_range in merge(*streams, key=itemgetter(0)):
+        range_end = parse_epoch_seconds(busy_range['end'])
+        if freebusy and range_start <= last_end:
+            if range_end > last_end:
+                freebusy[-1] = {'start': freebusy[-1]['start'], 'end': busy_range['end']}
+                last_end = range_end
+        else:
+            freebusy.append(busy_range)
+            last_end = range_end
+    return freebusy
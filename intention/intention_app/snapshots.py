@@ -0,0 +1,97 @@
+"""Module to persist busy times of user calendars in the database.
+
+Serves free/busy information and event times from BusyInterval rows, so
+that they survive restarts and are shared across worker processes. Each
+sync of a calendar window is recorded as a BusyCoverage row; windows not
+covered by a sync newer than SNAPSHOT_MAX_AGE are refetched from Google and
+replace the intervals previously stored for them.
+
+The getters returned have the signatures of the googleapi_utils functions
+they stand in for, so may be passed to the scheduler and rescheduler.
+
+Exported Functions
+------------------
+make_freebusy_getter(user_id)
+make_snapshot_events_getter(user_id)
+invalidate_snapshots(user_id, calendars)
+"""
+
+from datetime import timedelta
+from heapq import merge
+
+from django.db import transaction
+from django.utils import timezone
+
+from intention_app.models import BusyCoverage, BusyInterval
+from intention_app.scheduling.utils import googleapi_utils
+from intention_app.scheduling.utils.datetime_utils import parse_datetime, utc
+from intention_app.scheduling.utils.scheduling_utils import merge_freebusy
+
+SNAPSHOT_MAX_AGE = timedelta(minutes=5)
+
+
+def make_freebusy_getter(user_id):
+    """Returns function with the signature of googleapi_utils.get_freebusy_in_range served from the snapshot."""
+    def get_freebusy(credentials, timeMin, timeMax, calendars=['primary'], coalesce=False):
+        freebusy_lists = []
+        for cid in calendars:
+            intervals = _get_intervals(credentials, user_id, timeMin, timeMax, cid, BusyInterval.FREEBUSY)
+            freebusy_lists.append([{
+                'start': interval.start_utc.isoformat(),
+                'end': interval.end_utc.isoformat(),
+            } for interval in intervals])
+        return merge_freebusy(freebusy_lists, coalesce)
+    return get_freebusy
+
+
+def make_snapshot_events_getter(user_id):
+    """Returns function with the signature of googleapi_utils.iter_events_in_range served from the snapshot.
+
+    Events served only include their id, start and end times.
+    """
+    def get_events(credentials, timeMin, timeMax, calendars=['primary'], profile=googleapi_utils.MINIMAL):
+        streams = [_get_intervals(credentials, user_id, timeMin, timeMax, cid, BusyInterval.EVENTS)
+                   for cid in calendars]
+        return [{
+            'id': interval.event_id,
+            'start': {'dateTime': interval.start_utc.isoformat()},
+            'end': {'dateTime': interval.end_utc.isoformat()},
+        } for interval in merge(*streams, key=lambda x : x.start_utc)]
+    return get_events
+
+
+def invalidate_snapshots(user_id, calendars):
+    """Marks all stored windows of the user calendars provided as stale."""
+    BusyCoverage.objects.filter(user_id=user_id, calendar_id__in=calendars).delete()
+
+
+def _get_intervals(credentials, user_id, time_min, time_max, cid, source):
+    """Returns busy intervals of calendar overlapping range in order of start time, syncing them if stale."""
+    now = timezone.now()
+    covered = BusyCoverage.objects.filter(user_id=user_id, calendar_id=cid, source=source, start_utc__lte=time_min,
+                                          end_utc__gte=time_max, fetched_at__gte=now - SNAPSHOT_MAX_AGE).exists()
+    if not covered: return _sync_intervals(credentials, user_id, time_min, time_max, cid, source, now)
+    return list(BusyInterval.objects.filter(user_id=user_id, calendar_id=cid, source=source, start_utc__lt=time_max,
+                                            end_utc__gt=time_min).order_by('start_utc'))
+
+
+def _sync_intervals(credentials, user_id, time_min, time_max, cid, source, now):
+    """Returns busy intervals of calendar in range fetched from Google, replacing those stored for the range."""
+    if source == BusyInterval.FREEBUSY:
+        ranges = [(busy_range['start'], busy_range['end'], '')
+                  for busy_range in googleapi_utils.get_freebusy_in_range(credentials, time_min, time_max, [cid])]
+    else:
+        ranges = [(event['start']['dateTime'], event['end']['dateTime'], event['id'])
+                  for event in googleapi_utils.iter_events_in_range(credentials, time_min, time_max, [cid])]
+    intervals = [BusyInterval(user_id=user_id, calendar_id=cid, source=source, event_id=event_id,
+                              start_utc=parse_datetime(start).astimezone(utc), end_utc=parse_datetime(end).astimezone(utc),
+                              fetched_at=now) for start, end, event_id in ranges]
+    with transaction.atomic():
+        BusyInterval.objects.filter(user_id=user_id, calendar_id=cid, source=source, start_utc__lt=time_max,
+                                    end_utc__gt=time_min).delete()
+        BusyCoverage.objects.filter(user_id=user_id, calendar_id=cid, source=source, start_utc__lt=time_max,
+                                    end_utc__gt=time_min).delete()
+        BusyInterval.objects.bulk_create(intervals)
+        BusyCoverage.objects.create(user_id=user_id, calendar_id=cid, source=source, start_utc=time_min,
+                                    end_utc=time_max, fetched_at=now)
+    return sorted(intervals, key=lambda x : x.start_utc)
@@ -0,0 +1,204 @@
+"""Module to run the app against a simulated Google calendar API.
+
+FakeCalendarBackend answers the calendar API requests made by
+googleapi_utils from memory, with busy blocks every day on each calendar.
+fake_google_api routes googleapi_utils through a backend and counts the
+services built and requests made, and count_calls counts calls of a helper
+function from every module of the app, so that tests can hold changes to a
+budget of round trips and hot helper calls. The loadtest management command
+serves each synthetic user from a backend of their own, with latency added.
+
+Exported Functions
+------------------
+fake_google_api(backend)
+count_calls(function)
+make_credentials_dict()
+"""
+
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+import sys
+from threading import Lock
+import time
+from unittest import mock
+import uuid
+
+from googleapiclient.errors import HttpError
+from httplib2 import Response
+from pytz import timezone
+
+from intention_app.scheduling.utils import googleapi_utils
+from intention_app.scheduling.utils.datetime_utils import parse_datetime, utc
+
+# Key of the counter of services built in counts of fake_google_api.
+BUILD = 'build'
+
+
+class FakeCalendarBackend:
+    """In-memory Google calendar account answering calendar API requests.
+
+    Every day, each calendar is busy during busy_hours in the account
+    timezone, shifted by half an hour more than the previous calendar
+    so that busy times of different calendars partly overlap.
+    """
+
+    def __init__(self, calendars=('primary',), timezone_name='America/Los_Angeles', busy_hours=((9, 10), (13, 15))):
+        self.calendars = list(calendars)
+        self.timezone_name = timezone_name
+        self.busy_hours = busy_hours
+        self.events = defaultdict(list) # Events written to each calendar, by calendar id.
+
+    def respond(self, name, params):
+        """Returns response to API request of method name, ie 'events.list', with params provided."""
+        return getattr(self, '_' + name.replace('.', '_'))(**params)
+
+    def get_busy_ranges(self, cid, time_min, time_max):
+        """Returns list of (start, end) busy datetimes of calendar overlapping range."""
+        localtz = timezone(self.timezone_name)
+        offset = timedelta(minutes=30 * self.calendars.index(cid)) if cid in self.calendars else timedelta()
+        day = time_min.astimezone(localtz).replace(hour=0, minute=0, second=0, microsecond=0, tzinfo=None)
+        ranges = []
+        while localtz.localize(day) < time_max:
+            for start_hour, end_hour in self.busy_hours:
+                start = localtz.localize(day + timedelta(hours=start_hour) + offset)
+                end = localtz.localize(day + timedelta(hours=end_hour) + offset)
+                if start < time_max and end > time_min: ranges.append((start, end))
+            day += timedelta(days=1)
+        return ranges
+
+    def make_events(self, cid, time_min, time_max):
+        """Returns list of events of calendar overlapping range, in order of start time."""
+        events = [{
+            'id': '%s-%d' % (cid, int(start.timestamp())),
+            'summary': 'busy',
+            'start': {'dateTime': start.isoformat()},
+            'end': {'dateTime': end.isoformat()},
+            'organizer': {'email': cid},
+        } for start, end in self.get_busy_ranges(cid, time_min, time_max)]
+        events += [event for event in self.events[cid]
+                   if parse_datetime(event['start']['dateTime']) < time_max and
+                   parse_datetime(event['end']['dateTime']) > time_min]
+        return sorted(events, key=lambda x : parse_datetime(x['start']['dateTime']))
+
+    def _calendars_get(self, calendarId, fields=None):
+        return {'timeZone': self.timezone_name}
+
+    def _calendarList_list(self, pageToken=None, fields=None):
+        return {'items': [{'id': cid, 'summary': cid} for cid in self.calendars]}
+
+    def _freebusy_query(self, body, fields=None):
+        time_min, time_max = parse_datetime(body['timeMin']), parse_datetime(body['timeMax'])
+        return {'calendars': {item['id']: {'busy': [{
+            'start': start.astimezone(utc).strftime('%Y-%m-%dT%H:%M:%SZ'),
+            'end': end.astimezone(utc).strftime('%Y-%m-%dT%H:%M:%SZ'),
+        } for start, end in self.get_busy_ranges(item['id'], time_min, time_max)]} for item in body['items']}}
+
+    def _events_list(self, calendarId, timeMin, timeMax, pageToken=None, fields=None, **params):
+        return {'items': self.make_events(calendarId, parse_datetime(timeMin), parse_datetime(timeMax))}
+
+    def _events_insert(self, calendarId, body):
+        if any(event['id'] == body.get('id') for event in self.events[calendarId]):
+            raise HttpError(Response({'status': 409}), b'The requested identifier already exists.')
+        event = dict(body, id=body.get('id') or uuid.uuid4().hex, organizer={'email': calendarId})
+        self.events[calendarId].append(event)
+        return event
+
+    def _events_update(self, calendarId, eventId, body):
+        self.events[calendarId] = [event for event in self.events[calendarId] if event['id'] != eventId]
+        self.events[calendarId].append(body)
+        return body
+
+    def _events_watch(self, calendarId, body):
+        expiration = datetime.now(utc) + timedelta(seconds=int(body['params']['ttl']))
+        return {'id': body['id'], 'resourceId': uuid.uuid4().hex, 'expiration': str(int(expiration.timestamp() * 1000))}
+
+    def _channels_stop(self, body):
+        return {}
+
+
+class FakeService:
+    """Calendar API service whose requests are answered by a FakeCalendarBackend."""
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    def __getattr__(self, resource):
+        return lambda : _FakeResource(self.backend, resource)
+
+
+class _FakeResource:
+    def __init__(self, backend, resource):
+        self.backend = backend
+        self.resource = resource
+
+    def __getattr__(self, method):
+        return lambda **params : FakeRequest(self.backend, '%s.%s' % (self.resource, method), params)
+
+
+class FakeRequest:
+    """Calendar API request named by resource and method, ie 'freebusy.query'."""
+
+    def __init__(self, backend, name, params):
+        self.backend = backend
+        self.name = name
+        self.params = params
+
+    def execute(self):
+        return self.backend.respond(self.name, self.params)
+
+
+@contextmanager
+def fake_google_api(backend, latency=0):
+    """Routes calendar API requests of googleapi_utils to backend within the context.
+
+    backend may also be a function of credentials returning the backend of their account. Each request
+    takes latency seconds more, as if made over the network. Yields a Counter of requests made by name,
+    ie 'freebusy.query', and of services built under BUILD. Requests may be made from several threads.
+    """
+    counts = Counter()
+    lock = Lock()
+    get_backend = backend if callable(backend) else lambda credentials : backend
+
+    def build_service(credentials):
+        with lock: counts[BUILD] += 1
+        return FakeService(get_backend(credentials))
+
+    def execute(request, credentials):
+        with lock: counts[request.name] += 1
+        if latency: time.sleep(latency)
+        return request.execute()
+
+    with mock.patch.object(googleapi_utils, '_build_service', build_service), \
+         mock.patch.object(googleapi_utils, '_execute', execute):
+        yield counts
+
+
+@contextmanager
+def count_calls(function):
+    """Counts calls of function from every module of the app within the context.
+
+    The function is replaced in every module that imported it by name, as helpers are
+    mostly star imported, except in this module so that the fake API is not counted.
+    Yields a Counter whose 'calls' are the number of calls made.
+    """
+    counts = Counter()
+
+    def counted(*args, **kwargs):
+        counts['calls'] += 1
+        return function(*args, **kwargs)
+
+    patches = [mock.patch.object(module, name, counted) for module_name, module in list(sys.modules.items())
+               if module_name.startswith('intention_app') and module_name != __name__ and module is not None
+               for name, value in list(vars(module).items()) if value is function]
+    for patch in patches: patch.start()
+    try:
+        yield counts
+    finally:
+        for patch in patches: patch.stop()
+
+
+def make_credentials_dict():
+    """Returns credentials as stored in the session, for use with a fake calendar API."""
+    return {'token': 'token', 'refresh_token': 'refresh-token', 'token_uri': 'https://oauth2.googleapis.com/token',
+            'client_id': 'client-id', 'client_secret': 'client-secret', 'scopes': ['https://www.googleapis.com/auth/calendar']}
@@ -1,3 +1,959 @@
-from django.test import TestCase
+"""Budgets of Google API requests, hot helper calls and database queries per scenario,
+and regression tests of the scheduling engine.
 
-# Create your tests here.
+Requests are answered by the fake calendar API of intention_app.testing. A budget
+test failing here means a change added round trips or helper calls; raise a budget
+only when the extra work is intended.
+"""
+
+import asyncio
+from contextlib import contextmanager
+from datetime import datetime, time, timedelta
+import gzip
+from io import StringIO
+import json
+import os
+import random
+import tempfile
+import threading
+from time import sleep
+from unittest import mock
+
+import aiohttp
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import override_settings, SimpleTestCase, TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone as django_timezone
+from google.auth.exceptions import RefreshError
+from google.oauth2.credentials import Credentials
+from googleapiclient.errors import HttpError
+import httplib2
+from httplib2 import Response
+import numpy as np
+from pytz import timezone
+
+from intention_app.caching import get_busy_array
+from intention_app.credentials import load_credentials
+from intention_app.models import get_preferences, Preferences, SchedulePlan, StoredCredentials, WatchChannel
+from intention_app import prefetch, profiling
+from intention_app.plans import new_token, PLAN_MAX_AGE
+from intention_app.prefetch import warm_calendars
+from intention_app.profiling import read_reports
+from intention_app.scheduling import consolidator, parallel, rescheduler, scheduler
+from intention_app.scheduling.consolidator import clear_consolidations, consolidate_busy_array, \
+    consolidate_multiple_periods, find_free_run
+from intention_app.scheduling.parallel import make_work_item, schedule_work_items
+from intention_app.scheduling.plan_cache import clear_plans
+from intention_app.scheduling.scheduler import place_events
+from intention_app.scheduling.utils import googleapi_async_utils
+from intention_app.scheduling.utils import datetime_utils
+from intention_app.scheduling.utils.datetime_utils import clear_boundary_tables, get_end_of_week, get_next_day, \
+    get_next_week, get_start_of_next_day, get_week_number, get_weekday_index, is_dst, parse_datetime, \
+    parse_epoch_seconds, DAY, MONTH, WEEK
+from intention_app.scheduling.utils.googleapi_cassette import get_cassette_http, use_cassette, RECORD
+from intention_app.scheduling.utils import rate_limiter
+from intention_app.scheduling.utils.rate_limiter import MAX_RETRIES
+from intention_app.scheduling.utils.scheduling_utils import make_busy_array, merge_freebusy
+from intention_app.testing import BUILD, count_calls, fake_google_api, FakeCalendarBackend, make_credentials_dict
+from intention_app.watching import renew_channels, simulate_notification, watch_calendars
+
+CALENDARS = ['primary', 'work', 'family', 'classes']
+TIMEZONE_NAME = 'America/Los_Angeles'
+# Monday morning, so that weekly plans span several weeks of the month.
+NOW = timezone(TIMEZONE_NAME).localize(datetime(2026, 10, 5, 8, 30))
+SCHEDULE_FORM = {'name': 'run', 'frequency': '3', 'period': 'WEEK', 'hours': '1', 'minutes': '0',
+                 'timerange': 'ANYTIME', 'startdate': 'TOMORROW'}
+
+
+class FrozenDatetime(datetime):
+    @classmethod
+    def now(cls, tz=None):
+        return NOW.astimezone(tz) if tz else NOW.replace(tzinfo=None)
+
+
+@contextmanager
+def frozen_now():
+    """Fixes the current time of the scheduler and rescheduler to NOW."""
+    with mock.patch.object(scheduler, 'datetime', FrozenDatetime), \
+         mock.patch.object(rescheduler, 'datetime', FrozenDatetime):
+        yield
+
+
+@override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage', PREFETCH_WORKERS=0)
+class BudgetTestCase(TestCase):
+    """Test case against a fake calendar API with 4 calendars, whose cached state is reset for every test."""
+
+    def setUp(self):
+        cache.clear()
+        clear_plans()
+        clear_boundary_tables()
+        parse_epoch_seconds.cache_clear()
+        clear_consolidations()
+        self.backend = FakeCalendarBackend(CALENDARS, TIMEZONE_NAME)
+        self.user = User.objects.create_user('budget', 'budget@example.com', 'password')
+        self.user.preferences.set_calendars(CALENDARS)
+        self.user.preferences.save()
+        self.preferences = get_preferences(User.objects.get(pk=self.user.pk))
+        self.credentials = Credentials(**make_credentials_dict())
+
+    @contextmanager
+    def assertMaxQueries(self, num):
+        with CaptureQueriesContext(connection) as context:
+            yield
+        self.assertLessEqual(len(context), num, 'Queries over budget:\n%s' %
+                             '\n'.join(query['sql'] for query in context.captured_queries))
+
+    def assertWithinBudget(self, counts, budget):
+        """Asserts counts of API requests, by name, and total requests are within budget."""
+        for name, limit in budget.items():
+            count = sum(count for key, count in counts.items() if key != BUILD) if name == 'total' else counts[name]
+            self.assertLessEqual(count, limit, '%s over budget: %d > %d (%s)' % (name, count, limit, dict(counts)))
+
+
+class SchedulingBudgetTests(BudgetTestCase):
+
+    def test_schedule_three_times_a_week_on_four_calendars(self):
+        with frozen_now(), fake_google_api(self.backend) as api, count_calls(parse_datetime) as parses, \
+             count_calls(is_dst) as dst_checks:
+            self.assertTrue(scheduler.schedule(SCHEDULE_FORM, self.preferences, self.credentials))
+        self.assertEqual(api['events.insert'], 9)
+        # 1 timezone, 1 free/busy query per calendar, 1 insert per event.
+        self.assertWithinBudget(api, {'calendars.get': 1, 'freebusy.query': 4, 'total': 14, BUILD: 14})
+        # Busy ranges of calendars are consolidated as returned, not coalesced, see ConsolidationTests.
+        self.assertLessEqual(parses['calls'], 960)
+        self.assertLessEqual(dst_checks['calls'], 100)
+
+    def test_schedule_resubmitted_reuses_plan(self):
+        with frozen_now(), fake_google_api(self.backend):
+            scheduler.schedule(SCHEDULE_FORM, self.preferences, self.credentials)
+        with frozen_now(), fake_google_api(self.backend) as api, count_calls(is_dst) as dst_checks:
+            self.assertTrue(scheduler.plan_events(SCHEDULE_FORM, self.preferences, self.credentials))
+        # Busy times are refetched, but events are not placed again.
+        self.assertWithinBudget(api, {'calendars.get': 1, 'freebusy.query': 4, 'total': 5})
+        self.assertEqual(dst_checks['calls'], 0)
+
+    def test_boundaries_of_now_memoized(self):
+        tz, now = timezone(TIMEZONE_NAME), localize(2026, 10, 5, 14, 0, 12)
+        days = [now + timedelta(seconds=seconds) for seconds in range(0, 14 * 60, 7)]
+        expected = [(tz.localize(datetime(2026, 10, 6, 8)), tz.localize(datetime(2026, 10, 10, 22)))] * len(days)
+        with count_calls(get_next_day) as next_days, count_calls(get_next_week) as next_weeks:
+            boundaries = [(get_start_of_next_day(day, 'ANYTIME', tz, time(8)),
+                           get_end_of_week(day, 'ANYTIME', tz, time(8), time(22))) for day in days]
+        self.assertEqual(boundaries, expected)
+        # Days from now() in the same quarter hour share boundaries.
+        self.assertEqual((next_days['calls'], next_weeks['calls']), (1, 1))
+        with mock.patch.object(datetime_utils, 'MAX_BOUNDARIES_PER_TABLE', 2), \
+             count_calls(get_next_day) as next_days:
+            for minutes in (15, 30, 15, 45, 15, 30):
+                get_start_of_next_day(now + timedelta(minutes=minutes), 'ANYTIME', tz, time(8))
+        # Least recently used boundaries are evicted first.
+        self.assertEqual(next_days['calls'], 4)
+
+    def test_reschedule_five_events(self):
+        day_start = timezone(TIMEZONE_NAME).localize(datetime(2026, 10, 5, 9))
+        events = []
+        for cid in CALENDARS:
+            events += self.backend.make_events(cid, day_start, day_start + timedelta(hours=15))
+        events = sorted(events[:5], key=lambda x : x['start']['dateTime'])
+        with frozen_now(), fake_google_api(self.backend) as api, count_calls(parse_datetime) as parses, \
+             count_calls(is_dst) as dst_checks:
+            success, cid = rescheduler.reschedule(events, 'TOMORROW', self.preferences, self.credentials)
+        self.assertTrue(success)
+        # 1 timezone, 1 events page per calendar, 1 update per event.
+        self.assertWithinBudget(api, {'calendars.get': 1, 'events.list': 4, 'events.update': 5, 'total': 10,
+                                      BUILD: 10})
+        self.assertLessEqual(parses['calls'], 50)
+        self.assertLessEqual(dst_checks['calls'], 5)
+
+
+class ParallelSchedulingTests(BudgetTestCase):
+
+    def test_work_items_placed_as_serially(self):
+        forms = [dict(SCHEDULE_FORM, period=period, frequency=frequency, timerange=timerange)
+                 for period in ('DAY', 'WEEK', 'MONTH') for frequency in ('1', '3')
+                 for timerange in ('ANYTIME', 'MORNINGS')]
+        # Calendars are busy until 11:42 each morning, so events placed in 15 minute slots start at 11:45 instead.
+        self.backend.busy_hours = ((9, 10.2), (13, 15))
+        for slot_minutes in (1, 15):
+            with self.subTest(slot_minutes=slot_minutes):
+                with frozen_now(), mock.patch.object(parallel, 'datetime', FrozenDatetime), \
+                     fake_google_api(self.backend):
+                    work_items = [make_work_item(form, self.preferences, self.credentials, slot_minutes)
+                                  for form in forms] + [None]
+                serial = [place_events(item.form, item.preferences, timezone(item.timezone_name),
+                                       item.period_start_time, item.period_end_time, item.busy_array, slot_minutes,
+                                       item.user_id) if item else None for item in work_items]
+                self.assertTrue(all(serial[:-1]))
+                self.assertEqual(schedule_work_items(work_items, max_workers=2), serial)
+                if slot_minutes != 1: self.assertNotEqual(serial, default_serial)
+                default_serial = serial
+
+
+class ViewQueryBudgetTests(BudgetTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.user)
+        session = self.client.session
+        session['credentials'] = make_credentials_dict()
+        session.save()
+
+    def test_static_views(self):
+        # Preferences are read once per request, not cached across requests.
+        for view, limit in (('homepage', 2), ('scheduling_options_view', 3), ('calendar_view', 3)):
+            with self.subTest(view=view), self.assertMaxQueries(limit):
+                self.assertEqual(self.client.get(reverse(view)).status_code, 200)
+
+    def test_user_preferences_view(self):
+        with fake_google_api(self.backend), self.assertMaxQueries(5):
+            self.assertEqual(self.client.get(reverse('user_preferences_view')).status_code, 200)
+        with fake_google_api(self.backend), self.assertMaxQueries(7):
+            response = self.client.post(reverse('user_preferences_view'), {'calendar': 'work'})
+        self.assertEqual(response.status_code, 200)
+
+    def test_schedule_view(self):
+        # Syncing the snapshot of each calendar takes 7 queries, and recording the plan 7 more.
+        with frozen_now(), fake_google_api(self.backend) as api, self.assertMaxQueries(48):
+            response = self.client.post(reverse('schedule_view'), SCHEDULE_FORM)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(api['events.insert'], 9)
+        self.assertWithinBudget(api, {'freebusy.query': 4, 'total': 14})
+
+    def test_schedule_view_double_submit(self):
+        self.client.get(reverse('schedule_view'))
+        form = dict(SCHEDULE_FORM, plan_token=new_token())
+        with frozen_now(), fake_google_api(self.backend) as api:
+            self.client.post(reverse('schedule_view'), form)
+            self.client.post(reverse('schedule_view'), form)
+        self.assertEqual(len(self.backend.events['primary']), 9)
+        self.assertWithinBudget(api, {'freebusy.query': 4, 'events.insert': 9})
+
+    def test_schedule_view_edited_resubmit(self):
+        token = new_token()
+        with frozen_now(), fake_google_api(self.backend):
+            self.client.post(reverse('schedule_view'), dict(SCHEDULE_FORM, plan_token=token, preview='1'))
+            response = self.client.post(reverse('schedule_view'), dict(SCHEDULE_FORM, plan_token=token, name='swim'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual({event['summary'] for event in self.backend.events['primary']}, {'swim'})
+        self.assertEqual(SchedulePlan.objects.filter(user=self.user).exclude(token=token).count(), 1)
+
+    def test_schedule_view_stale_token(self):
+        token = new_token()
+        with frozen_now(), fake_google_api(self.backend):
+            self.client.post(reverse('schedule_view'), dict(SCHEDULE_FORM, plan_token=token, preview='1'))
+        SchedulePlan.objects.filter(token=token).update(created_at=django_timezone.now() - PLAN_MAX_AGE * 2)
+        with frozen_now(), fake_google_api(self.backend) as api:
+            response = self.client.post(reverse('schedule_view'), dict(SCHEDULE_FORM, plan_token=token))
+        self.assertNotContains(response, 'overbooked')
+        self.assertWithinBudget(api, {'freebusy.query': 4, 'events.insert': 9})
+        self.assertEqual(len(self.backend.events['primary']), 9)
+
+    def test_schedule_view_plan_expired_while_committing(self):
+        with frozen_now(), fake_google_api(self.backend) as api, \
+             mock.patch('intention_app.plans.commit_plan', return_value=None):
+            response = self.client.post(reverse('schedule_view'), SCHEDULE_FORM)
+        self.assertContains(response, 'That plan expired, please resubmit it.')
+        self.assertWithinBudget(api, {'events.insert': 0})
+
+    def test_schedule_commit_view(self):
+        with frozen_now(), fake_google_api(self.backend) as api:
+            response = self.client.post(reverse('schedule_view'), dict(SCHEDULE_FORM, preview='1'))
+        self.assertWithinBudget(api, {'events.insert': 0})
+        token = response.context['plan_token']
+        with fake_google_api(self.backend) as api:
+            self.assertEqual(self.client.post(reverse('schedule_commit_view'), {'plan_token': token}).status_code, 200)
+        self.assertWithinBudget(api, {'events.insert': 9, 'total': 9})
+        # Committing again is free.
+        with fake_google_api(self.backend) as api, self.assertMaxQueries(6):
+            self.assertEqual(self.client.post(reverse('schedule_commit_view'), {'plan_token': token}).status_code, 200)
+        self.assertWithinBudget(api, {'total': 0})
+        self.assertEqual(len(self.backend.events['primary']), 9)
+
+    def test_reschedule_view(self):
+        with frozen_now(), fake_google_api(self.backend) as api, self.assertMaxQueries(8):
+            self.assertEqual(self.client.get(reverse('reschedule_view')).status_code, 200)
+        self.assertWithinBudget(api, {'events.list': 4, 'total': 5})
+        event_ids = [event_id for event_id in self.client.session['event_map']][:5]
+        with frozen_now(), fake_google_api(self.backend) as api, self.assertMaxQueries(40):
+            response = self.client.post(reverse('reschedule_view'), {'mydata': ','.join(event_ids),
+                                                                     'schedule': 'TOMORROW'})
+        self.assertEqual(response.status_code, 200)
+        self.assertWithinBudget(api, {'events.list': 4, 'events.update': 5, 'total': 10})
+
+    def test_prefetched_views(self):
+        with frozen_now(), mock.patch.object(prefetch, 'datetime', FrozenDatetime), fake_google_api(self.backend):
+            warm_calendars(self.credentials, self.user.pk, self.preferences)
+        with frozen_now(), fake_google_api(self.backend) as api:
+            self.assertEqual(self.client.get(reverse('reschedule_view')).status_code, 200)
+            self.assertEqual(self.client.post(reverse('schedule_view'), dict(SCHEDULE_FORM, preview='1')).status_code,
+                             200)
+        self.assertWithinBudget(api, {'total': 0})
+
+    def test_availability_view(self):
+        query = {'from': '2026-10-06T00:00:00', 'to': '2026-10-13T00:00:00', 'duration': 60}
+        with fake_google_api(self.backend) as api, self.assertMaxQueries(33):
+            self.assertEqual(self.client.get(reverse('availability_view'), query).status_code, 200)
+        self.assertWithinBudget(api, {'calendars.get': 1, 'freebusy.query': 4, 'total': 5})
+        # Repeated queries are served from the cache, after reading the versions of the calendars.
+        with fake_google_api(self.backend) as api, self.assertMaxQueries(5):
+            self.assertEqual(self.client.get(reverse('availability_view'), query).status_code, 200)
+        self.assertWithinBudget(api, {'total': 0})
+
+    def test_calendar_webhook(self):
+        with fake_google_api(self.backend):
+            watch_calendars(make_credentials_dict(), self.user.pk, CALENDARS, 'https://example.com/webhook')
+        channel = WatchChannel.objects.get(user=self.user, calendar_id='work')
+        time_min = timezone(TIMEZONE_NAME).localize(datetime(2026, 10, 6))
+        with fake_google_api(self.backend) as api:
+            get_busy_array(self.credentials, self.user.pk, time_min, time_min + timedelta(days=7), ['work'])
+            get_busy_array(self.credentials, self.user.pk, time_min, time_min + timedelta(days=7), ['work'])
+        self.assertEqual(api['freebusy.query'], 1)
+        with self.assertMaxQueries(7):
+            self.assertEqual(simulate_notification(channel, client=self.client).status_code, 200)
+        # Busy times read after the notification, in any process, are read from Google again.
+        with fake_google_api(self.backend) as api:
+            get_busy_array(self.credentials, self.user.pk, time_min, time_min + timedelta(days=7), ['work'])
+        self.assertEqual(api['freebusy.query'], 1)
+
+    def test_watch_credentials_kept_once_encrypted(self):
+        with tempfile.TemporaryDirectory() as secrets_dir:
+            secrets_path = os.path.join(secrets_dir, 'client_secret.json')
+            with open(secrets_path, 'w') as secrets_file:
+                json.dump({'web': {'client_id': 'client-id', 'client_secret': 'client-secret'}}, secrets_file)
+            with fake_google_api(self.backend):
+                watch_calendars(make_credentials_dict(), self.user.pk, CALENDARS, 'https://example.com/webhook')
+            stored = StoredCredentials.objects.get(user=self.user)
+            # Neither tokens nor the client secret are stored in the clear.
+            for secret in ('client-secret', 'refresh-token'):
+                self.assertNotIn(secret, stored.refresh_token)
+            self.assertNotIn('client-secret', json.dumps(list(StoredCredentials.objects.values())))
+            with override_settings(GOOGLE_CLIENT_SECRETS_FILE=secrets_path):
+                credentials = load_credentials(self.user.pk)
+            self.assertEqual((credentials.token, credentials.refresh_token, credentials.client_secret),
+                             (None, 'refresh-token', 'client-secret'))
+        with fake_google_api(self.backend):
+            watch_calendars(make_credentials_dict(), self.user.pk, [], 'https://example.com/webhook')
+        self.assertFalse(StoredCredentials.objects.exists())
+        self.assertFalse(WatchChannel.objects.exists())
+
+    def test_renew_channels_skips_failing_channels(self):
+        with fake_google_api(self.backend):
+            watch_calendars(make_credentials_dict(), self.user.pk, CALENDARS, 'https://example.com/webhook')
+        WatchChannel.objects.update(expiration=django_timezone.now())
+        errors = {'work': HttpError(Response({'status': 404}), b'Not Found'), 'family': RefreshError('revoked'),
+                  'classes': HttpError(Response({'status': 503}), b'Backend Error')}
+        watch = self.backend._events_watch
+
+        def failing_watch(calendarId, body):
+            if calendarId in errors: raise errors[calendarId]
+            return watch(calendarId, body)
+
+        with fake_google_api(self.backend), mock.patch.object(self.backend, '_events_watch', failing_watch), \
+             self.assertLogs('intention_app.watching', 'WARNING'):
+            self.assertEqual(renew_channels('https://example.com/webhook'), 1)
+        # Channels of revoked credentials or missing calendars are deleted, others are retried on the next run.
+        self.assertEqual(sorted(WatchChannel.objects.values_list('calendar_id', flat=True)), ['classes', 'primary'])
+
+    def test_user_preferences_view_failing_watch(self):
+        def failing_watch(calendarId, body):
+            raise HttpError(Response({'status': 403}), b'Forbidden')
+
+        with override_settings(CALENDAR_WEBHOOK_URL='https://example.com/webhook'), fake_google_api(self.backend), \
+             mock.patch.object(self.backend, '_events_watch', failing_watch), self.assertLogs('intention_app.views'):
+            response = self.client.post(reverse('user_preferences_view'), {'calendars': ['primary', 'work']})
+        self.assertContains(response, 'calendars saved!')
+        self.assertEqual(get_preferences(User.objects.get(pk=self.user.pk)).get_calendars(), ['primary', 'work'])
+
+
+class ProfilingTests(BudgetTestCase):
+
+    def test_staff_profile_query_parameter(self):
+        with tempfile.TemporaryDirectory() as profile_dir, override_settings(PROFILE_DIR=profile_dir):
+            self.client.force_login(self.user)
+            self.client.get(reverse('scheduling_options_view'), {'profile': '1'})
+            self.assertEqual(read_reports(profile_dir), [])
+            self.user.is_staff = True
+            self.user.save()
+            self.client.get(reverse('scheduling_options_view'), {'profile': '1'})
+            [(stats_path, tags)] = read_reports(profile_dir)
+            self.assertTrue(os.path.exists(stats_path))
+            self.assertEqual((tags['view'], tags['status'], tags['calendars']), ('scheduling_options_view', 200, 4))
+
+            out = StringIO()
+            call_command('profile_summary', dir=profile_dir, stdout=out)
+            self.assertIn('scheduling_options_view', out.getvalue())
+
+    def test_peak_skipped_under_tracing_without_reset_peak(self):
+        # tracemalloc of Python before 3.9, already tracing memory.
+        old_tracemalloc = mock.Mock(spec=['is_tracing', 'start', 'stop', 'get_traced_memory', 'clear_traces'])
+        old_tracemalloc.is_tracing.return_value = True
+        old_tracemalloc.get_traced_memory.return_value = (1024, 4096)
+        with tempfile.TemporaryDirectory() as profile_dir, mock.patch.object(profiling, 'tracemalloc', old_tracemalloc), \
+             override_settings(PROFILE_DIR=profile_dir, PROFILE_REQUESTS=True):
+            self.assertEqual(self.client.get(reverse('homepage')).status_code, 200)
+            [(stats_path, tags)] = read_reports(profile_dir)
+            self.assertIsNone(tags['peak_memory_kb'])
+            old_tracemalloc.start.assert_not_called()
+            old_tracemalloc.stop.assert_not_called()
+            old_tracemalloc.clear_traces.assert_not_called()
+
+            out = StringIO()
+            call_command('profile_summary', dir=profile_dir, stdout=out)
+            self.assertIn('homepage', out.getvalue())
+
+
+def localize(*args):
+    """Returns datetime of args localized to TIMEZONE_NAME."""
+    return timezone(TIMEZONE_NAME).localize(datetime(*args))
+
+
+def make_busy_range(start, end):
+    return {'start': start.isoformat(), 'end': end.isoformat()}
+
+
+def get_busy_minutes(busy_ranges):
+    """Returns total number of minutes of busy ranges provided."""
+    return sum((parse_datetime(busy_range['end']) - parse_datetime(busy_range['start'])).total_seconds() // 60
+               for busy_range in busy_ranges)
+
+
+def consolidate_months_per_range(busy_ranges, first_period_start, localtz):
+    """Returns list of (start, end) minutes of (start, end) datetime busy ranges mapped into the first month.
+
+    Maps one range at a time, as month consolidation did before it was vectorized, skipping ranges of
+    zero modulo as it does now.
+    """
+    def get_minutes_between(start_time, end_time):
+        minutes = (end_time - start_time).total_seconds() // 60
+        return minutes + (int(is_dst(end_time, localtz)) - int(is_dst(start_time, localtz))) * 60
+
+    first_seven_days = {}
+    for i in range(7):
+        day = first_period_start + timedelta(days=i)
+        first_seven_days[get_weekday_index(day)] = (day, get_week_number(day))
+    minutes = []
+    for busy_start, busy_end in busy_ranges:
+        busy_start, busy_end = busy_start.astimezone(localtz), busy_end.astimezone(localtz)
+        orig_day, orig_day_week_num = first_seven_days[get_weekday_index(busy_start)]
+        busy_day_week_num = get_week_number(busy_start)
+        if busy_day_week_num < orig_day_week_num or busy_start.day > 28: continue
+        start_minute = int(get_minutes_between(first_period_start, busy_start))
+        end_minute = int(get_minutes_between(first_period_start, busy_end))
+        if busy_start.month != first_period_start.month:
+            modulo = ((busy_start.date() - orig_day.date()).days * 24 * 60 -
+                      (busy_day_week_num - orig_day_week_num) * 7 * 24 * 60)
+            if modulo == 0 or busy_start - timedelta(minutes=modulo) < first_period_start: continue
+            start_minute, end_minute = start_minute % modulo, end_minute % modulo
+        minutes.append((start_minute, end_minute))
+    return minutes
+
+
+class ConsolidationTests(SimpleTestCase):
+    # First period start and end of consolidations by period.
+    PERIODS = {DAY: (localize(2026, 10, 6), localize(2026, 10, 7)),
+               WEEK: (localize(2026, 10, 4), localize(2026, 10, 11)),
+               MONTH: (localize(2026, 10, 1), localize(2026, 10, 29))}
+
+    def consolidate(self, busy_ranges, period):
+        first_period_start, first_period_end = self.PERIODS[period]
+        return consolidate_multiple_periods(busy_ranges, first_period_start, first_period_end, period,
+                                            timezone(TIMEZONE_NAME))
+
+    def test_overlapping_calendars(self):
+        # Busy times of the two calendars joined span more than a day.
+        calendars = [[make_busy_range(localize(2026, 10, 6, 9), localize(2026, 10, 6, 20))],
+                     [make_busy_range(localize(2026, 10, 6, 19), localize(2026, 10, 7, 10))]]
+        for period in (DAY, WEEK, MONTH):
+            with self.subTest(period=period):
+                consolidated = self.consolidate(merge_freebusy(calendars), period)
+                self.assertEqual(self.consolidate(merge_freebusy(calendars, coalesce=True), period), consolidated)
+                self.assertEqual(get_busy_minutes(consolidated), 24 * 60 if period == DAY else 25 * 60)
+
+    def test_busy_ranges_parsed_once(self):
+        calendars = [[make_busy_range(localize(2026, 10, 6, hour), localize(2026, 10, 6, hour, 30))
+                      for hour in range(offset, 24, 2)] for offset in (0, 1)]
+        parse_epoch_seconds.cache_clear()
+        with count_calls(parse_datetime) as parses:
+            busy_ranges = merge_freebusy(calendars)
+            self.assertEqual(parses['calls'], 24)
+            make_busy_array(busy_ranges)
+        # Ends are only parsed for the array, and starts not parsed again.
+        self.assertEqual(parses['calls'], 48)
+        self.assertEqual([busy_range['start'] for busy_range in busy_ranges],
+                         [localize(2026, 10, 6, hour).isoformat() for hour in range(24)])
+
+    def test_range_longer_than_period(self):
+        busy_ranges = [make_busy_range(localize(2026, 10, 12, 9), localize(2026, 10, 21, 12))]
+        self.assertEqual(get_busy_minutes(self.consolidate(busy_ranges, DAY)), 24 * 60)
+        self.assertEqual(get_busy_minutes(self.consolidate(busy_ranges, WEEK)), 7 * 24 * 60)
+
+    def test_vectorized_months_match_per_range(self):
+        localtz = timezone(TIMEZONE_NAME)
+        rng = random.Random(0)
+        # Period starts of the first week, mid month, late in the month, and before daylight saving time starts.
+        for first_period_start in (localize(2026, 10, 1), localize(2026, 10, 12, 8), localize(2026, 10, 27, 9),
+                                   localize(2026, 3, 2, 7)):
+            busy_ranges = []
+            for day in range(92):
+                day_start = first_period_start + timedelta(days=day)
+                for hour in sorted(rng.sample(range(24), 3)):
+                    start = localtz.normalize(day_start.replace(hour=hour, minute=rng.choice([0, 15, 45])))
+                    busy_ranges.append((start, start + timedelta(minutes=rng.choice([30, 60, 150, 600]))))
+            busy_array = np.array([(int(start.timestamp()), int(end.timestamp())) for start, end in busy_ranges],
+                                  dtype=np.int64)
+            with self.subTest(first_period_start=first_period_start):
+                self.assertEqual(list(zip(*consolidator._consolidate_months(busy_array, first_period_start, localtz))),
+                                 consolidate_months_per_range(busy_ranges, first_period_start, localtz))
+
+    def test_months_skip_ranges(self):
+        localtz = timezone(TIMEZONE_NAME)
+        # Monday of week 0 of November, before Monday of week 1 of the period start. The 29th of November.
+        # Sunday the 1st of November, itself the Sunday of the first week of the period, so of modulo 0.
+        for first_period_start, busy_start in ((localize(2026, 10, 12), localize(2026, 11, 2, 9)),
+                                               (localize(2026, 10, 12), localize(2026, 11, 29, 9)),
+                                               (localize(2026, 10, 27), localize(2026, 11, 1, 9))):
+            busy_ranges = [(busy_start, busy_start + timedelta(hours=1))]
+            busy_array = np.array([(int(busy_start.timestamp()), int(busy_start.timestamp()) + 3600)], dtype=np.int64)
+            with self.subTest(busy_start=busy_start):
+                self.assertEqual(consolidate_months_per_range(busy_ranges, first_period_start, localtz), [])
+                self.assertEqual(len(consolidator._consolidate_months(busy_array, first_period_start, localtz)[0]), 0)
+
+    def test_period_without_room_rejected(self):
+        first_period_start, first_period_end = self.PERIODS[DAY]
+        busy_array = make_busy_array([make_busy_range(localize(2026, 10, 6, 9), localize(2026, 10, 6, 12)),
+                                      make_busy_range(localize(2026, 10, 6, 13), localize(2026, 10, 7))])
+        for slot_minutes in (1, 5, 15):
+            with self.subTest(slot_minutes=slot_minutes):
+                consolidate = lambda minutes : consolidate_busy_array(busy_array, first_period_start, first_period_end,
+                                                                      DAY, timezone(TIMEZONE_NAME), slot_minutes,
+                                                                      min_free_minutes=minutes)
+                self.assertEqual(len(consolidate(9 * 60)), 2)
+                self.assertIsNone(consolidate(9 * 60 + 1))
+
+    def test_free_run_padding_bits(self):
+        # 10 slots with the last 7 free, packed with the 6 padding bits of the second byte set.
+        bitmap = np.packbits(np.array([False] * 3 + [True] * 13))
+        self.assertEqual(find_free_run(bitmap, 10, 7), 3)
+        self.assertIsNone(find_free_run(bitmap, 10, 8))
+
+    def test_free_run_start_slot(self):
+        bitmap = np.packbits(np.array([True, True, False, True, True, True, False, False]))
+        self.assertEqual(find_free_run(bitmap, 8, 2), 0)
+        self.assertEqual(find_free_run(bitmap, 8, 2, start_slot=1), 3)
+        self.assertEqual(find_free_run(bitmap, 8, 2, start_slot=4), 4)
+        self.assertIsNone(find_free_run(bitmap, 8, 2, start_slot=5))
+
+    def test_free_run_longer_than_free_slots(self):
+        free = np.zeros(100, dtype=bool)
+        free[37:92] = True
+        bitmap = np.packbits(free)
+        self.assertEqual(find_free_run(bitmap, 100, 55), 37)
+        self.assertIsNone(find_free_run(bitmap, 100, 56))
+        self.assertIsNone(find_free_run(bitmap, 100, 101))
+
+    def test_free_run_not_positive(self):
+        bitmap = np.packbits(np.zeros(8, dtype=bool))
+        self.assertEqual(find_free_run(bitmap, 8, 0), 0)
+        self.assertEqual(find_free_run(bitmap, 8, -1, start_slot=5), 5)
+        self.assertIsNone(find_free_run(bitmap, 8, 0, start_slot=8))
+
+    def test_incremental_matches_full_consolidation(self):
+        # Windows slide a day or two at a time across the end or start of daylight saving time, with busy
+        # ranges entering, leaving and changing between steps, so kept consolidations are rotated and rebuilt.
+        rng = random.Random(0)
+        steps = 0
+        for timezone_name, first_day in (('America/Los_Angeles', datetime(2026, 10, 26)),
+                                         ('Europe/London', datetime(2026, 3, 23)),
+                                         ('Australia/Sydney', datetime(2026, 9, 28))):
+            localtz = timezone(timezone_name)
+            busy_ranges = self.make_busy_ranges(rng, localtz.localize(first_day).timestamp())
+            for period in (DAY, WEEK, MONTH):
+                for slot_minutes in (1, 5, 15):
+                    clear_consolidations()
+                    day = first_day
+                    for step in range(55):
+                        day += timedelta(days=rng.choice([0, 1, 1, 2]))
+                        start = localtz.localize(day.replace(hour=rng.choice([7, 8, 9])))
+                        end = start + timedelta(hours=rng.choice([14, 16]))
+                        window_end = start.timestamp() + rng.choice([7, 28, 60]) * 24 * 60 * 60
+                        window = [busy_range for busy_range in busy_ranges
+                                  if busy_range[1] > start.timestamp() and busy_range[0] < window_end]
+                        if window and rng.random() < 0.5: window.pop(rng.randrange(len(window)))
+                        if rng.random() < 0.5:
+                            moved = start.timestamp() + rng.randrange(5 * 24 * 60 * 60)
+                            window.append((moved, moved + 60 * 60))
+                        busy_array = np.array(sorted(window), dtype=np.int64).reshape(-1, 2)
+                        with self.subTest(timezone=timezone_name, period=period, slot_minutes=slot_minutes, step=step):
+                            self.assertEqual(consolidate_busy_array(busy_array, start, end, period, localtz, slot_minutes,
+                                                                    window_key=(timezone_name, period, slot_minutes)),
+                                             consolidate_busy_array(busy_array, start, end, period, localtz,
+                                                                    slot_minutes))
+                        steps += 1
+        self.assertEqual(steps, 1485)
+
+    def test_consolidations_bounded_by_bytes(self):
+        localtz = timezone(TIMEZONE_NAME)
+        busy_array = make_busy_array([make_busy_range(localize(2026, 10, 6, 9), localize(2026, 10, 6, 12))])
+        clear_consolidations()
+        # Room for the counts of a month, or for a day and a week, but not for all three.
+        max_bytes = 28 * 24 * 60 * 2 + 4 * consolidator.RANGE_BYTES
+        with mock.patch.object(consolidator, 'MAX_CONSOLIDATION_BYTES', max_bytes):
+            for period in (DAY, WEEK, MONTH):
+                first_period_start, first_period_end = self.PERIODS[period]
+                consolidate_busy_array(busy_array, first_period_start, first_period_end, period, localtz,
+                                       window_key=period)
+                self.assertIn(period, consolidator._consolidations)
+            self.assertEqual(list(consolidator._consolidations), [MONTH])
+        self.assertEqual(consolidator._consolidations[MONTH].counts.dtype, np.uint16)
+
+    def test_unchanged_window_packed_once(self):
+        first_period_start, first_period_end = self.PERIODS[WEEK]
+        busy_ranges = [make_busy_range(localize(2026, 10, 6, 9), localize(2026, 10, 6, 12))]
+        clear_consolidations()
+        with mock.patch.object(consolidator.np, 'packbits', wraps=np.packbits) as packbits:
+            for added in (0, 0, 0, 1, 1):
+                busy_array = make_busy_array(busy_ranges + [make_busy_range(localize(2026, 10, 7, 9),
+                                                                            localize(2026, 10, 7, 10))] * added)
+                self.assertEqual(len(consolidate_busy_array(busy_array, first_period_start, first_period_end, WEEK,
+                                                            timezone(TIMEZONE_NAME), 15, window_key=WEEK,
+                                                            min_free_minutes=60)), 1 + added)
+        self.assertEqual(packbits.call_count, 2)
+
+    def test_overflowing_counts_consolidated_anew(self):
+        first_period_start, first_period_end = self.PERIODS[DAY]
+        busy_array = make_busy_array([make_busy_range(localize(2026, 10, 6, 9), localize(2026, 10, 6, 12)),
+                                      make_busy_range(localize(2026, 10, 6, 11), localize(2026, 10, 6, 13))])
+        clear_consolidations()
+        with mock.patch.object(consolidator, 'MAX_BUSY_COUNT', 1):
+            self.assertEqual(consolidate_busy_array(busy_array, first_period_start, first_period_end, DAY,
+                                                    timezone(TIMEZONE_NAME), window_key=DAY),
+                             consolidate_busy_array(busy_array, first_period_start, first_period_end, DAY,
+                                                    timezone(TIMEZONE_NAME)))
+        self.assertNotIn(DAY, consolidator._consolidations)
+
+    @staticmethod
+    def make_busy_ranges(rng, first_epoch):
+        """Returns list of (start, end) utc epoch seconds of random busy ranges from before first_epoch on."""
+        busy_ranges, start = [], first_epoch - 3 * 24 * 60 * 60
+        while start < first_epoch + 70 * 24 * 60 * 60:
+            start += rng.choice([15, 30, 60, 90, 180, 600]) * 60 + rng.choice([0, 0, 0, 7 * 60 + 13])
+            end = start + rng.choice([15, 30, 60, 120, 1500]) * 60
+            busy_ranges.append((start, end))
+            start = end
+        return busy_ranges
+
+
+class FakeAsyncResponse:
+    """aiohttp response of FakeAsyncSession."""
+
+    def __init__(self, status, body):
+        self.status = status
+        self.body = body
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        pass
+
+    async def json(self):
+        return self.body
+
+    async def read(self):
+        return json.dumps(self.body).encode()
+
+    def raise_for_status(self):
+        if self.status >= 400:
+            raise aiohttp.ClientResponseError(None, (), status=self.status)
+
+
+class FakeAsyncSession:
+    """aiohttp session answering requests with the (status, body) responses provided, in order."""
+
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.requests = []
+
+    def request(self, method, url, params=None, json=None, headers=None):
+        self.requests.append((method, url, headers))
+        return FakeAsyncResponse(*self.responses.pop(0))
+
+
+class FakeAsyncCredentials:
+    """Credentials whose access token expired, refreshed in a tenth of a second."""
+
+    def __init__(self):
+        self.refresh_token, self.token, self.valid, self.refreshes = 'refresh', None, False, 0
+
+    def refresh(self, request):
+        sleep(0.1)
+        self.refreshes += 1
+        self.token, self.valid = 'token%d' % self.refreshes, True
+
+    def apply(self, headers):
+        headers['authorization'] = 'Bearer %s' % self.token
+
+
+def make_rate_limit_error(status, reason):
+    return (status, {'error': {'code': status, 'errors': [{'reason': reason}]}})
+
+
+FREEBUSY_RESPONSE = (200, {'calendars': {'primary': {'busy': []}}})
+
+
+@mock.patch.object(rate_limiter, 'BACKOFF_BASE_SECONDS', 0)
+class GoogleApiAsyncTests(SimpleTestCase):
+
+    def setUp(self):
+        rate_limit_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(rate_limit_dir.cleanup)
+        # Requests rejected for rate limits drain the user bucket, refilled instantly here.
+        for name, value in (('RATE_LIMIT_DB_PATH', os.path.join(rate_limit_dir.name, 'rate_limits.sqlite3')),
+                            ('_local', threading.local()), ('USER_REQUESTS_PER_SECOND', 10 ** 6)):
+            patcher = mock.patch.object(rate_limiter, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def run_coroutine(self, coroutine):
+        loop = asyncio.new_event_loop()
+        try:
+            return loop.run_until_complete(coroutine)
+        finally:
+            loop.close()
+
+    def run_requests(self, session, credentials, num_requests=1):
+        async def get_timezones():
+            return await asyncio.gather(*[googleapi_async_utils.get_localtz(session, credentials)
+                                          for _ in range(num_requests)])
+        return self.run_coroutine(get_timezones())
+
+    def test_requests_drawn_from_shared_buckets(self):
+        credentials = FakeAsyncCredentials()
+        with mock.patch.object(rate_limiter, 'USER_REQUESTS_PER_SECOND', 0.001):
+            self.run_requests(FakeAsyncSession([(200, {'timeZone': TIMEZONE_NAME})] * 3), credentials, 3)
+            # The bucket is drawn by googleapi_utils requests of the same user in any process as well.
+            self.assertGreater(rate_limiter.try_acquire(rate_limiter.get_user_key(credentials),
+                                                        rate_limiter.USER_BURST - 2), 0)
+            self.assertEqual(rate_limiter.try_acquire(rate_limiter.get_user_key(credentials),
+                                                      rate_limiter.USER_BURST - 3), 0)
+
+    def test_existing_events_skipped(self):
+        conflict = (409, {'error': {'code': 409, 'errors': [{'reason': 'duplicate'}]}})
+        session = FakeAsyncSession([conflict, conflict])
+        events = [{'id': 'plan0000', 'summary': 'run'}, {'id': 'plan0001', 'summary': 'run'}]
+        self.run_coroutine(googleapi_async_utils.add_events_to_calendar(session, FakeAsyncCredentials(), events))
+        self.assertEqual(len(session.requests), 2)
+        # Events without ids are not known to be the same event.
+        session = FakeAsyncSession([conflict])
+        with self.assertRaises(aiohttp.ClientResponseError) as context:
+            self.run_coroutine(googleapi_async_utils.add_events_to_calendar(session, FakeAsyncCredentials(),
+                                                                            [{'summary': 'run'}]))
+        self.assertEqual(context.exception.status, 409)
+
+    def test_expired_token_refreshed_once(self):
+        credentials = FakeAsyncCredentials()
+        session = FakeAsyncSession([(200, {'timeZone': TIMEZONE_NAME})] * 5)
+        self.assertEqual(self.run_requests(session, credentials, 5), [timezone(TIMEZONE_NAME)] * 5)
+        self.assertEqual(credentials.refreshes, 1)
+        self.assertEqual({headers['authorization'] for method, url, headers in session.requests}, {'Bearer token1'})
+
+    def test_rate_limited_requests_retried(self):
+        for response in (make_rate_limit_error(429, 'rateLimitExceeded'),
+                         make_rate_limit_error(403, 'rateLimitExceeded'),
+                         make_rate_limit_error(403, 'userRateLimitExceeded')):
+            with self.subTest(response=response):
+                session = FakeAsyncSession([response, response, (200, {'timeZone': TIMEZONE_NAME})])
+                self.assertEqual(self.run_requests(session, FakeAsyncCredentials()), [timezone(TIMEZONE_NAME)])
+                self.assertEqual(len(session.requests), 3)
+
+    def test_other_errors_raised(self):
+        session = FakeAsyncSession([make_rate_limit_error(403, 'forbidden'), FREEBUSY_RESPONSE])
+        with self.assertRaises(aiohttp.ClientResponseError) as context:
+            self.run_requests(session, FakeAsyncCredentials())
+        self.assertEqual((context.exception.status, len(session.requests)), (403, 1))
+
+    def test_rate_limited_requests_given_up(self):
+        session = FakeAsyncSession([make_rate_limit_error(429, 'rateLimitExceeded')] * (MAX_RETRIES + 2))
+        with self.assertRaises(aiohttp.ClientResponseError) as context:
+            self.run_requests(session, FakeAsyncCredentials())
+        self.assertEqual((context.exception.status, len(session.requests)), (429, MAX_RETRIES + 1))
+
+
+class StubHttp:
+    """httplib2.Http answering requests with the (status, content) responses of RESPONSES, in order."""
+    RESPONSES = []
+    requests = []
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def request(self, uri, method='GET', body=None, headers=None, **kwargs):
+        StubHttp.requests.append((method, uri, headers))
+        status, content = StubHttp.RESPONSES.pop(0)
+        return httplib2.Response({'status': str(status), 'content-type': 'application/json'}), content.encode()
+
+
+class CassetteTests(SimpleTestCase):
+    API_URL = 'https://www.googleapis.com/calendar/v3'
+    TOKENS = ('secret-access-token', 'secret-refresh-token', 'secret-client-secret', 'secret-new-token')
+
+    def setUp(self):
+        self.credentials = Credentials(**dict(make_credentials_dict(), token='secret-access-token',
+                                              refresh_token='secret-refresh-token',
+                                              client_secret='secret-client-secret'))
+        self.requests = [
+            ('GET', self.API_URL + '/calendars/primary?fields=timeZone&access_token=secret-access-token', None),
+            ('POST', 'https://oauth2.googleapis.com/token', json.dumps({'refresh_token': 'secret-refresh-token',
+                                                                       'client_secret': 'secret-client-secret'})),
+            ('GET', self.API_URL + '/calendars/work/events?page=1', None),
+            ('GET', self.API_URL + '/calendars/work/events?page=1', None),
+            ('GET', self.API_URL + '/calendars/work/events?page=2', None),
+        ]
+        self.responses = [(200, json.dumps({'timeZone': TIMEZONE_NAME})),
+                          (200, json.dumps({'access_token': 'secret-new-token', 'expires_in': 3600})),
+                          (200, '"first"'), (200, '"second"'), (200, '"third"')]
+
+    def record(self, path):
+        with mock.patch.object(httplib2, 'Http', StubHttp), \
+             mock.patch.object(StubHttp, 'RESPONSES', list(self.responses)), \
+             mock.patch.object(StubHttp, 'requests', []), use_cassette(path, RECORD):
+            http = get_cassette_http(self.credentials)
+            for method, uri, body in self.requests:
+                http.request(uri, method, body=body)
+            self.assertEqual(StubHttp.requests[0][2]['authorization'], 'Bearer secret-access-token')
+
+    def test_recorded_cassette_redacted(self):
+        with tempfile.TemporaryDirectory() as cassette_dir:
+            path = os.path.join(cassette_dir, 'cassette.jsonl.gz')
+            self.record(path)
+            with gzip.open(path, 'rt') as f:
+                recorded = f.read()
+        self.assertEqual(len(recorded.splitlines()), len(self.requests))
+        for token in self.TOKENS:
+            self.assertNotIn(token, recorded)
+
+    def test_replayed_interactions_served_once(self):
+        with tempfile.TemporaryDirectory() as cassette_dir:
+            path = os.path.join(cassette_dir, 'cassette.jsonl.gz')
+            self.record(path)
+            with use_cassette(path):
+                http = get_cassette_http(self.credentials)
+                replay = lambda uri : http.request(self.API_URL + uri)[1].decode()
+                # Matched by path, then exactly: the first recording of page 1 is not served twice.
+                self.assertEqual([replay('/calendars/work/events?page=9'), replay('/calendars/work/events?page=1'),
+                                  replay('/calendars/work/events?page=2')], ['"first"', '"second"', '"third"'])
+                self.assertEqual(replay('/calendars/work/events?page=1'), '"second"')
+                self.assertEqual(json.loads(replay('/calendars/primary?access_token=other-token&fields=timeZone')),
+                                 {'timeZone': TIMEZONE_NAME})
+
+
+class FakeClock:
+    """Time module of rate_limiter whose sleeps advance its time instantly."""
+
+    def __init__(self):
+        self.now, self.sleeps = 1000.0, []
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        # At least a millisecond passes, as on a real clock, so waits shorter than float precision still end.
+        self.sleeps.append(seconds)
+        self.now += max(seconds, 0.001)
+
+
+class FlakyRequest:
+    """API request raising the errors provided, in order, before succeeding."""
+
+    def __init__(self, errors):
+        self.errors, self.executions = list(errors), 0
+
+    def execute(self):
+        self.executions += 1
+        if self.errors: raise self.errors.pop(0)
+        return {'ok': True}
+
+
+def make_http_error(status, reason):
+    content = json.dumps({'error': {'code': status, 'errors': [{'reason': reason}]}}).encode()
+    return HttpError(Response({'status': status}), content)
+
+
+class RateLimiterTests(SimpleTestCase):
+
+    def setUp(self):
+        rate_limit_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(rate_limit_dir.cleanup)
+        self.clock = FakeClock()
+        for name, value in (('RATE_LIMIT_DB_PATH', os.path.join(rate_limit_dir.name, 'rate_limits.sqlite3')),
+                            ('_local', threading.local()), ('time', self.clock)):
+            patcher = mock.patch.object(rate_limiter, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.addCleanup(lambda : rate_limiter._local.__dict__.get('conn') and rate_limiter._local.conn.close())
+
+    def test_rate_limited_requests_retried(self):
+        for error in (make_http_error(429, 'rateLimitExceeded'), make_http_error(403, 'rateLimitExceeded'),
+                      make_http_error(403, 'userRateLimitExceeded')):
+            with self.subTest(status=error.resp.status, content=error.content):
+                request = FlakyRequest([error, error])
+                self.assertEqual(rate_limiter.execute_with_backoff(request, 'user:retried'), {'ok': True})
+                self.assertEqual(request.executions, 3)
+
+    def test_other_forbidden_errors_raised(self):
+        request = FlakyRequest([make_http_error(403, 'forbidden')])
+        with self.assertRaises(HttpError):
+            rate_limiter.execute_with_backoff(request, 'user:forbidden')
+        self.assertEqual((request.executions, self.clock.sleeps), (1, []))
+
+    def test_rate_limited_requests_given_up(self):
+        request = FlakyRequest([make_http_error(429, 'rateLimitExceeded')] * (MAX_RETRIES + 1))
+        with self.assertRaises(HttpError):
+            rate_limiter.execute_with_backoff(request, 'user:given-up')
+        self.assertEqual(request.executions, MAX_RETRIES + 1)
+
+    def test_bucket_refill_and_drain(self):
+        # A full bucket serves a burst without waiting, then one request per refill.
+        for _ in range(int(rate_limiter.USER_BURST)): rate_limiter.acquire('user:burst')
+        self.assertEqual(self.clock.sleeps, [])
+        rate_limiter.acquire('user:burst')
+        self.assertEqual(len(self.clock.sleeps), 1)
+        self.assertAlmostEqual(self.clock.sleeps[0], 1 / rate_limiter.USER_REQUESTS_PER_SECOND)
+        # Other users draw from buckets of their own, and a full second refills 5 tokens.
+        rate_limiter.acquire('user:other')
+        self.clock.now += 1
+        for _ in range(int(rate_limiter.USER_REQUESTS_PER_SECOND)): rate_limiter.acquire('user:burst')
+        self.assertEqual(len(self.clock.sleeps), 1)
+        # A rate limit rejection drains the bucket of the user, in every process sharing the database.
+        self.clock.now += 60
+        rate_limiter.drain('user:burst')
+        rate_limiter.acquire('user:burst')
+        self.assertEqual(len(self.clock.sleeps), 2)
+        self.assertAlmostEqual(self.clock.sleeps[1], 1 / rate_limiter.USER_REQUESTS_PER_SECOND)
+
+
+class PreferencesTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user('preferences', 'preferences@example.com', 'password')
+
+    def test_saved_preferences_read_through_fresh_user(self):
+        preferences = get_preferences(User.objects.get(pk=self.user.pk))
+        preferences.set_calendars(['primary', 'work'])
+        preferences.save(update_fields=['calendars'])
+        self.assertEqual(get_preferences(User.objects.get(pk=self.user.pk)).get_calendars(), ['primary', 'work'])
+
+    def test_preferences_saved_by_another_process(self):
+        get_preferences(User.objects.get(pk=self.user.pk))
+        # Written without signals, as seen from a worker process other than the one that saved.
+        Preferences.objects.filter(user=self.user).update(day_start_time=time(hour=6))
+        self.assertEqual(get_preferences(User.objects.get(pk=self.user.pk)).day_start_time, time(hour=6))
+
+    def test_preferences_read_once_per_request_user(self):
+        user = User.objects.get(pk=self.user.pk)
+        with self.assertNumQueries(1):
+            self.assertIs(get_preferences(user), get_preferences(user))
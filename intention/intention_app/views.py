@@ -1,22 +1,37 @@
+"""Views of the intention app.
+
+The Google client libraries, NumPy and the scheduling engine are imported
+within the views that use them rather than at module level, so that
+loading the URL configuration, ie on worker boot or for management
+commands, does not pay for them. See the importtime management command.
+"""
+
+from datetime import datetime, time, timedelta
+import logging
+
+from django.conf import settings
 from django.contrib.auth.decorators import login_required
-from django.http import HttpResponse, HttpResponseRedirect
+from django.http import HttpResponse, HttpResponseRedirect, JsonResponse
 from django.shortcuts import render
 from django.template import loader
 from django.urls import reverse
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
 
-from intention_app.scheduling.rescheduler import get_events_current_day, reschedule
-from intention_app.scheduling.scheduler import schedule
-from intention_app.scheduling.utils.datetime_utils import convert_to_ampm
-from intention_app.scheduling.utils.googleapi_utils import get_calendars
-from .forms import *
+from intention_app.scheduling.utils.datetime_utils import convert_to_ampm, parse_datetime, HOURS_IN_DAY, \
+    MINUTES_IN_HOUR
+from .forms import AllCalsForm, MainCalForm, ScheduleForm, TimeForm
+from .models import get_preferences, TIMERANGE_CHOICES
 
-CLIENT_SECRETS_FILE = 'client_secret.json'
+CLIENT_SECRETS_FILE = settings.GOOGLE_CLIENT_SECRETS_FILE
 SCOPES = ['https://www.googleapis.com/auth/calendar']
+AVAILABILITY_DEFAULT_DAYS, AVAILABILITY_MAX_DAYS = 7, 31
+AVAILABILITY_DEFAULT_SLOTS, AVAILABILITY_MAX_SLOTS = 10, 100
 MONTHS = {'01': 'January', '02': 'February', '03': 'March', '04': 'April', '05': 'May', '06': 'June',
           '07': 'July', '08': 'August', '09':'September', '10': 'October', '11': 'November', '12': 'December'}
 
+logger = logging.getLogger(__name__)
+
 
 def homepage_view(request):
     """Application homepage. Links to login and introduces user to product."""
@@ -26,7 +41,13 @@ def homepage_view(request):
 
 @login_required
 def scheduling_options_view(request):
-    """Follows log-in - allows user to choose from available scheduling options"""
+    """Follows log-in - allows user to choose from available scheduling options.
+
+    Prefetches the calendars of authorized users in the background, for whichever option they choose.
+    """
+    if 'credentials' in request.session:
+        from intention_app.prefetch import prefetch_calendars
+        prefetch_calendars(request.session['credentials'], request.user.pk, get_preferences(request.user))
     template = loader.get_template('scheduling_options.html')
     context = {}
     return HttpResponse(template.render(context, request))
@@ -58,14 +79,22 @@ def user_preferences_view(request):
         if 'sleep_time' in request.POST:
             time_form = TimeForm(request.POST)
             if time_form.is_valid():
-                save_sleep_time(request)
-                save_wake_time(request)
+                save_day_times(request)
                 message = "sleep and wake times saved!"
         elif 'calendar' in request.POST:
             save_calendar(request)
             message = "calendar choice saved!"
         elif 'calendars' in request.POST:
             save_calendars(request)
+            if settings.CALENDAR_WEBHOOK_URL:
+                from google.auth.exceptions import RefreshError
+                from googleapiclient.errors import HttpError
+                from intention_app.watching import watch_calendars
+                try:
+                    watch_calendars(request.session['credentials'], request.user.pk,
+                                    request.POST.getlist('calendars'), settings.CALENDAR_WEBHOOK_URL)
+                except (RefreshError, HttpError): # Calendars are saved, only without push notifications.
+                    logger.exception('Failed to watch calendars of user %s', request.user.pk)
             message = "calendars saved!"
         context = {
             'message': message,
@@ -78,44 +107,63 @@ def user_preferences_view(request):
 
 @login_required
 def schedule_view(request):
-    """Displays and submits scheduleForm - allows user to schedule events on their calendar."""
+    """Displays and submits scheduleForm - allows user to schedule events on their calendar.
+
+    Submitting the form plans events under the token of the form, then commits the plan unless a preview
+    is requested. Submitting the same form twice never schedules or writes its events twice.
+    """
     if 'credentials' not in request.session:
         request.session['endurl'] = _build_full_view_url(request, 'schedule_view')
         return HttpResponseRedirect('authorize')
 
     # User first arrives at scheduling page.
     if request.method == "GET":
-        form = ScheduleForm()
-        template = loader.get_template('schedule.html')
-        context = {
-            'message': 'make an intentional goal',
-            'form': form,
-        }
-        return HttpResponse(template.render(context, request))
+        return _render_schedule_form(request, 'make an intentional goal')
 
     # Scheduling form submitted - act on info.
     elif request.method == "POST":
+        from intention_app.caching import get_localtz
+        from intention_app.plans import commit_plan, make_plan
+        from intention_app.snapshots import make_freebusy_getter
         form = ScheduleForm(request.POST)
         if form.is_valid():
             form_data = _unpack_form_data(request)
-            preferences = User.objects.get(email=request.user.email).preferences
-            credentials = Credentials(**request.session['credentials'])
-            success = schedule(form_data, preferences, credentials)
+            preferences = get_preferences(request.user)
+            credentials = _get_credentials(request)
+            localtz = get_localtz(credentials, request.user.pk, preferences.calendar_id)
+            plan = make_plan(form_data, preferences, credentials, request.user.pk, request.POST.get('plan_token'),
+                             settings.SCHEDULING_SLOT_MINUTES, make_freebusy_getter(request.user.pk), localtz)
+            expired = False
+            if plan is not None and 'preview' not in request.POST:
+                committed = commit_plan(credentials, request.user.pk, plan.token)
+                expired = committed is None
+                plan = committed or plan
             request.session['credentials'] = _credentials_to_dict(credentials)
-            if not success:
-                form = ScheduleForm()
-                template = loader.get_template('schedule.html')
-                context = {
-                    'message': 'Looks like you\'re overbooked! Try again.',
-                    'form': form,
-                }
+            if plan is None:
+                return _render_schedule_form(request, 'Looks like you\'re overbooked! Try again.')
+            elif expired:
+                return _render_schedule_form(request, 'That plan expired, please resubmit it.')
+            elif plan.committed_at is None:
+                template = loader.get_template('schedule_preview.html')
+                template_events = [convert_to_ampm(event['start']['dateTime']) for event in plan.get_events()]
+                context = {'event': form_data, 'event_times': template_events, 'plan_token': plan.token}
                 return HttpResponse(template.render(context, request))
             else:
-                template = loader.get_template('calendar.html')
-                cid = request.user.preferences.calendar_id
-                if cid == 'primary': cid = request.user.email
-                context =  {'event' : form_data, 'calendar_id': cid}
-                return HttpResponse(template.render(context, request))
+                return _render_scheduled_plan(request, plan)
+
+
+@login_required
+@require_POST
+def schedule_commit_view(request):
+    """Writes events of a previewed plan to the user calendar. Committing a plan again has no effect."""
+    if 'credentials' not in request.session:
+        return HttpResponseRedirect('schedule')
+    from intention_app.plans import commit_plan
+    credentials = _get_credentials(request)
+    plan = commit_plan(credentials, request.user.pk, request.POST.get('plan_token', ''))
+    request.session['credentials'] = _credentials_to_dict(credentials)
+    if plan is None: return _render_schedule_form(request, 'That plan expired, please schedule it again.')
+    return _render_scheduled_plan(request, plan)
 
 
 @login_required
@@ -127,7 +175,7 @@ def reschedule_view(request):
 
     # Populate list of rescheduling candidates with events.
     if request.method == "GET":
-        preferences = User.objects.get(email=request.user.email).preferences
+        preferences = get_preferences(request.user)
         ids_and_titles = _get_calendar_events(request, preferences)
         template = loader.get_template('reschedule.html')
         context =  {'events' : ids_and_titles, 'message': 'choose what you would like to reschedule'}
@@ -135,6 +183,8 @@ def reschedule_view(request):
 
     # Rescheduling initiated after events selected by user.
     elif request.method == "POST":
+        from intention_app.scheduling.rescheduler import reschedule
+        from intention_app.snapshots import make_snapshot_events_getter
         if request.POST.get('mydata') == '': # no events selected by user.
             return HttpResponseRedirect('reschedule')
         event_map = request.session['event_map']
@@ -142,35 +192,83 @@ def reschedule_view(request):
         selected_events = [event_map[eid] for eid in event_ids]
         selected_events.sort(key=lambda x: x['start']['dateTime'])
         deadline = request.POST.get('schedule', '')
-        preferences = User.objects.get(email=request.user.email).preferences
-        credentials = Credentials(**request.session['credentials'])
-        success, cid = reschedule(selected_events, deadline, preferences, credentials)
+        preferences = get_preferences(request.user)
+        credentials = _get_credentials(request)
+        success, cid = reschedule(selected_events, deadline, preferences, credentials,
+                                  make_snapshot_events_getter(request.user.pk))
         request.session['credentials'] = _credentials_to_dict(credentials)
         if not success:
             ids_and_titles = _get_calendar_events(request, preferences)
             template = loader.get_template('reschedule.html')
             context = {'events': ids_and_titles, 'message': 'Looks like you\'re overbooked! Try again.'}
             return HttpResponse(template.render(context, request))
-        else:
-            template = loader.get_template('calendar.html')
-            template_events = [(event['summary'], convert_to_ampm(event['start']['dateTime'])) for event in selected_events]
-            context = {'selected_events': template_events, 'calendar_id': cid}
-            return HttpResponse(template.render(context, request))
+        _invalidate_calendars(request.user.pk, preferences.get_calendars())
+        template = loader.get_template('calendar.html')
+        template_events = [(event['summary'], convert_to_ampm(event['start']['dateTime'])) for event in selected_events]
+        context = {'selected_events': template_events, 'calendar_id': cid}
+        return HttpResponse(template.render(context, request))
 
 
 @login_required
 def calendar_view(request):
     """Allows people to view their updated calendar schedule."""
     template = loader.get_template('calendar.html')
-    cid = request.user.preferences.calendar_id
+    cid = get_preferences(request.user).calendar_id
     if cid == 'primary': cid = request.user.email
     context = {'calendar_id': cid}
     return HttpResponse(template.render(context, request))
 
 
+@login_required
+def availability_view(request):
+    """Returns JSON list of the next free slots in user calendar.
+
+    Query parameters are from and to (ISO datetimes, local to the user calendar if naive),
+    duration (minutes), timerange, limit, and format. With format=compact, slots are given
+    as a single array of utc epoch second start times.
+    """
+    if 'credentials' not in request.session:
+        return JsonResponse({'error': 'calendar access not authorized'}, status=401)
+    from intention_app.caching import get_busy_array, get_localtz
+    from intention_app.scheduling.availability import find_free_slots
+    preferences = get_preferences(request.user)
+    credentials = _get_credentials(request)
+    token = credentials.token
+    localtz = get_localtz(credentials, request.user.pk, preferences.calendar_id)
+    try:
+        range_start, range_end, event_length, timerange, max_slots = _unpack_availability_query(request.GET, localtz)
+    except (ValueError, OverflowError) as error:
+        return JsonResponse({'error': str(error)}, status=400)
+    busy_array = get_busy_array(credentials, request.user.pk, range_start, range_end, preferences.get_calendars())
+    slots = find_free_slots(preferences, localtz, busy_array, range_start, range_end, event_length, timerange,
+                            max_slots)
+    # Only write to the session when the access token was refreshed, keeping cached responses fast.
+    if credentials.token != token: request.session['credentials'] = _credentials_to_dict(credentials)
+    if request.GET.get('format') == 'compact':
+        return JsonResponse({
+            'timeZone': localtz.zone,
+            'duration': int(event_length.total_seconds()),
+            'starts': [int(start.timestamp()) for start, end in slots],
+        })
+    return JsonResponse({
+        'timeZone': localtz.zone,
+        'slots': [{'start': start.isoformat(), 'end': end.isoformat()} for start, end in slots],
+    })
+
+
+@csrf_exempt
+@require_POST
+def calendar_webhook(request):
+    """Receives push notifications of changes to watched user calendars from Google."""
+    from intention_app.watching import handle_notification
+    if not handle_notification(request.META): return HttpResponse(status=404)
+    return HttpResponse(status=200)
+
+
 @login_required
 def authorize(request):
     """Authorizes user's google account so that our code can edit their calendar."""
+    from google_auth_oauthlib.flow import InstalledAppFlow
     flow = InstalledAppFlow.from_client_secrets_file(CLIENT_SECRETS_FILE, SCOPES)
     flow.redirect_uri = _build_full_view_url(request, 'oauth2callback')
     authorization_url, state = flow.authorization_url(
@@ -185,6 +283,7 @@ def authorize(request):
 @login_required
 def oauth2callback(request):
     """Authorization callback code, called during oauth callback."""
+    from google_auth_oauthlib.flow import InstalledAppFlow
     state = request.session['state']
     flow = InstalledAppFlow.from_client_secrets_file(CLIENT_SECRETS_FILE, SCOPES, state=state)
     flow.redirect_uri = _build_full_view_url(request, 'oauth2callback')
@@ -200,10 +299,41 @@ def _build_full_view_url(request, view):
     return 'http://' + request.environ['HTTP_HOST'] + reverse(view)
 
 
+def _unpack_availability_query(query, localtz):
+    """Returns range, event length, timerange, and maximum number of slots of availability query.
+
+    Raises ValueError if any query parameter is invalid.
+    """
+    range_start = _parse_query_datetime(query.get('from'), localtz) or datetime.now(localtz)
+    range_end = (_parse_query_datetime(query.get('to'), localtz) or
+                 range_start + timedelta(days=AVAILABILITY_DEFAULT_DAYS))
+    if not range_start < range_end <= range_start + timedelta(days=AVAILABILITY_MAX_DAYS):
+        raise ValueError('to must be after from and within %d days of it' % AVAILABILITY_MAX_DAYS)
+    duration = int(query.get('duration', MINUTES_IN_HOUR))
+    if not 0 < duration <= MINUTES_IN_HOUR * HOURS_IN_DAY: raise ValueError('duration must be between 1 and 1440')
+    timerange = query.get('timerange', 'ANYTIME')
+    if timerange not in dict(TIMERANGE_CHOICES): raise ValueError('unknown timerange %s' % timerange)
+    max_slots = min(int(query.get('limit', AVAILABILITY_DEFAULT_SLOTS)), AVAILABILITY_MAX_SLOTS)
+    if max_slots < 1: raise ValueError('limit must be positive')
+    return range_start, range_end, timedelta(minutes=duration), timerange, max_slots
+
+
+def _parse_query_datetime(value, localtz):
+    """Returns datetime in query parameter value, localized to localtz if naive, or None if not provided."""
+    if not value: return None
+    dt = parse_datetime(value)
+    if dt.tzinfo is None: return localtz.localize(dt)
+    return dt.astimezone(localtz)
+
+
 def _get_calendar_events(request, preferences):
     """Returns list of (event_id, event_name) tuples of calendar events for current day."""
-    credentials = Credentials(**request.session['credentials'])
-    ids_and_titles, event_map = get_events_current_day(credentials, preferences)
+    from intention_app.caching import get_localtz, make_events_getter
+    from intention_app.scheduling.rescheduler import get_events_current_day
+    credentials = _get_credentials(request)
+    localtz = get_localtz(credentials, request.user.pk, preferences.calendar_id)
+    ids_and_titles, event_map = get_events_current_day(credentials, preferences, make_events_getter(request.user.pk),
+                                                       localtz)
     request.session['credentials'] = _credentials_to_dict(credentials)
     request.session['event_map'] = event_map
     return ids_and_titles
@@ -211,12 +341,27 @@ def _get_calendar_events(request, preferences):
 
 def _get_calendar_list(request):
     """Returns list of (cal_id, cal_name) tuples of all user google calendars."""
-    credentials = Credentials(**request.session['credentials'])
+    from intention_app.scheduling.utils.googleapi_utils import get_calendars
+    credentials = _get_credentials(request)
     calendar_list = get_calendars(credentials)
     request.session['credentials'] = _credentials_to_dict(credentials)
     return [(cal['id'], cal['summary']) for cal in calendar_list]
 
 
+def _invalidate_calendars(user_id, calendars):
+    """Discards cached and stored busy times of user calendars, ie after events were written to them."""
+    from intention_app.caching import invalidate_calendars
+    from intention_app.snapshots import invalidate_snapshots
+    invalidate_calendars(user_id, calendars)
+    invalidate_snapshots(user_id, calendars)
+
+
+def _get_credentials(request):
+    """Returns Google credentials stored in the session of request."""
+    from google.oauth2.credentials import Credentials
+    return Credentials(**request.session['credentials'])
+
+
 def _credentials_to_dict(credentials):
     """Helper function that adds sign-in credentials to dictionary."""
     return {'token': credentials.token,
@@ -227,6 +372,27 @@ def _credentials_to_dict(credentials):
             'scopes': credentials.scopes}
 
 
+def _render_schedule_form(request, message):
+    """Returns scheduling page with new scheduleForm, and a new plan token to submit it under."""
+    from intention_app.plans import new_token
+    template = loader.get_template('schedule.html')
+    context = {
+        'message': message,
+        'form': ScheduleForm(),
+        'plan_token': new_token(),
+    }
+    return HttpResponse(template.render(context, request))
+
+
+def _render_scheduled_plan(request, plan):
+    """Returns calendar page showing the events of committed plan."""
+    template = loader.get_template('calendar.html')
+    cid = plan.calendar_id
+    if cid == 'primary': cid = request.user.email
+    context = {'event': plan.get_form(), 'calendar_id': cid}
+    return HttpResponse(template.render(context, request))
+
+
 def _unpack_form_data(request):
     """Helper method that unpacks the data from scheduleForm."""
     return {
@@ -240,39 +406,29 @@ def _unpack_form_data(request):
     }
 
 
-def save_wake_time(request):
-    """Given request, saves user wake time preference to database."""
-    wake_time = request.POST['wake_up_time']
-    HH, MM = wake_time.split(':')
-    wake_hour, wake_min = int(HH), int(MM)
-    w_time = time(hour=wake_hour, minute=wake_min)
-    user = User.objects.get(email=request.user.email)
-    user.preferences.day_start_time = w_time
-    user.save()
-
-
-def save_sleep_time(request):
-    """Given request, saves user sleep time preference to database."""
-    sleep_time = request.POST['sleep_time']
-    HH, MM = sleep_time.split(':')
-    sleep_hour, sleep_min = int(HH), int(MM)
-    s_time = time(hour=sleep_hour, minute=sleep_min)
-    user = User.objects.get(email=request.user.email)
-    user.preferences.day_end_time = s_time
-    user.save()
+def save_day_times(request):
+    """Given request, saves user wake and sleep time preferences to database."""
+    preferences = get_preferences(request.user)
+    preferences.day_start_time = _parse_time(request.POST['wake_up_time'])
+    preferences.day_end_time = _parse_time(request.POST['sleep_time'])
+    preferences.save(update_fields=['day_start_time', 'day_end_time'])
 
 
 def save_calendar(request):
     """Given request, saves user main calendar preference to databsse."""
-    calendar_id = request.POST['calendar']
-    user = User.objects.get(email=request.user.email)
-    user.preferences.calendar_id = calendar_id
-    user.save()
+    preferences = get_preferences(request.user)
+    preferences.calendar_id = request.POST['calendar']
+    preferences.save(update_fields=['calendar_id'])
 
 
 def save_calendars(request):
     """Given request, saves calendars from which to include events to database."""
-    cals = request.POST.getlist('calendars')
-    user = User.objects.get(email = request.user.email)
-    user.preferences.set_calendars(cals)
-    user.save()
+    preferences = get_preferences(request.user)
+    preferences.set_calendars(request.POST.getlist('calendars'))
+    preferences.save(update_fields=['calendars'])
+
+
+def _parse_time(time_str):
+    """Returns time of day in HH:MM string provided."""
+    HH, MM = time_str.split(':')
+    return time(hour=int(HH), minute=int(MM))
@@ -0,0 +1,148 @@
+"""Module to keep cached calendar data fresh with push notifications.
+
+Opens Google Calendar watch channels on the calendars users select, so
+that Google notifies the calendar webhook whenever their events change,
+including edits made outside the app. Each notification invalidates the
+cached and stored busy times of only the affected user calendar.
+
+Channels expire, and are renewed by the renew_watch_channels management
+command with the credentials kept for their user by credentials.py. A
+channel that fails to renew is logged and skipped, and is deleted when its
+credentials or calendar are no longer valid. simulate_notification posts a
+notification to the webhook as Google would, for tests and local development.
+
+Exported Functions
+------------------
+watch_calendars(credentials_dict, user_id, calendars, address)
+renew_channels(address, renew_before=RENEW_BEFORE)
+handle_notification(headers)
+simulate_notification(channel, resource_state='exists', client=None)
+"""
+
+import logging
+import uuid
+from datetime import datetime, timedelta
+from hmac import compare_digest
+from secrets import token_urlsafe
+
+from django.urls import reverse
+from django.utils import timezone
+from google.auth.exceptions import RefreshError
+from google.oauth2.credentials import Credentials
+from googleapiclient.errors import HttpError
+
+from intention_app.caching import invalidate_calendars
+from intention_app.credentials import forget_credentials, load_credentials, store_credentials
+from intention_app.models import WatchChannel
+from intention_app.scheduling.utils.googleapi_utils import stop_channel, watch_events
+from intention_app.snapshots import invalidate_snapshots
+
+CHANNEL_TTL = timedelta(days=7)
+RENEW_BEFORE = timedelta(days=1)
+
+# Resource state of the notification sent when a channel is opened, which reports no change.
+SYNC_STATE = 'sync'
+
+# Statuses of errors opening a channel that will not succeed on a later renewal.
+DEAD_CHANNEL_STATUSES = (401, 403, 404, 410)
+
+logger = logging.getLogger(__name__)
+
+
+def watch_calendars(credentials_dict, user_id, calendars, address):
+    """Watches calendars provided for the user, and stops watching calendars no longer provided.
+
+    Expects credentials as stored in the session, and the public https url of the calendar webhook.
+    Keeps the credentials for renewing the channels, as long as any calendar is watched.
+    """
+    if calendars: store_credentials(user_id, credentials_dict)
+    credentials = Credentials(**credentials_dict)
+    watched = set()
+    for channel in WatchChannel.objects.filter(user_id=user_id):
+        if channel.calendar_id in calendars and channel.expiration > timezone.now(): watched.add(channel.calendar_id)
+        else: _close_channel(channel, credentials)
+    for cid in calendars:
+        if cid not in watched: _open_channel(credentials, user_id, cid, address)
+    if not calendars: forget_credentials(user_id)
+
+
+def renew_channels(address, renew_before=RENEW_BEFORE):
+    """Replaces channels expiring within renew_before with new channels. Returns number of channels renewed."""
+    expiring = WatchChannel.objects.filter(expiration__lt=timezone.now() + renew_before)
+    renewed = 0
+    credentials_by_user = {}
+    for channel in expiring:
+        if channel.user_id not in credentials_by_user:
+            credentials_by_user[channel.user_id] = load_credentials(channel.user_id)
+        try:
+            credentials = credentials_by_user[channel.user_id]
+            if credentials is None: raise RefreshError('No credentials kept')
+            _open_channel(credentials, channel.user_id, channel.calendar_id, address)
+        except (RefreshError, HttpError) as error:
+            dead = isinstance(error, RefreshError) or error.resp.status in DEAD_CHANNEL_STATUSES
+            logger.warning('Failed to renew channel %s of user %s calendar %s%s: %s', channel.channel_id,
+                           channel.user_id, channel.calendar_id, ', deleting it' if dead else '', error)
+            if dead: channel.delete()
+            continue
+        renewed += 1
+        try:
+            _close_channel(channel, credentials)
+        except (RefreshError, HttpError) as error: # Expires on its own.
+            logger.warning('Failed to stop channel %s: %s', channel.channel_id, error)
+            channel.delete()
+    return renewed
+
+
+def handle_notification(headers):
+    """Returns whether or not the notification in request headers belongs to a known channel.
+
+    Invalidates busy times of the channel's calendar for notifications of changes.
+    """
+    channel_id = headers.get('HTTP_X_GOOG_CHANNEL_ID', '')
+    channel = WatchChannel.objects.filter(channel_id=channel_id).first()
+    if channel is None or not compare_digest(channel.token, headers.get('HTTP_X_GOOG_CHANNEL_TOKEN', '')):
+        return False
+    if headers.get('HTTP_X_GOOG_RESOURCE_STATE') != SYNC_STATE:
+        invalidate_calendars(channel.user_id, [channel.calendar_id])
+        invalidate_snapshots(channel.user_id, [channel.calendar_id])
+    return True
+
+
+def simulate_notification(channel, resource_state='exists', client=None):
+    """Posts notification of a change to the calendar of channel to the webhook. Returns the response."""
+    from django.test import Client
+    headers = {
+        'HTTP_X_GOOG_CHANNEL_ID': channel.channel_id,
+        'HTTP_X_GOOG_CHANNEL_TOKEN': channel.token,
+        'HTTP_X_GOOG_CHANNEL_EXPIRATION': channel.expiration.strftime('%a, %d %b %Y %H:%M:%S GMT'),
+        'HTTP_X_GOOG_RESOURCE_ID': channel.resource_id,
+        'HTTP_X_GOOG_RESOURCE_STATE': resource_state,
+        'HTTP_X_GOOG_MESSAGE_NUMBER': '1',
+    }
+    return (client or Client()).post(reverse('calendar_webhook'), **headers)
+
+
+def _open_channel(credentials, user_id, cid, address):
+    """Opens channel watching user calendar and stores it."""
+    channel_id = uuid.uuid4().hex
+    token = token_urlsafe(32)
+    response = watch_events(credentials, cid, channel_id, address, token, int(CHANNEL_TTL.total_seconds()))
+    expiration = timezone.now() + CHANNEL_TTL
+    if response.get('expiration'):
+        expiration = datetime.fromtimestamp(int(response['expiration']) / 1000, timezone.utc)
+    WatchChannel.objects.create(user_id=user_id, calendar_id=cid, channel_id=channel_id,
+                                resource_id=response['resourceId'], token=token, expiration=expiration)
+
+
+def _close_channel(channel, credentials=None):
+    """Stops channel and deletes it.
+
+    Channels that Google no longer knows of, or whose user has no credentials kept, are deleted all the same.
+    """
+    credentials = credentials or load_credentials(channel.user_id)
+    if credentials is not None:
+        try:
+            stop_channel(credentials, channel.channel_id, channel.resource_id)
+        except HttpError as error:
+            if error.resp.status != 404: raise
+    channel.delete()